@@ -0,0 +1,106 @@
+"""Precompute sales forecasts for every Retailer, State and Product.
+
+Run
+
+    python batch_forecast.py [--workers N] [--engine prophet|numpy] [Retailer State Product ...]
+
+after loading new data (e.g. nightly). Each value of each dimension gets its
+own model, fitted on the daily rollup in a separate process, so a full
+refresh uses every core. Prophet is used when it is installed. Results are
+stored in the sales_forecasts table, from which the dashboard serves
+drill-down forecasts without fitting anything.
+"""
+import argparse
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from dataset import data_version
+from db import get_connection
+from forecasting import (
+    BATCH_DIMENSIONS, FORECAST_ENGINES, FORECAST_PERIODS, MIN_HISTORY_DAYS, default_batch_engine, fit_forecast,
+)
+from rollup import aggregate_sales
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def load_histories(dimensions):
+    """Yield (dimension, value, history) with daily ``ds``/``y`` for every value."""
+    for dimension in dimensions:
+        daily = aggregate_sales(["InvoiceDate", dimension])
+        for value, group in daily.groupby(dimension, sort=True):
+            history = group[["InvoiceDate", "TotalSales"]].rename(columns={"InvoiceDate": "ds", "TotalSales": "y"})
+            yield dimension, value, history.reset_index(drop=True)
+
+def fit_series(dimension, value, history, periods, engine):
+    """Worker process: fit one series and return its forecast frame."""
+    _, forecast = fit_forecast(history, periods, engine)
+    return dimension, value, forecast
+
+def store_forecast(conn, dimension, value, forecast, version):
+    """Replace the stored forecast of one (dimension, value) series."""
+    rows = [
+        (dimension, value, ds.strftime("%Y-%m-%d"), yhat, lower, upper, version)
+        for ds, yhat, lower, upper in forecast[["ds", "yhat", "yhat_lower", "yhat_upper"]].itertuples(index=False)
+    ]
+    with conn:
+        conn.execute("DELETE FROM sales_forecasts WHERE Dimension = ? AND Value = ?", (dimension, value))
+        conn.executemany("""
+            INSERT INTO sales_forecasts (Dimension, Value, ds, yhat, yhat_lower, yhat_upper, DataVersion)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+
+def run_batch(dimensions=BATCH_DIMENSIONS, workers=None, periods=FORECAST_PERIODS, engine=None):
+    """Fit and store forecasts for all values of ``dimensions``; return (fitted, failed)."""
+    engine = engine or default_batch_engine()
+    # Read the version first: rows written during the run make the results stale, not current
+    version = data_version()
+    fitted = failed = 0
+
+    conn = get_connection()
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {}
+            for dimension, value, history in load_histories(dimensions):
+                if history["y"].notna().sum() < MIN_HISTORY_DAYS:
+                    logger.warning(f"Skipping {dimension}={value}: fewer than {MIN_HISTORY_DAYS} days of sales")
+                    continue
+                future = executor.submit(fit_series, dimension, value, history, periods, engine)
+                futures[future] = (dimension, value)
+
+            for future in as_completed(futures):
+                dimension, value = futures[future]
+                try:
+                    _, _, forecast = future.result()
+                    store_forecast(conn, dimension, value, forecast, version)
+                    fitted += 1
+                except Exception as e:
+                    logger.error(f"Error forecasting {dimension}={value}: {str(e)}")
+                    failed += 1
+    finally:
+        conn.close()
+
+    logger.info(f"Stored {fitted} {engine} forecasts for data version {version} ({failed} failed)")
+    return fitted, failed
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute drill-down sales forecasts.")
+    parser.add_argument("dimensions", nargs="*", default=BATCH_DIMENSIONS,
+                        help=f"dimensions to forecast, any of {', '.join(BATCH_DIMENSIONS)} (default: all)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="number of worker processes (default: one per core)")
+    parser.add_argument("--periods", type=int, default=FORECAST_PERIODS,
+                        help="days to forecast beyond the last invoice")
+    parser.add_argument("--engine", choices=sorted(FORECAST_ENGINES), default=None,
+                        help="forecast engine (default: prophet if installed, else numpy)")
+    args = parser.parse_args()
+    unknown = [dim for dim in args.dimensions if dim not in BATCH_DIMENSIONS]
+    if unknown:
+        parser.error(f"cannot forecast by {', '.join(unknown)}")
+    _, failed = run_batch(args.dimensions, args.workers, args.periods, args.engine)
+    if failed:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
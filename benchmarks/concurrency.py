@@ -0,0 +1,173 @@
+"""Measure dashboard reads while an Admin keeps writing.
+
+Run from the repository root:
+
+    python -m benchmarks.concurrency [--readers 8] [--seconds 10] [--mode both]
+
+N reader threads run the dashboard's kind of range aggregate over sales_data
+while one writer thread updates single records, each in its own transaction.
+"pooled" uses db.get_connection (per-thread connections, WAL, tuned pragmas);
+"baseline" opens a fresh rollback-journal connection per operation, as the
+pages used to. Both run on a temporary copy of sales_data.db.
+
+``--reruns N`` also runs N short-lived threads one after another, each
+reading once, as Streamlit runs each rerun of a page on a new thread. It
+compares db.get_connection with and without idle connections kept in the
+pool (POOL_SIZE 0 opens a new connection per thread).
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+import db
+from migrate import migrate
+
+READ_QUERY = """
+    SELECT Retailer, SUM(TotalSales), SUM(UnitsSold)
+    FROM sales_data
+    WHERE InvoiceDate >= ? AND InvoiceDate < ?
+    GROUP BY Retailer
+"""
+WRITE_QUERY = "UPDATE sales_data SET UnitsSold = UnitsSold + ? WHERE rowid = ?"
+
+def _pooled(path):
+    db.DB_PATH = path
+    return db.get_connection
+
+def _baseline(path):
+    def connect():
+        return sqlite3.connect(path)
+    return connect
+
+def _prepare(directory, mode):
+    """Copy the database for ``mode`` and return its path."""
+    path = os.path.join(directory, f"{mode}.db")
+    shutil.copy(db.DB_PATH, path)
+    conn = sqlite3.connect(path)
+    try:
+        # Apply pending migrations so both modes see the same schema and triggers
+        migrate(conn)
+        conn.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        conn.close()
+    return path
+
+def run(mode, path, readers, seconds):
+    connect = _pooled(path) if mode == "pooled" else _baseline(path)
+    conn = sqlite3.connect(path)
+    record_ids = [row[0] for row in conn.execute("SELECT rowid FROM sales_data")]
+    days = [row[0] for row in conn.execute("SELECT DISTINCT date(InvoiceDate) FROM sales_data ORDER BY 1")]
+    conn.close()
+
+    stop = threading.Event()
+    latencies, writes, errors = [], [0], [0]
+    lock = threading.Lock()
+
+    def reader():
+        rng = random.Random()
+        local = []
+        while not stop.is_set():
+            start = rng.randrange(len(days) - 30)
+            params = (days[start], days[start + 30])
+            began = time.perf_counter()
+            try:
+                conn = connect()
+                try:
+                    conn.execute(READ_QUERY, params).fetchall()
+                finally:
+                    conn.close()
+                local.append(time.perf_counter() - began)
+            except sqlite3.OperationalError:
+                with lock:
+                    errors[0] += 1
+        with lock:
+            latencies.extend(local)
+
+    def writer():
+        rng = random.Random()
+        while not stop.is_set():
+            try:
+                conn = connect()
+                try:
+                    with conn:
+                        conn.execute(WRITE_QUERY, (rng.choice([-1, 1]), rng.choice(record_ids)))
+                finally:
+                    conn.close()
+                writes[0] += 1
+            except sqlite3.OperationalError:
+                with lock:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=reader) for _ in range(readers)]
+    threads.append(threading.Thread(target=writer))
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    return {
+        "reads/s": len(latencies) / seconds,
+        "p50 ms": statistics.median(latencies) * 1000 if latencies else float("nan"),
+        "p95 ms": latencies[int(len(latencies) * 0.95)] * 1000 if latencies else float("nan"),
+        "max ms": latencies[-1] * 1000 if latencies else float("nan"),
+        "writes/s": writes[0] / seconds,
+        "errors": errors[0],
+    }
+
+def rerun_ms(path, reruns, pool_size):
+    """Return the median time of a thread's first read, with ``pool_size`` idle connections kept."""
+    db.DB_PATH, db.POOL_SIZE = path, pool_size
+    days = [row[0] for row in sqlite3.connect(path).execute(
+        "SELECT DISTINCT date(InvoiceDate) FROM sales_data ORDER BY 1"
+    )]
+    timings = []
+
+    def rerun():
+        began = time.perf_counter()
+        conn = db.get_connection()
+        try:
+            conn.execute(READ_QUERY, (days[0], days[30])).fetchall()
+        finally:
+            conn.close()
+        timings.append(time.perf_counter() - began)
+
+    for _ in range(reruns):
+        thread = threading.Thread(target=rerun)
+        thread.start()
+        thread.join()
+    return statistics.median(timings) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark concurrent readers with one writer.")
+    parser.add_argument("--readers", type=int, default=8, help="reader threads")
+    parser.add_argument("--seconds", type=float, default=10, help="duration of each run")
+    parser.add_argument("--mode", choices=["pooled", "baseline", "both"], default="both")
+    parser.add_argument("--reruns", type=int, default=200, help="short-lived threads for the rerun measurement")
+    args = parser.parse_args()
+
+    modes = ["baseline", "pooled"] if args.mode == "both" else [args.mode]
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in modes:
+            path = _prepare(directory, mode)
+            result = run(mode, path, args.readers, args.seconds)
+            summary = "  ".join(f"{key} {value:,.1f}" for key, value in result.items())
+            print(f"{mode:>8}: {args.readers} readers + 1 writer  {summary}")
+        if args.reruns:
+            path = _prepare(directory, "reruns")
+            pool_size = db.POOL_SIZE
+            fresh = rerun_ms(path, args.reruns, 0)
+            reused = rerun_ms(path, args.reruns, pool_size)
+            print(f"  reruns: first read on a new thread {fresh:.2f} ms with a new connection, "
+                  f"{reused:.2f} ms with a pooled one")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Compare the accuracy and fit time of the forecast engines.
+
+Run from the repository root:
+
+    python -m benchmarks.forecast_engines [--holdout DAYS]
+
+Each engine is fitted on the daily sales in sales_data.db up to the last
+``--holdout`` days, in total and per retailer, and scored on the days held
+out. Engines whose packages are not installed (e.g. prophet) are skipped.
+"""
+import argparse
+import importlib.util
+import time
+
+import pandas as pd
+
+from forecasting import FORECAST_ENGINES, fit_forecast
+from rollup import aggregate_sales
+
+def load_series():
+    """Yield (name, history) daily ``ds``/``y`` series for the total and each retailer."""
+    total = aggregate_sales(["InvoiceDate"])
+    yield "All", total.rename(columns={"InvoiceDate": "ds", "TotalSales": "y"})[["ds", "y"]]
+    daily = aggregate_sales(["InvoiceDate", "Retailer"])
+    for retailer, group in daily.groupby("Retailer", sort=True):
+        history = group.rename(columns={"InvoiceDate": "ds", "TotalSales": "y"})[["ds", "y"]]
+        yield retailer, history.reset_index(drop=True)
+
+def score(engine, history, holdout):
+    """Fit on all but the last ``holdout`` days; return fit seconds and errors on them."""
+    cutoff = history["ds"].max() - pd.Timedelta(days=holdout)
+    train = history[history["ds"] <= cutoff]
+    test = history[history["ds"] > cutoff]
+
+    started = time.perf_counter()
+    _, forecast = fit_forecast(train, holdout, engine)
+    seconds = time.perf_counter() - started
+
+    scored = test.merge(forecast, on="ds", how="inner")
+    errors = scored["yhat"] - scored["y"]
+    nonzero = scored["y"] != 0
+    covered = (scored["y"] >= scored["yhat_lower"]) & (scored["y"] <= scored["yhat_upper"])
+    return {
+        "fit_seconds": seconds,
+        "mae": errors.abs().mean(),
+        "mape": (errors[nonzero].abs() / scored.loc[nonzero, "y"].abs()).mean() * 100,
+        "coverage": covered.mean() * 100,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the forecast engines.")
+    parser.add_argument("--holdout", type=int, default=90, help="days held out for scoring")
+    args = parser.parse_args()
+
+    engines = [name for name in FORECAST_ENGINES if name != "prophet" or importlib.util.find_spec("prophet")]
+    skipped = sorted(set(FORECAST_ENGINES) - set(engines))
+    if skipped:
+        print(f"Skipping engines that are not installed: {', '.join(skipped)}")
+
+    results = []
+    for name, history in load_series():
+        if len(history) <= args.holdout + 1:
+            continue
+        for engine in engines:
+            results.append({"series": name, "engine": engine, **score(engine, history, args.holdout)})
+
+    results = pd.DataFrame(results)
+    pd.set_option("display.width", 120)
+    print(results.round(3).to_string(index=False))
+    print()
+    summary = results.groupby("engine").agg(
+        fit_seconds=("fit_seconds", "mean"),
+        mae=("mae", "mean"),
+        mape=("mape", "mean"),
+        coverage=("coverage", "mean"),
+    )
+    print("Mean over series (MAPE and coverage in %):")
+    print(summary.round(3).to_string())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Measure data grid page reads: keyset pagination against OFFSET and full reads.
+
+Run from the repository root:
+
+    python -m benchmarks.grid_pages [--rows 500000] [--page 2000]
+
+A temporary copy of sales_data.db is grown by ``--rows`` synthetic invoices
+(see benchmarks/ingest.py). For each sort order the first page and page
+``--page`` are read with query_sales_page, the same page is read with LIMIT
+and OFFSET, and the whole table is read into a DataFrame as the grid used to.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+import db
+from benchmarks.ingest import _copy, bulk, make_csv
+from dataset import PAGE_ROWS, SORT_COLUMNS, _SELECT_ROWS, _prepare, query_sales_page
+
+def _ms(fn, repeat=5):
+    """Return the best wall time of ``fn()`` in milliseconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+def key_of_page(sort, page):
+    """Walk to ``page`` (1-based) and return the key it starts after."""
+    after = None
+    for _ in range(page - 1):
+        _, after = query_sales_page(sort=sort, after=after)
+    return after
+
+def offset_page(sort, page):
+    order = "rowid" if sort == "RecordID" else f"{sort}, rowid"
+    conn = db.get_connection()
+    try:
+        conn.execute(
+            f"{_SELECT_ROWS} ORDER BY {order} LIMIT ? OFFSET ?", (PAGE_ROWS, (page - 1) * PAGE_ROWS)
+        ).fetchall()
+    finally:
+        conn.close()
+
+def full_read():
+    conn = db.get_connection()
+    try:
+        return _prepare(pd.read_sql(_SELECT_ROWS, conn))
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark data grid page reads.")
+    parser.add_argument("--rows", type=int, default=500_000, help="synthetic rows added to the table")
+    parser.add_argument("--page", type=int, default=2000, help="deep page to read")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, "drop.csv")
+        make_csv(csv_path, args.rows)
+        bulk(_copy(directory, "grid.db"), csv_path, True)
+        print(f"table of {args.rows:,}+ rows, {PAGE_ROWS} rows per page")
+        for sort in SORT_COLUMNS:
+            after = key_of_page(sort, args.page)
+            first = _ms(lambda: query_sales_page(sort=sort))
+            deep = _ms(lambda: query_sales_page(sort=sort, after=after))
+            offset = _ms(lambda: offset_page(sort, args.page))
+            print(f"  {sort:>11}: first page {first:.1f} ms, page {args.page:,} {deep:.1f} ms "
+                  f"(OFFSET {offset:.1f} ms)")
+        print(f"  full read of the table: {_ms(full_read, repeat=1):,.0f} ms")
+
+if __name__ == "__main__":
+    main()
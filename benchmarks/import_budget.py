@@ -0,0 +1,105 @@
+"""Check that the login screen stays cheap to import.
+
+Run from the repository root:
+
+    python -m benchmarks.import_budget [--module final] [--budget-ms N] [--runs 3]
+
+The module is imported in a fresh interpreter and the check fails (exit
+status 1) if that loads any of HEAVY_MODULES that a bare ``import streamlit``
+does not load already (streamlit itself imports plotly.graph_objects and
+PIL, but not plotly.express or PIL.Image). tests/test_import_budget.py runs
+the same check as part of ``python -m pytest``.
+
+With ``-X importtime`` the script also reports how long the modules the
+page adds to a bare ``import streamlit`` take to import. streamlit's own
+modules, including the ones it loads lazily while the page runs (e.g.
+streamlit.emojis for page_icon), and the page module's body are left out,
+as they are paid whatever the page imports. Pass ``--budget-ms`` to fail
+when that time exceeds a budget; it varies between runs, so leave generous
+headroom.
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+# Libraries (or parts of them) that only the dashboard, forecasts and
+# exports need, and the modules of this repository that import them
+HEAVY_MODULES = [
+    "pandas", "numpy", "plotly.express", "PIL.Image", "prophet", "pydeck", "xlsxwriter", "openpyxl", "pyarrow",
+    "dataset", "rollup", "query_cache", "charts", "derive", "ingest", "data_management",
+    "forecasting", "batch_forecast", "exports", "reports", "report_cache", "report_jobs",
+    "report_generation", "scheduler",
+]
+
+def loaded_modules(module):
+    """Return the names in sys.modules after importing ``module`` in a fresh interpreter."""
+    result = subprocess.run(
+        [sys.executable, "-c", f"import json, sys, {module}; print(json.dumps(sorted(sys.modules)))"],
+        capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"'import {module}' failed:\n{result.stderr}")
+    return set(json.loads(result.stdout.splitlines()[-1]))
+
+def _heavy(names):
+    return {heavy for heavy in HEAVY_MODULES for name in names if name == heavy or name.startswith(heavy + ".")}
+
+def heavy_imports(module):
+    """Return the HEAVY_MODULES that importing ``module`` loads on top of streamlit."""
+    return sorted(_heavy(loaded_modules(module)) - _heavy(loaded_modules("streamlit")))
+
+def import_times(statement):
+    """Return {module: self time in microseconds} for a fresh ``statement``."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"'{statement}' failed:\n{result.stderr}")
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(self_us)
+    return times
+
+def measure(module, runs):
+    """Return the modules ``module`` adds to streamlit's and their best total time in ms."""
+    baseline = set(import_times("import streamlit"))
+    best_ms, added = None, set()
+    for _ in range(runs):
+        times = import_times(f"import {module}")
+        added = {
+            name for name in set(times) - baseline
+            if name != module and name.split(".")[0] != "streamlit"
+        }
+        total_ms = sum(times[name] for name in added) / 1000
+        best_ms = total_ms if best_ms is None else min(best_ms, total_ms)
+    return added, best_ms
+
+def main():
+    parser = argparse.ArgumentParser(description="Enforce an import budget for a page module.")
+    parser.add_argument("--module", default="final", help="module to import (default: final)")
+    parser.add_argument("--budget-ms", type=float, help="allowed import time of the modules the page adds")
+    parser.add_argument("--runs", type=int, default=3, help="imports to time; the fastest counts")
+    args = parser.parse_args()
+
+    failed = False
+    heavy = heavy_imports(args.module)
+    if heavy:
+        print(f"FAIL: imports heavy dependencies at startup: {', '.join(heavy)}")
+        failed = True
+
+    added, total_ms = measure(args.module, args.runs)
+    print(f"import {args.module}: {len(added)} modules besides streamlit's, {total_ms:.1f} ms")
+    if args.budget_ms is not None and total_ms > args.budget_ms:
+        print(f"FAIL: import time exceeds the budget of {args.budget_ms:.0f} ms by {total_ms - args.budget_ms:.1f} ms")
+        failed = True
+    if failed:
+        raise SystemExit(1)
+    print("OK")
+
+if __name__ == "__main__":
+    main()
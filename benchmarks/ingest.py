@@ -0,0 +1,98 @@
+"""Measure bulk loading with ingest.py against row-by-row inserts.
+
+Run from the repository root:
+
+    python -m benchmarks.ingest [--rows 500000] [--baseline-rows 2000]
+
+Synthetic CSV rows are generated from sales_data in the format of the
+original retailer files ("Invoice Date" 1/31/2021, "$50.00", "30%") and
+loaded into a temporary copy of sales_data.db, once with deferred indexes
+and once keeping them. The baseline inserts rows one at a time, each in its
+own transaction, as the Add New Record form does, and is extrapolated.
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import db
+from dataset import SALES_COLUMNS
+from migrate import migrate
+
+def make_csv(path, rows, seed=0):
+    """Write ``rows`` synthetic invoices to ``path`` in the retailers' CSV layout."""
+    conn = sqlite3.connect(db.DB_PATH)
+    sample = pd.read_sql_query(f"SELECT {', '.join(SALES_COLUMNS)} FROM sales_data", conn)
+    conn.close()
+    rng = np.random.default_rng(seed)
+    df = sample.iloc[rng.integers(0, len(sample), rows)].reset_index(drop=True)
+    dates = pd.to_datetime(df["InvoiceDate"]) + pd.to_timedelta(rng.integers(0, 365, rows), unit="D")
+    out = pd.DataFrame({
+        "Retailer": df["Retailer"],
+        "Retailer ID": df["RetailerID"],
+        "Invoice Date": dates.dt.strftime("%-m/%-d/%Y"),
+        "Region": df["Region"],
+        "State": df["State"],
+        "City": df["City"],
+        "Product": df["Product"],
+        "Price per Unit": df["PriceperUnit"].map("${:,.2f}".format),
+        "Units Sold": df["UnitsSold"],
+        "Total Sales": df["TotalSales"].map("${:,.2f}".format),
+        "Operating Profit": df["OperatingProfit"].map("${:,.2f}".format),
+        "Operating Margin": (df["OperatingMargin"] * 100).map("{:.0f}%".format),
+        "Sales Method": df["SalesMethod"],
+    })
+    out.to_csv(path, index=False)
+
+def _copy(directory, name):
+    path = os.path.join(directory, name)
+    shutil.copy(db.DB_PATH, path)
+    conn = sqlite3.connect(path)
+    migrate(conn)
+    conn.close()
+    return path
+
+def bulk(path, csv_path, defer_indexes):
+    import ingest
+
+    db.DB_PATH = path
+    success, message = ingest.ingest([csv_path], defer_indexes=defer_indexes)
+    if not success:
+        raise RuntimeError(message)
+    return message
+
+def row_by_row(path, csv_path, rows):
+    """Insert ``rows`` rows one transaction at a time; return rows per second."""
+    from ingest import _INSERT, _records, coerce_chunk, read_chunks
+
+    db.DB_PATH = path
+    records = _records(coerce_chunk(next(read_chunks(csv_path, rows)))[0])
+    conn = db.get_connection()
+    started = time.perf_counter()
+    for record in records:
+        with conn:
+            conn.execute(_INSERT, record)
+    return len(records) / (time.perf_counter() - started)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bulk CSV ingestion.")
+    parser.add_argument("--rows", type=int, default=500_000, help="rows in the generated CSV")
+    parser.add_argument("--baseline-rows", type=int, default=2000, help="rows inserted one by one")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, "drop.csv")
+        make_csv(csv_path, args.rows)
+        print(f"generated {args.rows:,} rows, {os.path.getsize(csv_path) / 1024 ** 2:.1f} MiB of CSV")
+        print(f"  deferred indexes: {bulk(_copy(directory, 'deferred.db'), csv_path, True)}")
+        print(f"      kept indexes: {bulk(_copy(directory, 'kept.db'), csv_path, False)}")
+        rate = row_by_row(_copy(directory, 'baseline.db'), csv_path, args.baseline_rows)
+        print(f"        row by row: {rate:,.0f} rows/s, i.e. {args.rows / rate:,.0f}s for {args.rows:,} rows")
+
+if __name__ == "__main__":
+    main()
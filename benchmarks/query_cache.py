@@ -0,0 +1,80 @@
+"""Measure the dashboard's aggregates with and without the query result cache.
+
+Run from the repository root:
+
+    python -m benchmarks.query_cache [--sessions 20] [--reruns 5]
+
+Each session is a thread that renders the default dashboard view (the
+aggregate_sales calls of final.show_dashboard) ``--reruns`` times, all
+sessions at once. The uncached run calls the rollup queries directly. After
+that one record is updated and the cached run repeated, which recomputes
+each aggregate once for the new data version. Runs on a temporary copy of
+sales_data.db.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import db
+import query_cache
+import rollup
+from dataset import get_filter_options
+
+# (group_by, filtered) of each aggregate on the dashboard
+DASHBOARD_QUERIES = [
+    ((), True), (("Retailer",), True), (("Month",), True),
+    (("State",), True), (("Region", "City"), False), (("Retailer",), True),
+]
+
+def render(aggregate, filters):
+    for group_by, filtered in DASHBOARD_QUERIES:
+        aggregate(group_by, filters if filtered else None)
+
+def run(aggregate, filters, sessions, reruns):
+    """Render from ``sessions`` threads at once; return the wall time in seconds."""
+    barrier = threading.Barrier(sessions)
+
+    def session():
+        barrier.wait()
+        for _ in range(reruns):
+            render(aggregate, filters)
+
+    threads = [threading.Thread(target=session) for _ in range(sessions)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the dashboard query cache.")
+    parser.add_argument("--sessions", type=int, default=20, help="concurrent sessions")
+    parser.add_argument("--reruns", type=int, default=5, help="dashboard reruns per session")
+    args = parser.parse_args()
+    renders = args.sessions * args.reruns
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "cache.db")
+        shutil.copy(db.DB_PATH, path)
+        db.DB_PATH = path
+        options = get_filter_options()
+        filters = {"start_date": options["min_date"], "end_date": options["max_date"]}
+
+        elapsed = run(rollup._aggregate_sales, filters, args.sessions, args.reruns)
+        print(f"{renders} renders, {len(DASHBOARD_QUERIES)} aggregates each")
+        print(f"  uncached: {elapsed * 1000:,.0f} ms, {len(DASHBOARD_QUERIES) * renders} computations")
+        elapsed = run(rollup.aggregate_sales, filters, args.sessions, args.reruns)
+        print(f"    cached: {elapsed * 1000:,.0f} ms, {query_cache.stats()}")
+
+        conn = db.get_connection()
+        with conn:
+            conn.execute("UPDATE sales_data SET UnitsSold = UnitsSold + 1 WHERE rowid = (SELECT MIN(rowid) FROM sales_data)")
+        elapsed = run(rollup.aggregate_sales, filters, args.sessions, args.reruns)
+        print(f"  after a write: {elapsed * 1000:,.0f} ms, {query_cache.stats()}")
+
+if __name__ == "__main__":
+    main()
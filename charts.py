@@ -0,0 +1,45 @@
+"""Helpers that keep Plotly figures small before they are sent to the browser.
+
+Plotly serializes every point of every trace into the page, so charts should be
+built from data that is already collapsed to one row per mark.
+"""
+import logging
+
+import streamlit as st
+
+logger = logging.getLogger(__name__)
+
+# Figures carrying more points than this are almost always plotting raw rows
+MAX_CHART_POINTS = 5000
+
+# Trace attributes that hold one entry per plotted point
+_POINT_ATTRIBUTES = ["x", "y", "values", "labels", "lat", "lon"]
+
+def collapse(df, keys, values, agg="sum"):
+    """Aggregate ``df`` to one row per distinct ``keys`` before plotting.
+
+    Frames that already have one row per key are returned unchanged.
+    """
+    keys = [keys] if isinstance(keys, str) else list(keys)
+    values = [values] if isinstance(values, str) else list(values)
+    if not df.duplicated(subset=keys).any():
+        return df
+    return df.groupby(keys, observed=True, sort=False)[values].agg(agg).reset_index()
+
+def count_points(fig):
+    """Return the number of data points a figure will serialize."""
+    total = 0
+    for trace in fig.data:
+        trace_json = trace.to_plotly_json()
+        total += max((len(trace_json[attr]) for attr in _POINT_ATTRIBUTES
+                      if trace_json.get(attr) is not None), default=0)
+    return total
+
+def show_chart(fig, max_points=MAX_CHART_POINTS):
+    """Render a figure, warning when it carries more than ``max_points`` points."""
+    points = count_points(fig)
+    if points > max_points:
+        title = fig.layout.title.text or "Untitled chart"
+        logger.warning(f"{title} carries {points:,} points (limit {max_points:,}); aggregate before plotting")
+        st.warning(f"'{title}' has {points:,} data points; consider narrowing the filters.")
+    st.plotly_chart(fig, use_container_width=True)
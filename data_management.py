@@ -1,12 +1,22 @@
 import streamlit as st
 import pandas as pd
-import sqlite3
-from datetime import datetime
+from datetime import date
 import plotly.express as px
 import plotly.graph_objects as go
+import json
 import logging
 import time
 
+from charts import show_chart
+from db import get_connection
+from dataset import (
+    PAGE_ROWS, SALES_COLUMNS, SORT_COLUMNS, filter_signature, get_filter_options, query_sales_page,
+    search_records,
+)
+from derive import DERIVED_COLUMNS, derive, derive_record, derive_updates
+from ingest import ingest
+from rollup import aggregate_sales
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -48,24 +58,14 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-def get_connection():
-    """Create a connection to the SQLite database."""
-    return sqlite3.connect("sales_data.db")
-
-def fetch_data():
-    """Fetch all data from the sales_data table."""
-    with get_connection() as conn:
-        query = "SELECT * FROM sales_data"
-        df = pd.read_sql(query, conn)
-        df["InvoiceDate"] = pd.to_datetime(df["InvoiceDate"], format='mixed')
-        return df
-
 def get_column_names():
     """Get the column names from the database."""
     with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("SELECT * FROM sales_data LIMIT 1")
-        return [description[0] for description in cursor.description]
+        # Skip the key and derived columns added by migrate.py
+        return [description[0] for description in cursor.description
+                if description[0] not in ("RecordID", "InvoiceDay")]
 
 def add_record(data):
     """Add a new record to the database with validation."""
@@ -75,6 +75,7 @@ def add_record(data):
         missing_fields = [field for field in required_fields if field not in data]
         if missing_fields:
             return False, f"Missing required fields: {', '.join(missing_fields)}"
+        data = derive_record(data)
 
         with get_connection() as conn:
             cursor = conn.cursor()
@@ -98,8 +99,8 @@ def add_record(data):
             values = []
             for field in available_fields:
                 value = data[field]
-                if isinstance(value, pd.Timestamp) or isinstance(value, datetime):
-                    value = value.strftime('%Y-%m-%d %H:%M:%S')
+                if isinstance(value, (pd.Timestamp, date)):
+                    value = pd.Timestamp(value).strftime('%Y-%m-%d %H:%M:%S')
                 values.append(value)
             
             # Execute the insert
@@ -113,8 +114,8 @@ def add_record(data):
         logger.error(f"Error adding record: {str(e)}")
         return False, f"Error adding record: {str(e)}"
 
-def update_record(record_index, data):
-    """Update an existing record with validation."""
+def update_record(record_id, data):
+    """Update the record with the given RecordID."""
     try:
         # Validate required fields
         required_fields = ["Retailer", "RetailerID", "InvoiceDate", "Product"]
@@ -132,6 +133,9 @@ def update_record(record_index, data):
                 "OperatingProfit", "OperatingMargin", "SalesMethod"
             ]
             
+            # Recompute the derived fields the changes make stale
+            data = derive_updates(conn, {int(record_id): data})[int(record_id)]
+
             # Create SET clause for the update
             available_fields = [field for field in columns if field in data]
             set_clause = ", ".join([f"{field} = ?" for field in available_fields])
@@ -140,100 +144,157 @@ def update_record(record_index, data):
             values = []
             for field in available_fields:
                 value = data[field]
-                if isinstance(value, pd.Timestamp) or isinstance(value, datetime):
-                    value = value.strftime('%Y-%m-%d %H:%M:%S')
+                if isinstance(value, (pd.Timestamp, date)):
+                    value = pd.Timestamp(value).strftime('%Y-%m-%d %H:%M:%S')
                 values.append(value)
             
-            # Get the record we want to update
-            df = fetch_data()
-            if record_index >= len(df):
-                return False, "Invalid record index"
-            
-            record = df.iloc[record_index]
-            
-            # Create WHERE clause using RetailerID, InvoiceDate, and Product for unique identification
-            where_clause = "RetailerID = ? AND date(InvoiceDate) = date(?) AND Product = ?"
-            where_values = [
-                int(record["RetailerID"]),  # Ensure RetailerID is an integer
-                record["InvoiceDate"].strftime('%Y-%m-%d'),  # Only compare the date part
-                record["Product"]
-            ]
-            
-            # Combine all values
-            all_values = values + where_values
-            
-            query = f"UPDATE sales_data SET {set_clause} WHERE {where_clause}"
+            # Target the row by its key (rowid lookup, no table scan)
+            query = f"UPDATE sales_data SET {set_clause} WHERE rowid = ?"
+            all_values = values + [int(record_id)]
             
             # Log the query and values for debugging
             logger.info(f"Update query: {query}")
             logger.info(f"Update values: {all_values}")
             
-            # First verify if the record exists
-            verify_query = "SELECT COUNT(*) FROM sales_data WHERE RetailerID = ? AND date(InvoiceDate) = date(?) AND Product = ?"
-            cursor.execute(verify_query, where_values)
-            count = cursor.fetchone()[0]
-            
-            if count == 0:
-                return False, "Record not found in database. It may have been deleted."
-            
-            # Execute the update
             cursor.execute(query, all_values)
             
             if cursor.rowcount == 0:
-                return False, "No changes were made. The new values might be the same as the existing ones."
+                return False, "Record not found in database. It may have been deleted."
             
             conn.commit()
-            logger.info(f"Successfully updated record at index {record_index}")
+            logger.info(f"Successfully updated record {record_id}")
             return True, "Record updated successfully!"
             
     except Exception as e:
         logger.error(f"Error updating record: {str(e)}")
         return False, f"Error updating record: {str(e)}"
 
-def delete_record(record_index):
-    """Delete a record from the database."""
+def delete_record(record_id):
+    """Delete the record with the given RecordID."""
     try:
         with get_connection() as conn:
             cursor = conn.cursor()
             
-            # Get the record we want to delete
-            df = fetch_data()
-            if record_index >= len(df):
-                return False, "Invalid record index"
-            
-            record = df.iloc[record_index]
-            
-            # Create WHERE clause using RetailerID, InvoiceDate, and Product for unique identification
-            where_clause = "RetailerID = ? AND date(InvoiceDate) = date(?) AND Product = ?"
-            where_values = [
-                int(record["RetailerID"]),  # Ensure RetailerID is an integer
-                record["InvoiceDate"].strftime('%Y-%m-%d'),  # Only compare the date part
-                record["Product"]
-            ]
-            
-            # First verify if the record exists
-            verify_query = "SELECT COUNT(*) FROM sales_data WHERE RetailerID = ? AND date(InvoiceDate) = date(?) AND Product = ?"
-            cursor.execute(verify_query, where_values)
-            count = cursor.fetchone()[0]
-            
-            if count == 0:
-                return False, "Record not found in database. It may have been deleted."
-            
-            # Execute the delete
-            query = f"DELETE FROM sales_data WHERE {where_clause}"
-            cursor.execute(query, where_values)
+            # Target the row by its key (rowid lookup, no table scan)
+            cursor.execute("DELETE FROM sales_data WHERE rowid = ?", [int(record_id)])
             
             if cursor.rowcount == 0:
-                return False, "No record was deleted. Please try again."
+                return False, "Record not found in database. It may have been deleted."
             
             conn.commit()
-            logger.info(f"Successfully deleted record at index {record_index}")
+            logger.info(f"Successfully deleted record {record_id}")
             return True, "Record deleted successfully!"
             
     except Exception as e:
         logger.error(f"Error deleting record: {str(e)}")
         return False, f"Error deleting record: {str(e)}"
 
+REQUIRED_FIELDS = ["Retailer", "RetailerID", "InvoiceDate", "Product"]
+
+def _sql_value(field, value):
+    """Convert a value from the data editor to what SQLite stores for ``field``."""
+    if value is None or (isinstance(value, float) and value != value) or value is pd.NaT:
+        return None
+    if field == "InvoiceDate" or isinstance(value, (pd.Timestamp, date)):
+        return pd.Timestamp(value).strftime('%Y-%m-%d %H:%M:%S')
+    if hasattr(value, "item"):
+        # numpy scalar
+        return value.item()
+    return value
+
+def _missing_fields(values):
+    return [field for field in REQUIRED_FIELDS if field in values and values[field] in (None, "")]
+
+def save_grid_changes(original_df, editor_state):
+    """Apply all changes made in the data editor in one transaction.
+
+    ``original_df`` is the frame shown in the editor, indexed by RecordID, and
+    ``editor_state`` its session state: ``edited_rows`` maps row positions to
+    changed values, ``added_rows`` lists new rows and ``deleted_rows`` lists
+    removed positions. Updates, inserts and deletes are written with one
+    executemany each (updates grouped by the columns they change). Returns a
+    list of (row label, success, message), one per changed row.
+    """
+    results = []
+    deleted_positions = {int(position) for position in editor_state.get("deleted_rows", [])}
+    deletes = [int(original_df.index[position]) for position in sorted(deleted_positions)]
+
+    updates = {}   # RecordID -> {column: value}
+    for position, changes in editor_state.get("edited_rows", {}).items():
+        position = int(position)
+        if position in deleted_positions:
+            continue
+        record_id = int(original_df.index[position])
+        values = {field: _sql_value(field, value) for field, value in changes.items() if field in SALES_COLUMNS}
+        missing = _missing_fields(values)
+        if missing:
+            results.append((f"Record {record_id}", False, f"Missing required fields: {', '.join(missing)}"))
+        elif values:
+            updates[record_id] = values
+
+    inserts = []
+    for number, row in enumerate(editor_state.get("added_rows", []), start=1):
+        values = {field: _sql_value(field, row.get(field)) for field in SALES_COLUMNS}
+        missing = _missing_fields(values)
+        if missing:
+            results.append((f"New row {number}", False, f"Missing required fields: {', '.join(missing)}"))
+        else:
+            inserts.append(values)
+
+    if inserts:
+        derived = derive(pd.DataFrame(inserts, columns=SALES_COLUMNS))[DERIVED_COLUMNS]
+        for values, row in zip(inserts, derived.to_dict("records")):
+            values.update({field: None if pd.isna(value) else value for field, value in row.items()})
+
+    if not (updates or inserts or deletes):
+        return results
+
+    conn = get_connection()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        keys = list(updates) + deletes
+        existing = {row[0] for row in conn.execute(
+            "SELECT rowid FROM sales_data WHERE rowid IN (SELECT value FROM json_each(?))", (json.dumps(keys),)
+        )}
+        for record_id in [key for key in keys if key not in existing]:
+            results.append((f"Record {record_id}", False, "Record not found in database. It may have been deleted."))
+        updates = {record_id: values for record_id, values in updates.items() if record_id in existing}
+        deletes = [record_id for record_id in deletes if record_id in existing]
+        updates = derive_updates(conn, updates)
+
+        # Rows changing the same columns share one statement
+        groups = {}
+        for record_id, values in updates.items():
+            groups.setdefault(tuple(values), []).append(list(values.values()) + [record_id])
+        for fields, params in groups.items():
+            set_clause = ", ".join(f"{field} = ?" for field in fields)
+            conn.executemany(f"UPDATE sales_data SET {set_clause} WHERE rowid = ?", params)
+
+        last_record_id = conn.execute("SELECT COALESCE(MAX(RecordID), 0) FROM sales_data").fetchone()[0]
+        conn.executemany(
+            f"INSERT INTO sales_data ({', '.join(SALES_COLUMNS)}) VALUES ({', '.join('?' for _ in SALES_COLUMNS)})",
+            [list(values.values()) for values in inserts],
+        )
+        # The write lock is held, so the new rows are the ones above the old maximum
+        new_ids = [row[0] for row in conn.execute(
+            "SELECT RecordID FROM sales_data WHERE RecordID > ? ORDER BY RecordID", (last_record_id,)
+        )]
+
+        conn.executemany("DELETE FROM sales_data WHERE rowid = ?", [(record_id,) for record_id in deletes])
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Error saving changes: {str(e)}")
+        return results + [("All changes", False, f"Error saving changes, nothing was saved: {str(e)}")]
+    finally:
+        conn.close()
+
+    results += [(f"Record {record_id}", True, "Record updated") for record_id in updates]
+    results += [(f"Record {record_id}", True, "Record added") for record_id in new_ids]
+    results += [(f"Record {record_id}", True, "Record deleted") for record_id in deletes]
+    logger.info(f"Saved {len(updates)} updates, {len(new_ids)} inserts and {len(deletes)} deletes")
+    return results
+
 def manage_data():
     """Main function to manage data in the Streamlit app."""
     # Add custom CSS
@@ -318,12 +379,12 @@ def manage_data():
     # Sidebar filters
     st.sidebar.title("Filters")
     
-    # Get data
-    df = fetch_data()
+    # Filter choices come from a small cached summary, not the full table
+    options = get_filter_options()
     
     # Date range filter
-    min_date = pd.to_datetime(df['InvoiceDate']).min()
-    max_date = pd.to_datetime(df['InvoiceDate']).max()
+    min_date = options['min_date']
+    max_date = options['max_date']
     date_range = st.sidebar.date_input(
         "Date Range",
         value=(min_date, max_date),
@@ -332,34 +393,28 @@ def manage_data():
     )
 
     # Retailer filter
-    retailers = sorted(df['Retailer'].unique())
+    retailers = options['Retailer']
     selected_retailers = st.sidebar.multiselect("Retailer", retailers)
 
     # Region filter
-    regions = sorted(df['Region'].unique())
+    regions = options['Region']
     selected_regions = st.sidebar.multiselect("Region", regions)
 
     # Product filter
-    products = sorted(df['Product'].unique())
+    products = options['Product']
     selected_products = st.sidebar.multiselect("Product", products)
 
-    # Apply filters
-    filtered_df = df.copy()
-    
+    # Apply filters in SQLite
+    filters = {
+        'Retailer': selected_retailers,
+        'Region': selected_regions,
+        'Product': selected_products,
+    }
     if len(date_range) == 2:
-        filtered_df = filtered_df[
-            (pd.to_datetime(filtered_df['InvoiceDate']).dt.date >= date_range[0]) &
-            (pd.to_datetime(filtered_df['InvoiceDate']).dt.date <= date_range[1])
-        ]
-    
-    if selected_retailers:
-        filtered_df = filtered_df[filtered_df['Retailer'].isin(selected_retailers)]
-    
-    if selected_regions:
-        filtered_df = filtered_df[filtered_df['Region'].isin(selected_regions)]
-    
-    if selected_products:
-        filtered_df = filtered_df[filtered_df['Product'].isin(selected_products)]
+        filters['start_date'], filters['end_date'] = date_range
+
+    # Metrics and charts come from the daily rollup, not the raw rows
+    totals = aggregate_sales(filters=filters).iloc[0].fillna(0)
 
     # Display metrics
     col1, col2, col3, col4 = st.columns(4)
@@ -370,7 +425,7 @@ def manage_data():
                 <h3>Total Records</h3>
                 <h2>{:,}</h2>
             </div>
-        """.format(len(filtered_df)), unsafe_allow_html=True)
+        """.format(int(totals['Transactions'])), unsafe_allow_html=True)
     
     with col2:
         st.markdown("""
@@ -378,7 +433,7 @@ def manage_data():
                 <h3>Total Sales</h3>
                 <h2>${:,.2f}</h2>
             </div>
-        """.format(filtered_df['TotalSales'].sum()), unsafe_allow_html=True)
+        """.format(totals['TotalSales']), unsafe_allow_html=True)
     
     with col3:
         st.markdown("""
@@ -386,7 +441,7 @@ def manage_data():
                 <h3>Units Sold</h3>
                 <h2>{:,}</h2>
             </div>
-        """.format(filtered_df['UnitsSold'].sum()), unsafe_allow_html=True)
+        """.format(int(totals['UnitsSold'])), unsafe_allow_html=True)
     
     with col4:
         st.markdown("""
@@ -394,7 +449,7 @@ def manage_data():
                 <h3>Operating Profit</h3>
                 <h2>${:,.2f}</h2>
             </div>
-        """.format(filtered_df['OperatingProfit'].sum()), unsafe_allow_html=True)
+        """.format(totals['OperatingProfit']), unsafe_allow_html=True)
 
     # Data visualization options
     st.subheader("Data Visualization")
@@ -404,45 +459,71 @@ def manage_data():
     )
 
     if viz_option == "Sales Trend":
-        daily_sales = filtered_df.groupby(pd.to_datetime(filtered_df['InvoiceDate']).dt.date)['TotalSales'].sum().reset_index()
+        daily_sales = aggregate_sales(["InvoiceDate"], filters)
         fig = px.line(daily_sales, x='InvoiceDate', y='TotalSales', title='Daily Sales Trend')
-        st.plotly_chart(fig, use_container_width=True)
+        show_chart(fig)
     
     elif viz_option == "Regional Distribution":
-        regional_sales = filtered_df.groupby('Region')['TotalSales'].sum().reset_index()
+        regional_sales = aggregate_sales(["Region"], filters)
         fig = px.pie(regional_sales, values='TotalSales', names='Region', title='Sales by Region')
-        st.plotly_chart(fig, use_container_width=True)
+        show_chart(fig)
     
     else:  # Product Performance
-        product_performance = filtered_df.groupby('Product').agg({
-            'TotalSales': 'sum',
-            'UnitsSold': 'sum',
-            'OperatingProfit': 'sum'
-        }).reset_index()
+        product_performance = aggregate_sales(["Product"], filters)
         fig = px.bar(product_performance, x='Product', y='TotalSales', title='Product Sales Performance')
-        st.plotly_chart(fig, use_container_width=True)
+        show_chart(fig)
+
+    # Editable data grid, one page at a time
+    sort_col1, sort_col2 = st.columns(2)
+    sort = sort_col1.selectbox("Sort by", SORT_COLUMNS, key="grid_sort")
+    descending = sort_col2.toggle("Descending", key="grid_descending")
+
+    # Keys of the pages visited so far; a new selection starts again at page 1
+    grid_signature = json.dumps([filter_signature(filters), sort, descending])
+    if st.session_state.get("grid_signature") != grid_signature:
+        st.session_state["grid_signature"] = grid_signature
+        st.session_state["grid_pages"] = [None]
+    pages = st.session_state["grid_pages"]
+    page_df, next_after = query_sales_page(filters, sort, descending, after=pages[-1])
 
-    # Show editable data table
-    edited_df = st.data_editor(
-        filtered_df,
+    # A key per page and save, so edits are neither replayed on another page
+    # nor saved twice
+    editor_key = f"editable_data_{hash((grid_signature, len(pages), st.session_state.get('grid_saves', 0)))}"
+    st.data_editor(
+        page_df,
         hide_index=True,
         use_container_width=True,
         num_rows="dynamic",
-        key="editable_data"
+        key=editor_key
     )
 
+    nav_col1, nav_col2, nav_col3 = st.columns([1, 2, 1])
+    if nav_col1.button("⬅️ Previous", disabled=len(pages) == 1):
+        pages.pop()
+        st.rerun()
+    first_row = (len(pages) - 1) * PAGE_ROWS
+    nav_col2.caption(
+        f"Page {len(pages)}: rows {first_row + 1:,}–{first_row + len(page_df):,} "
+        f"of {int(totals['Transactions']):,}"
+    )
+    if nav_col3.button("Next ➡️", disabled=next_after is None):
+        pages.append(next_after)
+        st.rerun()
+
     # Save changes button
     if st.button("Save Changes"):
-        changes = edited_df.compare(filtered_df)
-        if not changes.empty:
-            for idx in changes.index:
-                row_data = edited_df.loc[idx].to_dict()
-                success, message = update_record(idx, row_data)
-                if success:
-                    st.success(f"Record at index {idx} updated.")
-                else:
-                    st.error(message)
-            st.rerun()
+        results = save_grid_changes(page_df, st.session_state[editor_key])
+        if results:
+            failed = [(label, message) for label, success, message in results if not success]
+            saved = len(results) - len(failed)
+            if saved:
+                # The changes are committed; start the next edit from a fresh editor
+                st.session_state["grid_saves"] = st.session_state.get("grid_saves", 0) + 1
+                st.success(f"Saved {saved} changed rows.")
+            for label, message in failed:
+                st.error(f"{label}: {message}")
+            if not failed:
+                st.rerun()
         else:
             st.info("No changes detected.")
 
@@ -474,23 +555,41 @@ def manage_data():
                 else:
                     st.error(message)
 
-    # Row deletion (selectbox-based)
-    filtered_df = filtered_df.reset_index(drop=True)
-    if not filtered_df.empty:
-        selected_index = st.selectbox(
-            "Select a record to delete",
-            filtered_df.index,
-            format_func=lambda i: f"{filtered_df.loc[i, 'Retailer']} | {filtered_df.loc[i, 'InvoiceDate']} | {filtered_df.loc[i, 'Product']}"
+    # Bulk upload of retailer files, loaded in one transaction
+    with st.expander("Bulk Upload (CSV / Excel)"):
+        uploaded_files = st.file_uploader(
+            "Files with a header row",
+            type=["csv", "xlsx"],
+            accept_multiple_files=True,
+            key="bulk_upload"
         )
-        if st.button("Delete Selected Record"):
-            success, message = delete_record(selected_index)
+        if uploaded_files and st.button("Import Files"):
+            with st.spinner("Importing records..."):
+                success, message = ingest(uploaded_files)
             if success:
                 st.success(message)
-                st.rerun()
             else:
                 st.error(message)
-    else:
-        st.info("No records available to delete.")
+
+    # Row deletion: records are looked up by search, not listed in full
+    search_term = st.text_input("Search a record to delete (RecordID, retailer, product or city)")
+    if search_term.strip():
+        matches = dict(search_records(search_term, filters))
+        if matches:
+            selected_index = st.selectbox(
+                "Select a record to delete",
+                list(matches),
+                format_func=matches.get
+            )
+            if st.button("Delete Selected Record"):
+                success, message = delete_record(selected_index)
+                if success:
+                    st.success(message)
+                    st.rerun()
+                else:
+                    st.error(message)
+        else:
+            st.info("No matching records.")
 
 if __name__ == "__main__":
     manage_data()
@@ -0,0 +1,246 @@
+"""Reads of the sales_data table shared by every page of the dashboard.
+
+Pages never load the whole table. Sidebar filters are compiled into a
+parameterized WHERE clause (see :func:`build_where`) and pushed down to
+SQLite: aggregates come from the daily rollup (see rollup.py), exports
+stream rows with :func:`iter_sales_rows`, and the data grid reads one page
+at a time with :func:`query_sales_page`.
+
+Triggers bump a data version on every write (see :func:`data_version`);
+caches of derived results key on it, so they never serve data older than
+the table.
+"""
+import json
+
+import pandas as pd
+
+from db import get_connection
+
+# Columns of sales_data, in table order, excluding the key and derived columns
+SALES_COLUMNS = [
+    "Retailer", "RetailerID", "InvoiceDate", "Region", "State",
+    "City", "Product", "PriceperUnit", "UnitsSold", "TotalSales",
+    "OperatingProfit", "OperatingMargin", "SalesMethod"
+]
+
+# Low-cardinality text columns stored as pandas categoricals
+CATEGORICAL_COLUMNS = ["Retailer", "Region", "State", "City", "Product", "SalesMethod"]
+
+NUMERIC_COLUMNS = [
+    "RetailerID", "PriceperUnit", "UnitsSold", "TotalSales",
+    "OperatingProfit", "OperatingMargin"
+]
+
+# Sidebar filters that compile to "column IN (...)" conditions
+FILTER_COLUMNS = ["Retailer", "State", "Region", "Product"]
+
+# Columns the data grid can be sorted by. Each is the leading column of an
+# index (RecordID is the rowid), so a page is a short index range scan
+SORT_COLUMNS = ["RecordID", "InvoiceDate"]
+
+# Rows per data grid page
+PAGE_ROWS = 100
+
+_SELECT_ROWS = f"SELECT rowid AS RecordID, {', '.join(SALES_COLUMNS)} FROM sales_data"
+
+_options = None
+
+def _prepare(df):
+    """Index raw rows on RecordID and parse their dates.
+
+    Text columns stay plain strings: st.data_editor shows a categorical
+    column as a selectbox limited to the categories on the page, so new
+    values could not be typed into the grid.
+    """
+    df = df.set_index("RecordID")
+    if "InvoiceDate" in df.columns:
+        df["InvoiceDate"] = pd.to_datetime(df["InvoiceDate"], format="ISO8601")
+    if df.empty:
+        # read_sql cannot infer numeric types without rows
+        numeric = [col for col in NUMERIC_COLUMNS if col in df.columns]
+        df[numeric] = df[numeric].astype("float64")
+    return df
+
+def _day(value, offset=0):
+    """Format a date-like value as 'YYYY-MM-DD', shifted by ``offset`` days."""
+    return (pd.Timestamp(value).normalize() + pd.Timedelta(days=offset)).strftime("%Y-%m-%d")
+
+def build_where(filters, date_column="InvoiceDate"):
+    """Compile sidebar filters into a parameterized WHERE clause.
+
+    ``filters`` is a dict that may hold inclusive ``start_date``/``end_date``
+    values and, for any of FILTER_COLUMNS, a list of allowed values. Missing or
+    empty entries do not filter. Returns ``(where_sql, params)`` where
+    ``where_sql`` is empty or starts with " WHERE".
+    """
+    filters = filters or {}
+    conditions = []
+    params = []
+    if filters.get("start_date") is not None:
+        conditions.append(f"{date_column} >= ?")
+        params.append(_day(filters["start_date"]))
+    if filters.get("end_date") is not None:
+        # Compare against the next day so invoices later on end_date match too
+        conditions.append(f"{date_column} < ?")
+        params.append(_day(filters["end_date"], offset=1))
+    for col in FILTER_COLUMNS:
+        values = filters.get(col)
+        if values:
+            placeholders = ", ".join(["?" for _ in values])
+            conditions.append(f"{col} IN ({placeholders})")
+            params.extend(values)
+    if not conditions:
+        return "", params
+    return " WHERE " + " AND ".join(conditions), params
+
+def query_sales_page(filters=None, sort="RecordID", descending=False, after=None, limit=PAGE_ROWS):
+    """Return one page of the rows matching ``filters`` and the key of the next page.
+
+    Pages are read with keyset pagination: ``after`` is the key returned with
+    the previous page (None for the first), and the query seeks past it in
+    the ``sort`` index instead of skipping rows with OFFSET, so every page
+    costs the same however deep it is. Returns ``(page, next_after)``, where
+    ``page`` is indexed by RecordID and ``next_after`` is None on the last
+    page.
+    """
+    if sort not in SORT_COLUMNS:
+        raise ValueError(f"Cannot sort the data grid by {sort}")
+    where, params = build_where(filters)
+    # Ties in the sort column are broken by RecordID, so the key is unique
+    key_columns = ["rowid"] if sort == "RecordID" else [sort, "rowid"]
+    if after is not None:
+        seek = f"({', '.join(key_columns)}) {'<' if descending else '>'} ({', '.join('?' for _ in after)})"
+        where += f" AND {seek}" if where else f" WHERE {seek}"
+        params.extend(after)
+    direction = " DESC" if descending else ""
+    order = ", ".join(f"{col}{direction}" for col in key_columns)
+    # One row more than a page tells whether there is a next page
+    query = f"{_SELECT_ROWS}{where} ORDER BY {order} LIMIT ?"
+    conn = get_connection()
+    try:
+        df = pd.read_sql(query, conn, params=params + [limit + 1])
+    finally:
+        conn.close()
+
+    next_after = None
+    if len(df) > limit:
+        df = df.iloc[:limit]
+        last = df.iloc[-1]
+        # Raw SQLite values, before the dates are parsed
+        next_after = [int(last["RecordID"])] if sort == "RecordID" else [last[sort], int(last["RecordID"])]
+    return _prepare(df), next_after
+
+def search_records(term, filters=None, limit=50):
+    """Return up to ``limit`` (RecordID, label) pairs for records matching ``term``.
+
+    A number matches the RecordID; any other text matches the retailer,
+    product or city. Used by record pickers that cannot list every row.
+    """
+    where, params = build_where(filters)
+    term = str(term).strip()
+    if term.isdigit():
+        condition = "rowid = ?"
+        params.append(int(term))
+    else:
+        condition = "(Retailer LIKE ? OR Product LIKE ? OR City LIKE ?)"
+        params.extend([f"%{term}%"] * 3)
+    where += f" AND {condition}" if where else f" WHERE {condition}"
+    conn = get_connection()
+    try:
+        rows = conn.execute(
+            f"SELECT rowid, Retailer, InvoiceDate, Product FROM sales_data{where} ORDER BY rowid LIMIT ?",
+            params + [limit],
+        ).fetchall()
+    finally:
+        conn.close()
+    return [(record_id, f"#{record_id} | {retailer} | {invoice_date} | {product}")
+            for record_id, retailer, invoice_date, product in rows]
+
+def iter_sales_rows(filters=None, columns=None, chunk_size=10000):
+    """Yield the rows matching ``filters`` as lists of at most ``chunk_size`` tuples.
+
+    Rows are fetched from a SQLite cursor as they are consumed, so memory use
+    is bounded by one chunk however many rows match. Values are the raw
+    SQLite ones, e.g. InvoiceDate is a 'YYYY-MM-DD HH:MM:SS' string.
+    """
+    columns = columns or SALES_COLUMNS
+    where, params = build_where(filters)
+    conn = get_connection()
+    cursor = conn.execute(f"SELECT {', '.join(columns)} FROM sales_data{where}", params)
+    try:
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cursor.close()
+        conn.close()
+
+def get_filter_options():
+    """Return the invoice date bounds and the distinct values of each dimension.
+
+    The result is cached until the data version changes, so sidebars can be
+    rendered on every rerun without touching the table.
+    """
+    global _options
+    version = data_version()
+    options = _options
+    if options is not None and options[0] == version:
+        return options[1]
+
+    conn = get_connection()
+    try:
+        min_date, max_date = conn.execute(
+            "SELECT MIN(InvoiceDate), MAX(InvoiceDate) FROM sales_data"
+        ).fetchone()
+        values = {
+            col: [row[0] for row in conn.execute(
+                f"SELECT DISTINCT {col} FROM sales_data WHERE {col} IS NOT NULL ORDER BY {col}"
+            )]
+            for col in CATEGORICAL_COLUMNS
+        }
+    finally:
+        conn.close()
+
+    result = {
+        "min_date": pd.Timestamp(min_date) if min_date else pd.Timestamp.today().normalize(),
+        "max_date": pd.Timestamp(max_date) if max_date else pd.Timestamp.today().normalize(),
+        **values,
+    }
+    _options = (version, result)
+    return result
+
+def data_version(conn=None):
+    """Return the data version stored in the database.
+
+    Triggers on sales_data bump it once per changed row (see migrate.py), so
+    it also reflects writes made by other processes.
+    """
+    if conn is not None:
+        return conn.execute("SELECT value FROM sales_meta WHERE key = 'data_version'").fetchone()[0]
+    conn = get_connection()
+    try:
+        return data_version(conn)
+    finally:
+        conn.close()
+
+def normalize_filters(filters):
+    """Return a canonical, JSON-serializable copy of a filter dict.
+
+    Dates become 'YYYY-MM-DD' strings, value lists are sorted and empty
+    entries are dropped, so equal selections always normalize the same way.
+    """
+    filters = filters or {}
+    normalized = {}
+    for key in ["start_date", "end_date"]:
+        if filters.get(key) is not None:
+            normalized[key] = _day(filters[key])
+    for col in FILTER_COLUMNS:
+        if filters.get(col):
+            normalized[col] = sorted(str(value) for value in filters[col])
+    return normalized
+
+def filter_signature(filters):
+    """Return a stable string identifying a filter selection."""
+    return json.dumps(normalize_filters(filters), sort_keys=True)
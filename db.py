@@ -0,0 +1,149 @@
+"""Shared access to the SQLite sales database.
+
+Connections are long-lived and tuned for a read-heavy dashboard:
+
+- WAL journaling, so readers never block the writer or each other
+- ``synchronous=NORMAL``, which is durable across application crashes in
+  WAL mode and avoids an fsync per commit
+- a larger page cache and memory-mapped reads
+- a busy timeout, so a writer waits for another one instead of failing
+- a per-connection cache of prepared statements
+
+A thread gets one connection, taken on first use from a process-wide pool
+of idle connections, and keeps it until the thread ends; then it goes back
+to the pool, up to POOL_SIZE idle connections. Streamlit runs every rerun
+of a page on a new thread, so a rerun reuses the connection (with its
+prepared statements) of an earlier one instead of opening a new one.
+
+Callers keep the usual ``conn = get_connection() ... conn.close()`` and
+``with get_connection() as conn:`` patterns; close() only rolls back an
+unfinished transaction and leaves the connection open for the next caller
+on that thread.
+"""
+import os
+import sqlite3
+import threading
+import weakref
+
+from migrate import migrate
+
+DB_PATH = "sales_data.db"
+
+# Seconds a connection waits for a lock held by another writer
+BUSY_TIMEOUT = 30
+# Prepared statements kept per connection
+CACHED_STATEMENTS = 256
+# Idle connections kept per database for threads yet to start
+POOL_SIZE = 8
+
+_PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -65536",       # KiB, i.e. 64 MiB
+    "PRAGMA mmap_size = 268435456",     # 256 MiB
+    "PRAGMA temp_store = MEMORY",
+]
+
+_schema_lock = threading.Lock()
+_schema_ready = False
+_pool_lock = threading.Lock()
+_idle = {}        # database path -> idle connections
+_local = threading.local()
+_inherited = []   # pools copied into a forked child, which must not close them
+
+class PooledConnection(sqlite3.Connection):
+    """A connection owned by the pool; close() hands it back instead."""
+
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+
+    def really_close(self):
+        super().close()
+
+class _Lease:
+    """The connections a thread holds; they go back to the pool when it ends."""
+
+    def __init__(self):
+        self.connections = {}   # database path -> connection
+        finalizer = weakref.finalize(self, _release, self.connections)
+        # A forked child must not touch connections inherited from its parent
+        finalizer.atexit = False
+
+def _release(connections):
+    for path, conn in connections.items():
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.really_close()
+            continue
+        with _pool_lock:
+            idle = _idle.setdefault(path, [])
+            pooled = len(idle) < POOL_SIZE
+            if pooled:
+                idle.append(conn)
+        if not pooled:
+            conn.really_close()
+    connections.clear()
+
+def _open(path):
+    conn = sqlite3.connect(
+        path,
+        timeout=BUSY_TIMEOUT,
+        factory=PooledConnection,
+        cached_statements=CACHED_STATEMENTS,
+        # Used by one thread at a time, but not always the one that opened it
+        check_same_thread=False,
+    )
+    for pragma in _PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def get_connection():
+    """Return this thread's connection to the SQLite database.
+
+    Pending schema migrations are applied on the first connection made by the
+    process.
+    """
+    global _schema_ready
+    lease = getattr(_local, "lease", None)
+    if lease is None:
+        lease = _local.lease = _Lease()
+    conn = lease.connections.get(DB_PATH)
+    if conn is None:
+        with _pool_lock:
+            idle = _idle.get(DB_PATH)
+            conn = idle.pop() if idle else None
+        if conn is None:
+            conn = _open(DB_PATH)
+        lease.connections[DB_PATH] = conn
+    if not _schema_ready:
+        with _schema_lock:
+            if not _schema_ready:
+                migrate(conn)
+                _schema_ready = True
+    return conn
+
+def close_connections():
+    """Close the calling thread's connections instead of returning them to the pool."""
+    lease = getattr(_local, "lease", None)
+    connections = lease.connections if lease is not None else {}
+    for conn in connections.values():
+        conn.really_close()
+    connections.clear()
+
+def _after_fork():
+    """Start a forked child with an empty pool.
+
+    SQLite connections must not be used across fork(); the parent's are kept
+    referenced so that the child never closes them either.
+    """
+    global _local, _idle, _pool_lock
+    _inherited.append((_local, _idle))
+    _local = threading.local()
+    _idle = {}
+    _pool_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,213 @@
+"""Derived sales fields, computed for whole batches of rows at once.
+
+TotalSales, OperatingProfit and OperatingMargin follow from the other
+fields:
+
+    TotalSales = PriceperUnit * UnitsSold
+    OperatingProfit = TotalSales * OperatingMargin
+
+and a missing OperatingMargin comes from OperatingProfit / TotalSales or,
+failing that, from MARGIN_RULES. Only missing values are derived; figures a
+retailer supplied are kept as they are. add_record, the data grid and
+ingest.py all pass their rows through here before writing them.
+
+Run
+
+    python derive.py [--chunk-size N]
+
+to backfill rows that were stored with missing derived fields.
+"""
+import argparse
+import json
+import logging
+
+import numpy as np
+import pandas as pd
+
+from dataset import SALES_COLUMNS
+from db import get_connection
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DERIVED_COLUMNS = ["TotalSales", "OperatingProfit", "OperatingMargin"]
+
+# (conditions, margin): the first rule whose conditions all match a row gives
+# its margin. The defaults are the median margins per sales method.
+MARGIN_RULES = [
+    ({"SalesMethod": "Online"}, 0.47),
+    ({"SalesMethod": "Outlet"}, 0.40),
+    ({"SalesMethod": "In-store"}, 0.35),
+    ({}, 0.40),
+]
+
+BACKFILL_CHUNK_ROWS = 10_000
+
+def _floats(df, col):
+    if col not in df.columns:
+        return np.full(len(df), np.nan)
+    return pd.to_numeric(df[col], errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+
+def rule_margins(df, rules=MARGIN_RULES):
+    """Return the margin MARGIN_RULES gives each row of ``df`` (NaN if none matches)."""
+    margins = np.full(len(df), np.nan)
+    for conditions, margin in rules:
+        matches = np.isnan(margins)
+        for col, value in conditions.items():
+            if col not in df.columns:
+                matches[:] = False
+                break
+            matches &= (df[col] == value).to_numpy(dtype=bool, na_value=False)
+        margins[matches] = margin
+    return margins
+
+def derive(df, rules=MARGIN_RULES):
+    """Fill in the missing derived fields of a batch of rows and return it.
+
+    ``df`` holds SALES_COLUMNS (missing columns count as empty); the result
+    is a copy with the derived columns as float64.
+    """
+    df = df.copy()
+    total = _floats(df, "TotalSales")
+    profit = _floats(df, "OperatingProfit")
+    margin = _floats(df, "OperatingMargin")
+
+    total = np.where(np.isnan(total), np.round(_floats(df, "PriceperUnit") * _floats(df, "UnitsSold"), 2), total)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        from_profit = np.where(total != 0, profit / total, np.nan)
+    margin = np.where(np.isnan(margin), np.round(from_profit, 4), margin)
+    margin = np.where(np.isnan(margin), rule_margins(df, rules), margin)
+    profit = np.where(np.isnan(profit), np.round(total * margin, 2), profit)
+
+    df["TotalSales"] = total
+    df["OperatingProfit"] = profit
+    df["OperatingMargin"] = margin
+    return df
+
+def derive_record(data, rules=MARGIN_RULES):
+    """Return a copy of one record dict with its missing derived fields filled in."""
+    derived = derive(pd.DataFrame([data]), rules).iloc[0]
+    data = dict(data)
+    for col in DERIVED_COLUMNS:
+        if data.get(col) is None or pd.isna(data[col]):
+            data[col] = None if pd.isna(derived[col]) else float(derived[col])
+    return data
+
+def _differs(old, value):
+    if pd.isna(old) or pd.isna(value):
+        return pd.isna(old) != pd.isna(value)
+    try:
+        return float(old) != float(value)
+    except (TypeError, ValueError):
+        return str(old) != str(value)
+
+def _current_rows(conn, record_ids):
+    return pd.read_sql(
+        f"SELECT rowid AS RecordID, {', '.join(SALES_COLUMNS)} FROM sales_data "
+        "WHERE rowid IN (SELECT value FROM json_each(?))",
+        conn, params=[json.dumps(list(record_ids))], index_col="RecordID",
+    )
+
+def derive_updates(conn, updates, rules=MARGIN_RULES):
+    """Add derived fields made stale by ``updates`` ({RecordID: {column: value}}).
+
+    A derived field is recomputed when a field it follows from changes and
+    it was not itself edited: price or units give a new TotalSales, a new
+    TotalSales or margin a new OperatingProfit, and an edited profit alone
+    a new margin. Values equal to the stored ones do not count as edits.
+    Returns the updates with the recomputed values added; records that no
+    longer exist are left unchanged.
+    """
+    current = _current_rows(conn, updates)
+    if current.empty:
+        return updates
+    rows = current.astype(object)
+    changed = pd.DataFrame(False, index=current.index, columns=SALES_COLUMNS)
+    for record_id, values in updates.items():
+        if record_id in rows.index:
+            for col, value in values.items():
+                if col in SALES_COLUMNS and _differs(current.at[record_id, col], value):
+                    rows.at[record_id, col] = value
+                    changed.at[record_id, col] = True
+
+    stale_total = (changed["PriceperUnit"] | changed["UnitsSold"]) & ~changed["TotalSales"]
+    stale_profit = (changed["TotalSales"] | changed["OperatingMargin"] | stale_total) & ~changed["OperatingProfit"]
+    stale_margin = changed["OperatingProfit"] & ~changed["OperatingMargin"] & ~stale_profit
+    for col, stale in [("TotalSales", stale_total), ("OperatingProfit", stale_profit),
+                       ("OperatingMargin", stale_margin)]:
+        rows.loc[stale, col] = None
+    derived = derive(rows, rules)
+
+    result = {}
+    for record_id, values in updates.items():
+        values = dict(values)
+        if record_id in derived.index:
+            for col in DERIVED_COLUMNS:
+                value = derived.at[record_id, col]
+                old = current.at[record_id, col]
+                if not (pd.isna(value) or value == old):
+                    values[col] = float(value)
+        result[record_id] = values
+    return result
+
+def backfill(chunk_size=BACKFILL_CHUNK_ROWS, rules=MARGIN_RULES):
+    """Derive missing fields of stored rows, ``chunk_size`` rows per transaction.
+
+    Returns (success, message). Only rows with a TotalSales, or a price and
+    units to compute it from, are read, and only those that gain at least
+    one field are written; the message counts the rows that remain
+    incomplete.
+    """
+    columns = ", ".join(SALES_COLUMNS)
+    missing = " OR ".join(f"{col} IS NULL" for col in DERIVED_COLUMNS)
+    derivable = "TotalSales IS NOT NULL OR (PriceperUnit IS NOT NULL AND UnitsSold IS NOT NULL)"
+    updated, last_record_id = 0, 0
+    conn = get_connection()
+    try:
+        while True:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = pd.read_sql(
+                f"SELECT rowid AS RecordID, {columns} FROM sales_data "
+                f"WHERE rowid > ? AND ({missing}) AND ({derivable}) ORDER BY rowid LIMIT ?",
+                conn, params=[last_record_id, chunk_size], index_col="RecordID",
+            )
+            if rows.empty:
+                conn.commit()
+                break
+            derived = derive(rows, rules)[DERIVED_COLUMNS]
+            filled = (rows[DERIVED_COLUMNS].isna() & derived.notna()).any(axis=1)
+            derived = derived[filled].astype(object)
+            derived = derived.where(derived.notna(), None)
+            conn.executemany(
+                "UPDATE sales_data SET TotalSales = ?, OperatingProfit = ?, OperatingMargin = ? WHERE rowid = ?",
+                [(*values, record_id) for record_id, values in zip(derived.index.tolist(), derived.values.tolist())],
+            )
+            conn.commit()
+            updated += len(derived)
+            last_record_id = int(rows.index[-1])
+            logger.info(f"Backfilled {updated} rows")
+
+        incomplete = conn.execute(f"SELECT COUNT(*) FROM sales_data WHERE {missing}").fetchone()[0]
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Error backfilling derived fields: {str(e)}")
+        return False, f"Error backfilling derived fields after {updated:,} rows: {str(e)}"
+    finally:
+        conn.close()
+
+    message = f"Backfilled derived fields of {updated:,} rows"
+    if incomplete:
+        message += f"; {incomplete:,} rows still have missing fields that cannot be derived (e.g. no price)"
+    return True, message
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill missing TotalSales, OperatingProfit and OperatingMargin.")
+    parser.add_argument("--chunk-size", type=int, default=BACKFILL_CHUNK_ROWS, help="rows updated per transaction")
+    args = parser.parse_args()
+    success, message = backfill(args.chunk_size)
+    print(message)
+    if not success:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
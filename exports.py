@@ -0,0 +1,284 @@
+"""Writers for the report exports.
+
+Worksheets are written straight through xlsxwriter: every cell is written
+exactly once, with a type-specific call and no per-cell format. Number
+formats are attached to whole columns with ``set_column``, and column widths
+are estimated from the column extremes or a sample of rows, so formatting
+costs the same for a hundred rows as for a million.
+
+Workbooks opened with xlsxwriter's ``constant_memory`` option flush each row
+to disk once the next one starts. They have to be written row by row, which
+write_sheet does automatically; stream_sheets fills such a workbook from
+chunks of database rows, so an export of any size needs memory for one chunk.
+write_csv does the same for CSV files, and write_parquet and write_arrow
+write typed, compressed columnar files one record batch per chunk.
+"""
+import csv
+import gzip
+import os
+import tempfile
+import time
+from datetime import datetime
+
+import pandas as pd
+
+# Rows sampled per column when estimating its display width
+WIDTH_SAMPLE_ROWS = 1000
+MAX_COLUMN_WIDTH = 60
+
+# Rows per worksheet allowed by Excel, including the header
+EXCEL_MAX_ROWS = 1_048_576
+
+# Rows per Parquet row group and Arrow record batch
+ROW_GROUP_ROWS = 100_000
+# Compression codec for the columnar formats
+COLUMNAR_COMPRESSION = "zstd"
+# Numeric columns stored as integers in the columnar formats; the rest are float64
+INTEGER_COLUMNS = ["RetailerID", "UnitsSold"]
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Export files are written here and removed once they are this many seconds old
+EXPORT_DIR = os.path.join(tempfile.gettempdir(), "sales_exports")
+EXPORT_MAX_AGE = 60 * 60
+
+def add_formats(workbook, header_format):
+    """Create the header, number, percent and datetime formats for a workbook."""
+    return {
+        "header": workbook.add_format(header_format),
+        "number": workbook.add_format({"num_format": "#,##0.00"}),
+        "percent": workbook.add_format({"num_format": "0.00%"}),
+        "datetime": workbook.add_format({"num_format": "yyyy-mm-dd hh:mm:ss"}),
+    }
+
+def _is_number(series):
+    return pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+
+def column_widths(df, sample_rows=WIDTH_SAMPLE_ROWS):
+    """Estimate a display width for every column of ``df``.
+
+    Numeric widths come from the column's extremes, formatted as they will be
+    shown; other columns are measured on an evenly spaced sample of rows.
+    """
+    step = max(len(df) // sample_rows, 1)
+    sample = df.iloc[::step]
+    widths = []
+    for col in df.columns:
+        series = df[col]
+        if _is_number(series):
+            extremes = series.abs().max() if len(series) else 0
+            length = len(f"-{extremes:,.2f}") if pd.notna(extremes) else 0
+        else:
+            lengths = sample[col].dropna().astype(str).str.len()
+            length = int(lengths.max()) if len(lengths) else 0
+        widths.append(min(max(length, len(str(col))) + 2, MAX_COLUMN_WIDTH))
+    return widths
+
+def write_column(worksheet, row, col, series, formats):
+    """Write ``series`` downwards from (row, col), skipping missing values."""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        write, date_format = worksheet.write_datetime, formats["datetime"]
+        for r, value in enumerate(series.dt.to_pydatetime().tolist(), start=row):
+            if value is not None and value == value:
+                write(r, col, value, date_format)
+    elif _is_number(series):
+        write = worksheet.write_number
+        for r, value in enumerate(series.to_numpy(dtype="float64").tolist(), start=row):
+            if value == value:
+                write(r, col, value)
+    else:
+        write_string, write = worksheet.write_string, worksheet.write
+        for r, value in enumerate(series.astype(object).tolist(), start=row):
+            if isinstance(value, str):
+                write_string(r, col, value)
+            elif value is not None and value == value:
+                write(r, col, value)
+
+def write_rows(worksheet, first_row, rows, kinds, formats):
+    """Write row tuples downwards from ``first_row``, in order, skipping missing values.
+
+    ``kinds`` gives each column's type: "number", "datetime" (datetimes or
+    ISO 8601 strings) or anything else for strings. Returns the next free row.
+    """
+    write_number, write_string = worksheet.write_number, worksheet.write_string
+    write_datetime, write = worksheet.write_datetime, worksheet.write
+    date_format = formats["datetime"]
+    row = first_row
+    for values in rows:
+        for col, value in enumerate(values):
+            if value is None or value != value:
+                continue
+            kind = kinds[col]
+            if kind == "number" and isinstance(value, (int, float)):
+                write_number(row, col, value)
+            elif kind == "datetime":
+                if isinstance(value, str):
+                    value = datetime.fromisoformat(value)
+                write_datetime(row, col, value, date_format)
+            elif isinstance(value, str):
+                write_string(row, col, value)
+            else:
+                write(row, col, value)
+        row += 1
+    return row
+
+def _column_kinds(df):
+    return [
+        "datetime" if pd.api.types.is_datetime64_any_dtype(df[col])
+        else "number" if _is_number(df[col])
+        else "text"
+        for col in df.columns
+    ]
+
+def _add_sheet(workbook, sheet_name, df, formats, percent_columns=()):
+    """Add a sheet with the header row and column formats for ``df``'s columns."""
+    worksheet = workbook.add_worksheet(sheet_name)
+    worksheet.write_row(0, 0, [str(col) for col in df.columns], formats["header"])
+    for i, (col, width) in enumerate(zip(df.columns, column_widths(df))):
+        column_format = None
+        if _is_number(df[col]):
+            column_format = formats["percent"] if col in percent_columns else formats["number"]
+        worksheet.set_column(i, i, width, column_format)
+    return worksheet
+
+def write_sheet(workbook, df, sheet_name, formats, percent_columns=()):
+    """Write ``df`` to a new sheet with a formatted header and column formats.
+
+    Numeric columns get the number format, or the percent format when they
+    are listed in ``percent_columns``.
+    """
+    worksheet = _add_sheet(workbook, sheet_name, df, formats, percent_columns)
+    if workbook.constant_memory:
+        write_rows(worksheet, 1, df.itertuples(index=False, name=None), _column_kinds(df), formats)
+    else:
+        for i, col in enumerate(df.columns):
+            write_column(worksheet, 1, i, df[col], formats)
+    return worksheet
+
+def stream_sheets(workbook, sheet_name, columns, chunks, kinds, formats):
+    """Write chunks of row tuples to as many sheets as Excel's row limit needs.
+
+    The sheets are named ``sheet_name``, "``sheet_name`` (2)", and so on.
+    Column widths are estimated from the first chunk. Returns the number of
+    rows written.
+    """
+    worksheet, row, sheets, total = None, EXCEL_MAX_ROWS, 0, 0
+    for chunk in chunks:
+        start = 0
+        while start < len(chunk):
+            if row >= EXCEL_MAX_ROWS:
+                sheets += 1
+                name = sheet_name if sheets == 1 else f"{sheet_name} ({sheets})"
+                sample = pd.DataFrame(chunk[:WIDTH_SAMPLE_ROWS], columns=columns)
+                worksheet, row = _add_sheet(workbook, name, sample, formats), 1
+            count = min(len(chunk) - start, EXCEL_MAX_ROWS - row)
+            row = write_rows(worksheet, row, chunk[start:start + count], kinds, formats)
+            start += count
+            total += count
+    if worksheet is None:
+        _add_sheet(workbook, sheet_name, pd.DataFrame(columns=columns), formats)
+    return total
+
+def write_csv(path, columns, chunks, compress=False):
+    """Write a header and chunks of row tuples to a CSV file; return the row count.
+
+    With ``compress`` the file is gzip-compressed as it is written.
+    """
+    opener = gzip.open if compress else open
+    total = 0
+    with opener(path, "wt", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(columns)
+        for chunk in chunks:
+            writer.writerows(chunk)
+            total += len(chunk)
+    return total
+
+def columnar_schema(columns, dictionaries):
+    """Return the pyarrow schema for exporting ``columns`` of sales_data.
+
+    Columns with an entry in ``dictionaries`` (value lists, e.g. from
+    dataset.get_filter_options) are dictionary-encoded against that fixed
+    dictionary, so every batch shares it; InvoiceDate becomes a timestamp.
+    """
+    import pyarrow as pa
+
+    fields = []
+    for col in columns:
+        if col in dictionaries:
+            fields.append(pa.field(col, pa.dictionary(pa.int32(), pa.string())))
+        elif col == "InvoiceDate":
+            fields.append(pa.field(col, pa.timestamp("s")))
+        elif col in INTEGER_COLUMNS:
+            fields.append(pa.field(col, pa.int64()))
+        else:
+            fields.append(pa.field(col, pa.float64()))
+    return pa.schema(fields)
+
+def _record_batches(schema, chunks, dictionaries):
+    """Convert chunks of raw SQLite row tuples to record batches of ``schema``."""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    value_sets = {col: pa.array(values, pa.string()) for col, values in dictionaries.items()}
+    for chunk in chunks:
+        arrays = []
+        for field, values in zip(schema, zip(*chunk)):
+            if pa.types.is_dictionary(field.type):
+                values = pa.array(values, pa.string())
+                indices = pc.index_in(values, value_set=value_sets[field.name])
+                if indices.null_count != values.null_count:
+                    raise ValueError(f"{field.name} has values added during the export; please try again")
+                arrays.append(pa.DictionaryArray.from_arrays(
+                    indices, value_sets[field.name]
+                ))
+            elif pa.types.is_timestamp(field.type):
+                arrays.append(pc.strptime(pa.array(values, pa.string()), DATE_FORMAT, unit="s"))
+            else:
+                arrays.append(pa.array(values, field.type))
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+def write_parquet(path, columns, chunks, dictionaries):
+    """Write chunks of row tuples to a Parquet file; return the row count.
+
+    Every chunk becomes one row group with min/max statistics, so readers
+    can skip row groups by date or value. Needs pyarrow.
+    """
+    import pyarrow.parquet as pq
+
+    schema = columnar_schema(columns, dictionaries)
+    total = 0
+    with pq.ParquetWriter(path, schema, compression=COLUMNAR_COMPRESSION, write_statistics=True) as writer:
+        for batch in _record_batches(schema, chunks, dictionaries):
+            writer.write_batch(batch, row_group_size=ROW_GROUP_ROWS)
+            total += batch.num_rows
+    return total
+
+def write_arrow(path, columns, chunks, dictionaries):
+    """Write chunks of row tuples to an Arrow IPC (Feather v2) file; return the row count.
+
+    Every chunk becomes one compressed record batch. Needs pyarrow.
+    """
+    import pyarrow as pa
+
+    schema = columnar_schema(columns, dictionaries)
+    options = pa.ipc.IpcWriteOptions(compression=COLUMNAR_COMPRESSION)
+    total = 0
+    with pa.ipc.new_file(path, schema, options=options) as writer:
+        for batch in _record_batches(schema, chunks, dictionaries):
+            writer.write_batch(batch)
+            total += batch.num_rows
+    return total
+
+def new_export_path(suffix):
+    """Return a fresh file path in EXPORT_DIR, removing exports older than EXPORT_MAX_AGE."""
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    cutoff = time.time() - EXPORT_MAX_AGE
+    for entry in os.scandir(EXPORT_DIR):
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            pass
+    fd, path = tempfile.mkstemp(suffix=suffix, dir=EXPORT_DIR)
+    os.close(fd)
+    return path
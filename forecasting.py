@@ -0,0 +1,390 @@
+"""Sales forecasts that are fitted once and then served from a cache.
+
+A forecast is identified by the engine, the filter selection and the data
+version (see dataset.data_version). Fitted models and their predictions are
+persisted in FORECAST_DIR, so they survive restarts and are shared by every
+session. When the data changes, the previous forecast keeps being served while
+a background worker fits a new one.
+
+Files are moved into place atomically, so the directory can be shared by
+several server processes; a file another process removed or left unreadable
+counts as a miss. The modification time of a forecast file records its last
+use: files unused for FORECAST_DISK_MAX_AGE and the least recently used
+beyond FORECAST_DISK_ENTRIES are removed, and at most FORECAST_MEMORY_ENTRIES
+selections are kept in memory.
+
+Engines are registered in FORECAST_ENGINES. Interactive views use the NumPy
+engine, which fits in milliseconds; Prophet is more accurate but takes
+seconds to import and fit, so it is only the default for batch_forecast.py,
+and only when it is installed.
+"""
+import glob
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from dataset import FILTER_COLUMNS, data_version, filter_signature, get_filter_options, normalize_filters
+from db import get_connection
+from rollup import aggregate_sales
+
+logger = logging.getLogger(__name__)
+
+FORECAST_DIR = "forecast_cache"
+FORECAST_PERIODS = 90
+FORECAST_MEMORY_ENTRIES = 128
+FORECAST_DISK_ENTRIES = 1000
+FORECAST_DISK_MAX_AGE = 30 * 24 * 60 * 60
+# Unfinished files older than this are left over from crashed processes
+PARTIAL_MAX_AGE = 24 * 60 * 60
+
+_PARTIAL_PREFIX = "partial-"
+
+# Dimensions for which batch_forecast.py precomputes one forecast per value
+BATCH_DIMENSIONS = ["Retailer", "State", "Product"]
+
+# Status values returned by get_forecast
+READY = "ready"
+STALE = "stale"
+PENDING = "pending"
+FAILED = "failed"
+NO_DATA = "no_data"
+
+# Days with sales needed to fit a forecast
+MIN_HISTORY_DAYS = 2
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="forecast")
+_lock = threading.Lock()
+# Least recently used first, each bounded by FORECAST_MEMORY_ENTRIES
+_memory = OrderedDict()    # signature key -> (version, forecast frame)
+_failed = OrderedDict()    # (signature key, version) whose fit raised -> None
+_no_data = OrderedDict()   # (signature key, version) with too little history to fit -> None
+_in_flight = {}            # (signature key, version) -> Future
+
+def _remember(entries, key, value=None):
+    """Store ``key`` in one of the bounded dicts above; call with _lock held."""
+    entries[key] = value
+    entries.move_to_end(key)
+    while len(entries) > FORECAST_MEMORY_ENTRIES:
+        entries.popitem(last=False)
+
+def _signature_key(filters, periods, engine):
+    """Return a short, filesystem-safe key for an engine, filter selection and horizon."""
+    signature = f"{engine}|{filter_signature(filters)}|{periods}"
+    return hashlib.sha256(signature.encode("utf-8")).hexdigest()[:24]
+
+def _paths(key, version):
+    base = os.path.join(FORECAST_DIR, f"{key}-v{version}")
+    return base + ".json", base + ".pkl"
+
+def _disk_versions(key):
+    """Return the data versions for which a forecast of ``key`` is persisted."""
+    versions = []
+    for path in glob.glob(os.path.join(FORECAST_DIR, f"{key}-v*.pkl")):
+        suffix = os.path.basename(path)[len(key) + 2:-len(".pkl")]
+        if suffix.isdigit():
+            versions.append(int(suffix))
+    return versions
+
+def _latest_on_disk(key):
+    """Return (version, forecast) for the newest readable persisted forecast of ``key``."""
+    for version in sorted(_disk_versions(key), reverse=True):
+        forecast_path = _paths(key, version)[1]
+        try:
+            forecast = pd.read_pickle(forecast_path)
+            os.utime(forecast_path)
+        except Exception as e:
+            # Removed by another process in the meantime, or unreadable
+            logger.warning(f"Skipping persisted forecast {forecast_path}: {str(e)}")
+            continue
+        return version, forecast
+    return None, None
+
+def _write_atomic(path, write):
+    """Call ``write(file)`` on a temporary file and move it to ``path``."""
+    fd, partial_path = tempfile.mkstemp(prefix=_PARTIAL_PREFIX, dir=FORECAST_DIR)
+    try:
+        with os.fdopen(fd, "wb") as file:
+            write(file)
+        os.replace(partial_path, path)
+    except BaseException:
+        _remove(partial_path)
+        raise
+
+def evict(max_entries=FORECAST_DISK_ENTRIES, max_age=FORECAST_DISK_MAX_AGE):
+    """Remove persisted forecasts unused for ``max_age`` seconds or beyond ``max_entries``."""
+    entries = {}   # "<key>-v<version>" -> [last used, paths]
+    now = time.time()
+    for entry in os.scandir(FORECAST_DIR):
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        if entry.name.startswith(_PARTIAL_PREFIX):
+            if stat.st_mtime < now - PARTIAL_MAX_AGE:
+                _remove(entry.path)
+            continue
+        base, extension = os.path.splitext(entry.name)
+        info = entries.setdefault(base, [0.0, []])
+        info[1].append(entry.path)
+        if extension == ".pkl":
+            info[0] = stat.st_mtime
+
+    removed = 0
+    newest_first = sorted(entries.values(), key=lambda info: info[0], reverse=True)
+    for number, (last_used, paths) in enumerate(newest_first):
+        if number < max_entries and last_used >= now - max_age:
+            continue
+        for path in paths:
+            _remove(path)
+        removed += 1
+    if removed:
+        logger.info(f"Evicted {removed} persisted forecasts")
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+def fit_prophet_forecast(history, periods=FORECAST_PERIODS):
+    """Fit Prophet on a frame with ``ds``/``y`` columns."""
+    from prophet import Prophet
+    from prophet.serialize import model_to_json
+
+    model = Prophet()
+    model.fit(history)
+    future = model.make_future_dataframe(periods=periods)
+    forecast = model.predict(future)[["ds", "yhat", "yhat_lower", "yhat_upper"]]
+    return model_to_json(model), forecast
+
+# Harmonics of the seasonal terms in the NumPy engine (Prophet's defaults)
+WEEKLY_ORDER = 3
+YEARLY_ORDER = 10
+
+def _fourier(days, period, order):
+    """Sine and cosine columns for ``order`` harmonics of ``period`` days."""
+    angles = 2 * np.pi * np.outer(days, np.arange(1, order + 1)) / period
+    return [np.sin(angles), np.cos(angles)]
+
+def _design(days, span, weekly, yearly):
+    """Regression matrix: intercept, linear trend and Fourier seasonality."""
+    columns = [np.ones((len(days), 1)), (days / span)[:, None]]
+    if weekly:
+        columns += _fourier(days, 7.0, weekly)
+    if yearly:
+        columns += _fourier(days, 365.25, yearly)
+    return np.hstack(columns)
+
+def fit_numpy_forecast(history, periods=FORECAST_PERIODS):
+    """Fit a linear trend with weekly and yearly Fourier terms by least squares.
+
+    Like Prophet, weekly terms need two weeks of history and yearly terms two
+    years. The interval is +/- 1.96 residual standard deviations.
+    """
+    history = history.dropna(subset=["y"]).sort_values("ds")
+    if history.empty:
+        raise ValueError("No sales history to fit a forecast to")
+    ds = pd.to_datetime(history["ds"]).reset_index(drop=True)
+    y = history["y"].to_numpy(dtype="float64")
+    start = ds.min()
+    days = ((ds - start) / pd.Timedelta(days=1)).to_numpy()
+    span = max(days.max(), 1.0)
+    weekly = WEEKLY_ORDER if span >= 14 else 0
+    yearly = YEARLY_ORDER if span >= 730 else 0
+
+    X = _design(days, span, weekly, yearly)
+    coef, _, _, _ = np.linalg.lstsq(X, y, rcond=None)
+    residuals = y - X @ coef
+    sigma = float(np.sqrt(residuals @ residuals / max(len(y) - X.shape[1], 1)))
+
+    future_ds = pd.date_range(ds.max() + pd.Timedelta(days=1), periods=periods, freq="D")
+    all_ds = pd.Series(ds.tolist() + future_ds.tolist())
+    all_days = ((all_ds - start) / pd.Timedelta(days=1)).to_numpy()
+    yhat = _design(all_days, span, weekly, yearly) @ coef
+    forecast = pd.DataFrame({
+        "ds": all_ds,
+        "yhat": yhat,
+        "yhat_lower": yhat - 1.96 * sigma,
+        "yhat_upper": yhat + 1.96 * sigma,
+    })
+    model = {
+        "start": start.isoformat(), "span": span, "weekly": weekly, "yearly": yearly,
+        "coef": coef.tolist(), "sigma": sigma,
+    }
+    return json.dumps(model), forecast
+
+# Forecast engines by name. An engine takes a frame with ``ds``/``y`` columns
+# and a horizon in days, and returns ``(model_json, forecast)`` where
+# ``forecast`` holds ds, yhat, yhat_lower and yhat_upper for the history plus
+# the future days.
+FORECAST_ENGINES = {
+    "numpy": fit_numpy_forecast,
+    "prophet": fit_prophet_forecast,
+}
+INTERACTIVE_ENGINE = "numpy"
+
+# Engines quick enough to fit while the page waits
+FAST_ENGINES = {"numpy"}
+
+def default_batch_engine():
+    """Return "prophet" if it is installed, otherwise the NumPy engine."""
+    return "prophet" if importlib.util.find_spec("prophet") else INTERACTIVE_ENGINE
+
+def fit_forecast(history, periods=FORECAST_PERIODS, engine=INTERACTIVE_ENGINE):
+    """Fit ``history`` with the named engine; see FORECAST_ENGINES."""
+    return FORECAST_ENGINES[engine](history, periods)
+
+def _refit(key, filters, periods, version, engine):
+    """Background job: fit, persist and publish the forecast for ``version``."""
+    try:
+        history = aggregate_sales(["InvoiceDate"], filters)[["InvoiceDate", "TotalSales"]]
+        history.columns = ["ds", "y"]
+        if history["y"].notna().sum() < MIN_HISTORY_DAYS:
+            logger.info(f"Not fitting forecast {key}: fewer than {MIN_HISTORY_DAYS} days of sales")
+            with _lock:
+                _remember(_no_data, (key, version))
+            return
+        model_json, forecast = fit_forecast(history, periods, engine)
+
+        os.makedirs(FORECAST_DIR, exist_ok=True)
+        model_path, forecast_path = _paths(key, version)
+        _write_atomic(model_path, lambda file: file.write(model_json.encode("utf-8")))
+        # Written last: readers look for the forecast file
+        _write_atomic(forecast_path, forecast.to_pickle)
+
+        # Older versions of this forecast are no longer needed
+        for old_version in _disk_versions(key):
+            if old_version < version:
+                for path in _paths(key, old_version):
+                    _remove(path)
+        evict()
+
+        with _lock:
+            if key not in _memory or _memory[key][0] < version:
+                _remember(_memory, key, (version, forecast))
+        logger.info(f"Fitted forecast {key} for data version {version}")
+    except Exception as e:
+        logger.error(f"Error fitting forecast {key}: {str(e)}")
+        with _lock:
+            _remember(_failed, (key, version))
+    finally:
+        with _lock:
+            _in_flight.pop((key, version), None)
+
+def get_forecast(filters, periods=FORECAST_PERIODS, engine=INTERACTIVE_ENGINE):
+    """Return ``(forecast, status)`` for a filter selection.
+
+    ``status`` is READY when the forecast matches the current data, STALE when
+    an older forecast is returned while a refit runs, PENDING when nothing has
+    been fitted yet (``forecast`` is None), NO_DATA when the selection has
+    fewer than MIN_HISTORY_DAYS days of sales (``forecast`` is None) and
+    FAILED when fitting the current data raised. Engines in FAST_ENGINES are waited for when there is nothing
+    to show yet; slower ones never block the caller.
+    """
+    key = _signature_key(filters, periods, engine)
+    version = data_version()
+
+    with _lock:
+        cached = _memory.get(key)
+        if cached is not None:
+            _memory.move_to_end(key)
+    if cached is None or cached[0] != version:
+        # Another process may already have persisted a newer fit
+        disk_version, forecast = _latest_on_disk(key)
+        if forecast is not None and (cached is None or disk_version > cached[0]):
+            cached = (disk_version, forecast)
+            with _lock:
+                _remember(_memory, key, cached)
+
+    if cached is not None and cached[0] == version:
+        return cached[1], READY
+
+    with _lock:
+        if (key, version) in _no_data:
+            return None, NO_DATA
+        if (key, version) in _failed:
+            return (cached[1] if cached else None), FAILED
+        future = _in_flight.get((key, version))
+        if future is None:
+            future = _executor.submit(_refit, key, filters, periods, version, engine)
+            _in_flight[(key, version)] = future
+
+    if cached is not None:
+        return cached[1], STALE
+    if engine in FAST_ENGINES:
+        future.result()
+        with _lock:
+            cached = _memory.get(key)
+            if cached is not None and cached[0] >= version:
+                return cached[1], READY
+            if (key, version) in _no_data:
+                return None, NO_DATA
+            if (key, version) in _failed:
+                return None, FAILED
+    return None, PENDING
+
+def _covers_history(normalized):
+    """Return whether normalized filters include every invoice date in the table."""
+    options = get_filter_options()
+    return (
+        normalized.get("start_date", "") <= options["min_date"].strftime("%Y-%m-%d")
+        and normalized.get("end_date", "9999-12-31") >= options["max_date"].strftime("%Y-%m-%d")
+    )
+
+def _drilldown(filters):
+    """Return (dimension, value) if ``filters`` select one value of one batch dimension.
+
+    The date range must cover the whole table, as batch forecasts are fitted
+    on the full history of each value.
+    """
+    normalized = normalize_filters(filters)
+    if not _covers_history(normalized):
+        return None
+    selected = [col for col in FILTER_COLUMNS if col in normalized]
+    if len(selected) != 1 or selected[0] not in BATCH_DIMENSIONS:
+        return None
+    values = normalized[selected[0]]
+    if len(values) != 1:
+        return None
+    return selected[0], values[0]
+
+def get_batch_forecast(filters):
+    """Return ``(forecast, status)`` from the sales_forecasts table.
+
+    Only drill-downs into a single Retailer, State or Product over the full
+    date range are precomputed by batch_forecast.py; for anything else, such
+    as a narrower date range, or when the batch job has not covered the value
+    yet, ``(None, None)`` is returned. ``status`` is READY or, if the data changed since the batch
+    ran, STALE.
+    """
+    drilldown = _drilldown(filters)
+    if drilldown is None:
+        return None, None
+
+    conn = get_connection()
+    try:
+        forecast = pd.read_sql(
+            "SELECT ds, yhat, yhat_lower, yhat_upper, DataVersion FROM sales_forecasts "
+            "WHERE Dimension = ? AND Value = ? ORDER BY ds",
+            conn, params=list(drilldown),
+        )
+        version = data_version(conn)
+    finally:
+        conn.close()
+
+    if forecast.empty:
+        return None, None
+    status = READY if forecast["DataVersion"].iloc[0] == version else STALE
+    forecast = forecast.drop(columns="DataVersion")
+    forecast["ds"] = pd.to_datetime(forecast["ds"])
+    return forecast, status
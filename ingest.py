@@ -0,0 +1,215 @@
+"""Bulk-load CSV and Excel files into sales_data.
+
+Run
+
+    python ingest.py FILE [FILE ...] [--chunk-size N] [--keep-indexes]
+
+for daily retailer drops; the data management page offers the same through
+an upload widget. Files are read in chunks, so their size is not limited by
+memory. Each chunk is validated and coerced column by column with pandas
+and written with one executemany call. All files go in one transaction:
+either every valid row is loaded or nothing is.
+
+During the load the secondary indexes and the rollup and data version
+triggers are dropped. Afterwards the indexes are rebuilt in one pass, the
+new rows are added to the daily rollup in one aggregate query, and the data
+version is bumped once by the number of rows loaded.
+"""
+import argparse
+import logging
+import os
+import re
+import time
+
+import pandas as pd
+
+from dataset import CATEGORICAL_COLUMNS, SALES_COLUMNS
+from db import get_connection
+from derive import derive
+from migrate import (
+    add_to_rollup, bump_data_version, create_rollup_triggers, create_version_triggers,
+    drop_rollup_triggers, drop_version_triggers,
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CHUNK_ROWS = 50_000
+REQUIRED_COLUMNS = ["Retailer", "RetailerID", "InvoiceDate", "Product"]
+# Rejected rows described in the result message
+MAX_REPORTED_ERRORS = 5
+
+_EXCEL_SUFFIXES = (".xlsx", ".xlsm")
+_INSERT = f"INSERT INTO sales_data ({', '.join(SALES_COLUMNS)}) VALUES ({', '.join('?' for _ in SALES_COLUMNS)})"
+
+def _header_key(name):
+    return re.sub(r"[^a-z0-9]", "", str(name).lower())
+
+_COLUMNS_BY_KEY = {_header_key(col): col for col in SALES_COLUMNS}
+
+def _source_name(source):
+    return getattr(source, "name", str(source))
+
+def _excel_chunks(source, chunk_size):
+    """Yield DataFrames of ``chunk_size`` rows from the first sheet of a workbook."""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield pd.DataFrame(chunk, columns=header)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=header)
+    finally:
+        workbook.close()
+
+def read_chunks(source, chunk_size=CHUNK_ROWS):
+    """Yield the rows of a CSV or Excel file (a path or file object) as raw DataFrames."""
+    if _source_name(source).lower().endswith(_EXCEL_SUFFIXES):
+        yield from _excel_chunks(source, chunk_size)
+    else:
+        yield from pd.read_csv(source, chunksize=chunk_size, dtype=str, keep_default_na=False,
+                               skipinitialspace=True)
+
+def _numbers(series):
+    """Parse numbers, also from text like '$1,234.50' or '30%'."""
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype("float64")
+    text = series.astype("string").str.strip()
+    percent = text.str.endswith("%", na=False)
+    for symbol in ["$", ",", "%"]:
+        text = text.str.replace(symbol, "", regex=False)
+    text = text.mask(text == "")
+    try:
+        values = text.astype("float64")
+    except ValueError:
+        # Only when some values are not numbers: slower, but flags them as missing
+        values = pd.to_numeric(text, errors="coerce").astype("float64")
+    return values.where(~percent, values / 100)
+
+def coerce_chunk(raw):
+    """Validate and convert one raw chunk; return (rows, invalid).
+
+    Columns are matched to sales_data by name, ignoring case, spaces and
+    punctuation ("Invoice Date" -> InvoiceDate). ``rows`` is a DataFrame of
+    SALES_COLUMNS ready to insert, with missing derived fields filled in
+    (see derive.py). ``invalid`` flags, for each rejected row and required
+    column, whether that field is missing or unparseable.
+    """
+    raw = raw.rename(columns=lambda name: _COLUMNS_BY_KEY.get(_header_key(name), name))
+    rows = pd.DataFrame(index=raw.index)
+    for col in SALES_COLUMNS:
+        series = raw[col] if col in raw.columns else pd.Series(None, index=raw.index, dtype="object")
+        if col in CATEGORICAL_COLUMNS:
+            text = series.astype("string").str.strip()
+            rows[col] = text.mask(text == "")
+        elif col == "InvoiceDate":
+            # Each value is parsed on its own; a format inferred from the first
+            # value would turn every other format in the chunk into NaT
+            rows[col] = pd.to_datetime(series, format="mixed", errors="coerce")
+        else:
+            rows[col] = _numbers(series)
+
+    invalid = rows[REQUIRED_COLUMNS].isna()
+    invalid["RetailerID"] |= rows["RetailerID"] % 1 != 0
+    rejected = invalid.any(axis=1)
+    rows = rows[~rejected].copy()
+    rows["RetailerID"] = rows["RetailerID"].astype("int64")
+    rows["InvoiceDate"] = rows["InvoiceDate"].dt.strftime("%Y-%m-%d %H:%M:%S")
+    return derive(rows), invalid[rejected]
+
+def _records(rows):
+    """Return the rows as tuples, with None for missing values."""
+    columns = []
+    for col in SALES_COLUMNS:
+        series = rows[col]
+        if series.dtype == "float64":
+            # SQLite stores a bound NaN as NULL
+            columns.append(series.tolist())
+        else:
+            columns.append(series.astype(object).where(series.notna(), None).tolist())
+    return list(zip(*columns))
+
+def _secondary_indexes(conn):
+    return conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'sales_data' AND sql IS NOT NULL"
+    ).fetchall()
+
+def ingest(sources, chunk_size=CHUNK_ROWS, defer_indexes=True):
+    """Load CSV/Excel files into sales_data in one transaction; return (success, message).
+
+    Rows missing a required field or holding an unparseable one are skipped
+    and counted; any other error rolls the whole load back.
+    """
+    started = time.perf_counter()
+    inserted, rejected, examples = 0, 0, []
+    conn = get_connection()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        last_record_id = conn.execute("SELECT COALESCE(MAX(RecordID), 0) FROM sales_data").fetchone()[0]
+        indexes = _secondary_indexes(conn) if defer_indexes else []
+        for name, _ in indexes:
+            conn.execute(f"DROP INDEX {name}")
+        drop_rollup_triggers(conn)
+        drop_version_triggers(conn)
+
+        for source in sources:
+            first_row = 1
+            for raw in read_chunks(source, chunk_size):
+                raw.index = pd.RangeIndex(first_row, first_row + len(raw))
+                rows, invalid = coerce_chunk(raw)
+                conn.executemany(_INSERT, _records(rows))
+                first_row += len(raw)
+                inserted += len(rows)
+                rejected += len(invalid)
+                for row, flags in invalid.head(MAX_REPORTED_ERRORS - len(examples)).iterrows():
+                    columns = ", ".join(flags.index[flags.to_numpy()])
+                    examples.append(f"{_source_name(source)} row {row}: missing or invalid {columns}")
+            logger.info(f"Loaded {_source_name(source)}: {inserted} rows so far")
+
+        for _, sql in indexes:
+            conn.execute(sql)
+        add_to_rollup(conn, last_record_id)
+        create_rollup_triggers(conn)
+        create_version_triggers(conn)
+        bump_data_version(conn, inserted)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Error ingesting files: {str(e)}")
+        return False, f"Error ingesting files, nothing was loaded: {str(e)}"
+    finally:
+        conn.close()
+
+    elapsed = time.perf_counter() - started
+    message = f"Loaded {inserted:,} rows in {elapsed:.1f}s ({inserted / elapsed:,.0f} rows/s)"
+    if rejected:
+        message += f"; skipped {rejected:,} invalid rows, e.g. " + "; ".join(examples)
+    logger.info(message)
+    return True, message
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-load CSV or Excel files into sales_data.")
+    parser.add_argument("files", nargs="+", help="CSV or .xlsx files with a header row")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_ROWS, help="rows read and inserted at a time")
+    parser.add_argument("--keep-indexes", action="store_true",
+                        help="update indexes row by row instead of rebuilding them after the load")
+    args = parser.parse_args()
+    missing = [path for path in args.files if not os.path.exists(path)]
+    if missing:
+        parser.error(f"no such file: {', '.join(missing)}")
+    success, message = ingest(args.files, args.chunk_size, defer_indexes=not args.keep_indexes)
+    print(message)
+    if not success:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
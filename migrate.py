@@ -0,0 +1,393 @@
+"""Schema migrations for the sales database.
+
+Each migration runs once, in its own transaction, and the number of applied
+migrations is tracked in SQLite's ``PRAGMA user_version``. Run
+
+    python migrate.py [path/to/sales_data.db]
+
+before deploying to apply them up front. The dashboard also applies any
+pending migrations the first time it connects, so an older database keeps
+working without manual steps.
+"""
+import logging
+import sqlite3
+import sys
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DB_PATH = "sales_data.db"
+
+def _add_record_key(conn):
+    """Rebuild sales_data with a RecordID primary key, a day column and indexes.
+
+    ``RecordID INTEGER PRIMARY KEY`` aliases the rowid, so existing rowids are
+    kept and, unlike a bare rowid, never renumbered by VACUUM. InvoiceDate is
+    rewritten as 'YYYY-MM-DD HH:MM:SS' so that text comparisons on the index
+    order correctly, and InvoiceDay holds just the date part.
+    """
+    conn.execute("""
+        CREATE TABLE sales_data_new (
+            RecordID INTEGER PRIMARY KEY,
+            Retailer TEXT,
+            RetailerID INTEGER,
+            InvoiceDate TIMESTAMP,
+            Region TEXT,
+            State TEXT,
+            City TEXT,
+            Product TEXT,
+            PriceperUnit REAL,
+            UnitsSold INTEGER,
+            TotalSales REAL,
+            OperatingProfit REAL,
+            OperatingMargin REAL,
+            SalesMethod TEXT,
+            InvoiceDay TEXT GENERATED ALWAYS AS (date(InvoiceDate)) STORED
+        )
+    """)
+    conn.execute("""
+        INSERT INTO sales_data_new (
+            RecordID, Retailer, RetailerID, InvoiceDate, Region, State, City, Product,
+            PriceperUnit, UnitsSold, TotalSales, OperatingProfit, OperatingMargin, SalesMethod
+        )
+        SELECT
+            rowid, Retailer, RetailerID, COALESCE(datetime(InvoiceDate), InvoiceDate), Region, State, City, Product,
+            PriceperUnit, UnitsSold, TotalSales, OperatingProfit, OperatingMargin, SalesMethod
+        FROM sales_data
+    """)
+    conn.execute("DROP TABLE sales_data")
+    conn.execute("ALTER TABLE sales_data_new RENAME TO sales_data")
+    conn.execute("CREATE INDEX idx_sales_invoice_date ON sales_data (InvoiceDate)")
+    conn.execute("CREATE INDEX idx_sales_retailer_date ON sales_data (Retailer, InvoiceDate)")
+    conn.execute("CREATE INDEX idx_sales_state_date ON sales_data (State, InvoiceDate)")
+    conn.execute("CREATE INDEX idx_sales_product_date ON sales_data (Product, InvoiceDate)")
+
+def _add_region_index(conn):
+    """Index Region filters, which the dashboard pushes down to SQL."""
+    conn.execute("CREATE INDEX idx_sales_region_date ON sales_data (Region, InvoiceDate)")
+
+# Dimensions of the sales_daily_agg rollup, besides the invoice day
+ROLLUP_DIMENSIONS = ["Retailer", "Region", "State", "City", "Product", "SalesMethod"]
+
+def _rollup_key(row):
+    """SQL matching one rollup row to the OLD/NEW sales_data row in a trigger."""
+    conditions = [f"InvoiceDay = COALESCE(date({row}.InvoiceDate), '')"]
+    conditions += [f"{dim} = COALESCE({row}.{dim}, '')" for dim in ROLLUP_DIMENSIONS]
+    return " AND ".join(conditions)
+
+def _rollup_add(row):
+    """Trigger statement adding one sales_data row to the rollup."""
+    dims = ", ".join(ROLLUP_DIMENSIONS)
+    dim_values = ", ".join(f"COALESCE({row}.{dim}, '')" for dim in ROLLUP_DIMENSIONS)
+    return f"""
+        INSERT INTO sales_daily_agg (
+            InvoiceDay, {dims}, TotalSales, UnitsSold, OperatingProfit,
+            MarginSum, MarginCount, SalesCount, RecordCount
+        ) VALUES (
+            COALESCE(date({row}.InvoiceDate), ''), {dim_values},
+            COALESCE({row}.TotalSales, 0), COALESCE({row}.UnitsSold, 0), COALESCE({row}.OperatingProfit, 0),
+            COALESCE({row}.OperatingMargin, 0), {row}.OperatingMargin IS NOT NULL, {row}.TotalSales IS NOT NULL, 1
+        )
+        ON CONFLICT (InvoiceDay, {dims}) DO UPDATE SET
+            TotalSales = TotalSales + excluded.TotalSales,
+            UnitsSold = UnitsSold + excluded.UnitsSold,
+            OperatingProfit = OperatingProfit + excluded.OperatingProfit,
+            MarginSum = MarginSum + excluded.MarginSum,
+            MarginCount = MarginCount + excluded.MarginCount,
+            SalesCount = SalesCount + excluded.SalesCount,
+            RecordCount = RecordCount + 1;
+    """
+
+def _rollup_remove(row):
+    """Trigger statements taking one sales_data row out of the rollup."""
+    key = _rollup_key(row)
+    return f"""
+        UPDATE sales_daily_agg SET
+            TotalSales = TotalSales - COALESCE({row}.TotalSales, 0),
+            UnitsSold = UnitsSold - COALESCE({row}.UnitsSold, 0),
+            OperatingProfit = OperatingProfit - COALESCE({row}.OperatingProfit, 0),
+            MarginSum = MarginSum - COALESCE({row}.OperatingMargin, 0),
+            MarginCount = MarginCount - ({row}.OperatingMargin IS NOT NULL),
+            SalesCount = SalesCount - ({row}.TotalSales IS NOT NULL),
+            RecordCount = RecordCount - 1
+        WHERE {key};
+        DELETE FROM sales_daily_agg WHERE {key} AND RecordCount <= 0;
+    """
+
+def create_rollup_triggers(conn):
+    """(Re)create the triggers that keep sales_daily_agg in step with sales_data."""
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_sales_agg_insert AFTER INSERT ON sales_data
+        BEGIN {_rollup_add("NEW")} END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_sales_agg_delete AFTER DELETE ON sales_data
+        BEGIN {_rollup_remove("OLD")} END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_sales_agg_update AFTER UPDATE ON sales_data
+        BEGIN {_rollup_remove("OLD")} {_rollup_add("NEW")} END
+    """)
+
+def drop_rollup_triggers(conn):
+    """Drop the rollup triggers, e.g. around a bulk load followed by rebuild_rollup."""
+    for name in ["trg_sales_agg_insert", "trg_sales_agg_delete", "trg_sales_agg_update"]:
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+def _rollup_insert(where):
+    """SQL aggregating the sales_data rows matching ``where`` into rollup rows."""
+    dims = ", ".join(ROLLUP_DIMENSIONS)
+    dim_values = ", ".join(f"COALESCE({dim}, '')" for dim in ROLLUP_DIMENSIONS)
+    return f"""
+        INSERT INTO sales_daily_agg (
+            InvoiceDay, {dims}, TotalSales, UnitsSold, OperatingProfit,
+            MarginSum, MarginCount, SalesCount, RecordCount
+        )
+        SELECT
+            COALESCE(date(InvoiceDate), ''), {dim_values},
+            SUM(COALESCE(TotalSales, 0)), SUM(COALESCE(UnitsSold, 0)), SUM(COALESCE(OperatingProfit, 0)),
+            SUM(COALESCE(OperatingMargin, 0)), COUNT(OperatingMargin), COUNT(TotalSales), COUNT(*)
+        FROM sales_data
+        WHERE {where}
+        GROUP BY 1, {dims}
+    """
+
+def rebuild_rollup(conn):
+    """Recompute sales_daily_agg from scratch."""
+    conn.execute("DELETE FROM sales_daily_agg")
+    conn.execute(_rollup_insert("true"))
+
+def add_to_rollup(conn, after_record_id):
+    """Add the rows with a RecordID above ``after_record_id`` to sales_daily_agg.
+
+    Used after appending in bulk with the rollup triggers dropped; the cost
+    is proportional to the number of new rows, not the size of the table.
+    """
+    dims = ", ".join(ROLLUP_DIMENSIONS)
+    conn.execute(_rollup_insert("RecordID > ?") + f"""
+        ON CONFLICT (InvoiceDay, {dims}) DO UPDATE SET
+            TotalSales = TotalSales + excluded.TotalSales,
+            UnitsSold = UnitsSold + excluded.UnitsSold,
+            OperatingProfit = OperatingProfit + excluded.OperatingProfit,
+            MarginSum = MarginSum + excluded.MarginSum,
+            MarginCount = MarginCount + excluded.MarginCount,
+            SalesCount = SalesCount + excluded.SalesCount,
+            RecordCount = RecordCount + excluded.RecordCount
+    """, (after_record_id,))
+
+def _add_daily_rollup(conn):
+    """Create the sales_daily_agg rollup (day x dimensions), its triggers and contents.
+
+    Missing dimension values are stored as '' so that they take part in the
+    primary key; NULL would make every such row distinct.
+    """
+    dims = ",\n            ".join(f"{dim} TEXT NOT NULL" for dim in ROLLUP_DIMENSIONS)
+    conn.execute(f"""
+        CREATE TABLE sales_daily_agg (
+            InvoiceDay TEXT NOT NULL,
+            {dims},
+            TotalSales REAL NOT NULL,
+            UnitsSold INTEGER NOT NULL,
+            OperatingProfit REAL NOT NULL,
+            MarginSum REAL NOT NULL,
+            MarginCount INTEGER NOT NULL,
+            SalesCount INTEGER NOT NULL,
+            RecordCount INTEGER NOT NULL,
+            PRIMARY KEY (InvoiceDay, {", ".join(ROLLUP_DIMENSIONS)})
+        ) WITHOUT ROWID
+    """)
+    rebuild_rollup(conn)
+    create_rollup_triggers(conn)
+
+_VERSION_TRIGGERS = {
+    "trg_sales_version_insert": "AFTER INSERT",
+    "trg_sales_version_update": "AFTER UPDATE",
+    "trg_sales_version_delete": "AFTER DELETE",
+}
+
+def create_version_triggers(conn):
+    """(Re)create the triggers that bump the data version for every changed row."""
+    for name, event in _VERSION_TRIGGERS.items():
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {name} {event} ON sales_data
+            BEGIN
+                UPDATE sales_meta SET value = value + 1 WHERE key = 'data_version';
+            END
+        """)
+
+def drop_version_triggers(conn):
+    """Drop the data version triggers; bulk loads call bump_data_version instead."""
+    for name in _VERSION_TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+def bump_data_version(conn, amount=1):
+    """Advance the data version by ``amount`` inside the caller's transaction."""
+    conn.execute("UPDATE sales_meta SET value = value + ? WHERE key = 'data_version'", (amount,))
+
+def _add_data_version(conn):
+    """Add sales_meta with a data version that every change to sales_data bumps.
+
+    Caches that outlive a process (persisted forecasts, report files) key on
+    it, and it lets a process notice writes made by another one.
+    """
+    conn.execute("CREATE TABLE sales_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+    conn.execute("INSERT INTO sales_meta (key, value) VALUES ('data_version', 0)")
+    create_version_triggers(conn)
+
+def _add_sales_forecasts(conn):
+    """Add sales_forecasts, written by batch_forecast.py.
+
+    It holds one predicted series per (Dimension, Value), e.g. ('Retailer',
+    'Amazon'), with the data version the model was fitted on.
+    """
+    conn.execute("""
+        CREATE TABLE sales_forecasts (
+            Dimension TEXT NOT NULL,
+            Value TEXT NOT NULL,
+            ds TEXT NOT NULL,
+            yhat REAL,
+            yhat_lower REAL,
+            yhat_upper REAL,
+            DataVersion INTEGER NOT NULL,
+            PRIMARY KEY (Dimension, Value, ds)
+        ) WITHOUT ROWID
+    """)
+
+def _add_users(conn):
+    """Add the users and sessions tables and import the accounts in users.json.
+
+    Passwords are stored as salted hashes (see user_store.hash_password).
+    users.json is left in place but no longer read; delete it once the import
+    has been checked, since it holds the old plaintext passwords.
+    """
+    import json
+    import os
+
+    from user_store import USER_DB, hash_password
+
+    conn.execute("""
+        CREATE TABLE users (
+            username TEXT PRIMARY KEY,
+            password_hash TEXT NOT NULL,
+            role TEXT NOT NULL,
+            reset_token_hash TEXT,
+            reset_token_expiry REAL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE sessions (
+            token_hash TEXT PRIMARY KEY,
+            username TEXT NOT NULL REFERENCES users (username),
+            expires_at REAL NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX idx_sessions_username ON sessions (username)")
+
+    if os.path.exists(USER_DB):
+        with open(USER_DB, "r") as file:
+            users = json.load(file)
+        conn.executemany(
+            "INSERT INTO users (username, password_hash, role) VALUES (?, ?, ?)",
+            [(username, hash_password(user["password"]), user["role"]) for username, user in users.items()],
+        )
+        logger.info(f"Imported {len(users)} users from {USER_DB}; it can now be deleted")
+
+def _add_report_jobs(conn):
+    """Add report_jobs, the queue of background report exports (see report_jobs.py).
+
+    A job holds its export spec, status, progress and, once done, the path
+    of the written file, so its state survives reruns and browser refreshes.
+    """
+    conn.execute("""
+        CREATE TABLE report_jobs (
+            job_id TEXT PRIMARY KEY,
+            username TEXT,
+            report_type TEXT NOT NULL,
+            export_format TEXT NOT NULL,
+            filters TEXT NOT NULL,
+            status TEXT NOT NULL,
+            progress REAL NOT NULL DEFAULT 0,
+            message TEXT,
+            output_path TEXT,
+            rows INTEGER,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL
+        )
+    """)
+    conn.execute("CREATE INDEX idx_report_jobs_username ON report_jobs (username, created_at)")
+
+def _add_report_schedules(conn):
+    """Add report_schedules, the recurring exports run by scheduler.py.
+
+    ``cron`` is a five-field cron spec in server local time. With
+    ``window_days`` set, each run covers the days before it instead of the
+    stored start and end dates.
+    """
+    conn.execute("""
+        CREATE TABLE report_schedules (
+            schedule_id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE,
+            cron TEXT NOT NULL,
+            report_type TEXT NOT NULL,
+            export_format TEXT NOT NULL,
+            filters TEXT NOT NULL,
+            window_days INTEGER,
+            enabled INTEGER NOT NULL DEFAULT 1,
+            next_run_at REAL NOT NULL,
+            last_run_at REAL,
+            last_status TEXT,
+            last_message TEXT,
+            last_output_path TEXT,
+            last_rows INTEGER
+        )
+    """)
+    conn.execute("CREATE INDEX idx_report_schedules_next_run ON report_schedules (enabled, next_run_at)")
+
+# Append new migrations to the end; never reorder or remove entries
+MIGRATIONS = [
+    _add_record_key,
+    _add_region_index,
+    _add_daily_rollup,
+    _add_data_version,
+    _add_sales_forecasts,
+    _add_users,
+    _add_report_jobs,
+    _add_report_schedules,
+]
+
+def schema_version(conn):
+    """Return the number of migrations already applied to the database."""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def migrate(conn):
+    """Apply all pending migrations and return the resulting schema version."""
+    version = schema_version(conn)
+    for number, step in enumerate(MIGRATIONS[version:], start=version + 1):
+        logger.info(f"Applying migration {number}: {step.__name__}")
+        conn.execute("BEGIN")
+        try:
+            step(conn)
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        version = number
+    return version
+
+def main():
+    db_path = sys.argv[1] if len(sys.argv) > 1 else DB_PATH
+    conn = sqlite3.connect(db_path)
+    try:
+        before = schema_version(conn)
+        after = migrate(conn)
+    finally:
+        conn.close()
+    if after == before:
+        print(f"{db_path} is up to date (schema version {after}).")
+    else:
+        print(f"Migrated {db_path} from schema version {before} to {after}.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Process-wide cache of dashboard query results.
+
+Every Streamlit rerun recomputes the dashboard's aggregates, although most
+reruns, and most sessions, ask for the same filter selection. Results are
+therefore kept in memory, shared by all sessions of the server process, and
+keyed by a query name, the filter signature (see dataset.filter_signature)
+and the data version, so a write to sales_data makes every older result
+unreachable at once.
+
+Entries also expire after RESULT_CACHE_TTL seconds, which bounds how stale
+a result can be if the table is ever changed without bumping the version,
+and the least recently used ones are dropped beyond RESULT_CACHE_ENTRIES.
+When several sessions miss on the same key at once, one computes the result
+and the others wait for it.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from dataset import data_version, filter_signature
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_ENTRIES = 256
+RESULT_CACHE_TTL = 10 * 60
+
+_lock = threading.Lock()
+_entries = OrderedDict()   # (name, signature, version) -> (stored at, result)
+_in_flight = {}            # (name, signature, version) -> Future
+_stats = {"hits": 0, "misses": 0, "waits": 0, "expired": 0, "evicted": 0}
+_version = None            # newest data version seen
+
+def cached(name, filters, compute, version=None):
+    """Return ``compute()`` for a query, computing it once per filters and data version.
+
+    ``name`` identifies the query (any hashable value) and ``filters`` is a
+    dataset filter dict. ``version`` defaults to the current data version.
+    The result is shared, so callers must not modify it in place.
+    """
+    global _version
+    if version is None:
+        version = data_version()
+    key = (name, filter_signature(filters), version)
+    now = time.monotonic()
+    with _lock:
+        if _version is None or version > _version:
+            # Results for older versions can never be hit again
+            _version = version
+            _entries.clear()
+        entry = _entries.get(key)
+        if entry is not None:
+            if now - entry[0] < RESULT_CACHE_TTL:
+                _entries.move_to_end(key)
+                _stats["hits"] += 1
+                return entry[1]
+            del _entries[key]
+            _stats["expired"] += 1
+        future = _in_flight.get(key)
+        if future is None:
+            future = _in_flight[key] = Future()
+            _stats["misses"] += 1
+            computing = True
+        else:
+            _stats["waits"] += 1
+            computing = False
+
+    if not computing:
+        return future.result()
+    try:
+        result = compute()
+    except BaseException as e:
+        with _lock:
+            del _in_flight[key]
+        future.set_exception(e)
+        raise
+    with _lock:
+        del _in_flight[key]
+        if version >= _version:
+            _entries[key] = (time.monotonic(), result)
+            while len(_entries) > RESULT_CACHE_ENTRIES:
+                _entries.popitem(last=False)
+                _stats["evicted"] += 1
+    future.set_result(result)
+    return result
+
+def stats():
+    """Return the cache counters and its current number of entries."""
+    with _lock:
+        return {**_stats, "entries": len(_entries)}
+
+def clear():
+    """Drop all cached results."""
+    with _lock:
+        _entries.clear()
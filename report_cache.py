@@ -0,0 +1,123 @@
+"""On-disk cache of finished report exports.
+
+An export is fully determined by its report type, filters, format and the
+data version, so a finished file is stored under a hash of those and served
+again for any identical request until the data changes. CSV, Parquet and
+Arrow IPC exports hold only the raw rows, so they are shared by all report
+types.
+
+Each entry is the export file plus a small JSON sidecar with its row count.
+The sidecar's modification time records the last use; once the cache grows
+past REPORT_CACHE_MAX_BYTES the least recently used entries are removed,
+except the one just stored. Entries for older data versions are never hit
+again and age out the same way. Files are moved into place atomically, so
+the cache can be shared by the server and the report workers.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+from dataset import filter_signature
+from reports import EXPORT_FORMATS
+
+logger = logging.getLogger(__name__)
+
+REPORT_CACHE_DIR = "report_cache"
+REPORT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+# Unfinished files older than this are left over from crashed workers
+PARTIAL_MAX_AGE = 24 * 60 * 60
+
+_PARTIAL_PREFIX = "partial-"
+
+def cache_key(report_type, filters, export_format, version):
+    """Return the cache key of an export of ``filters`` at data version ``version``."""
+    if export_format != "Excel":
+        report_type = None
+    signature = json.dumps(
+        [report_type, filter_signature(filters), export_format, version]
+    )
+    return hashlib.sha256(signature.encode("utf-8")).hexdigest()
+
+def _paths(key, export_format):
+    base = os.path.join(os.path.abspath(REPORT_CACHE_DIR), key)
+    return base + EXPORT_FORMATS[export_format][0], base + ".json"
+
+def lookup(key, export_format):
+    """Return (path, rows) of a cached export and mark it as used, or None."""
+    path, meta_path = _paths(key, export_format)
+    try:
+        with open(meta_path, "r") as file:
+            rows = json.load(file)["rows"]
+        if not os.path.exists(path):
+            return None
+        os.utime(meta_path)
+    except (OSError, ValueError, KeyError):
+        return None
+    return path, rows
+
+def new_partial_path(export_format):
+    """Return a fresh path in the cache directory to write an export to."""
+    os.makedirs(REPORT_CACHE_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(
+        prefix=_PARTIAL_PREFIX, suffix=EXPORT_FORMATS[export_format][0], dir=REPORT_CACHE_DIR
+    )
+    os.close(fd)
+    return os.path.abspath(path)
+
+def store(key, export_format, partial_path, rows):
+    """Move a finished export from new_partial_path into the cache and return its path."""
+    path, meta_path = _paths(key, export_format)
+    os.replace(partial_path, path)
+    fd, meta_partial = tempfile.mkstemp(prefix=_PARTIAL_PREFIX, suffix=".json", dir=REPORT_CACHE_DIR)
+    with os.fdopen(fd, "w") as file:
+        json.dump({"rows": rows, "export_format": export_format}, file)
+    os.replace(meta_partial, meta_path)
+    evict(keep=key)
+    return path
+
+def evict(max_bytes=REPORT_CACHE_MAX_BYTES, keep=None):
+    """Remove least recently used entries until the cache fits in ``max_bytes``.
+
+    The entry ``keep`` is never removed, so an export larger than the whole
+    cache can still be downloaded by the job that just stored it.
+    """
+    entries = {}   # key -> [last used, size, paths]
+    now = time.time()
+    for entry in os.scandir(REPORT_CACHE_DIR):
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        if entry.name.startswith(_PARTIAL_PREFIX):
+            if stat.st_mtime < now - PARTIAL_MAX_AGE:
+                _remove(entry.path)
+            continue
+        key, extension = entry.name.split(".", 1)
+        info = entries.setdefault(key, [0.0, 0, []])
+        info[1] += stat.st_size
+        info[2].append(entry.path)
+        if extension == "json":
+            info[0] = stat.st_mtime
+
+    total = sum(info[1] for info in entries.values())
+    removed = 0
+    for key, (_, size, paths) in sorted(entries.items(), key=lambda item: item[1][0]):
+        if total <= max_bytes:
+            break
+        if key == keep:
+            continue
+        for path in paths:
+            _remove(path)
+        total -= size
+        removed += 1
+    if removed:
+        logger.info(f"Evicted {removed} cached reports; {total / 1024 ** 2:.1f} MiB remain")
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
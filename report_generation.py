@@ -1,207 +1,18 @@
 import streamlit as st
-import pandas as pd
 from datetime import datetime
-import sqlite3
-import numpy as np
+from functools import partial
+import os
 import plotly.express as px
-import plotly.graph_objects as go
-import plotly.io as pio
-from io import BytesIO
-import pydeck as pdk
 
-def get_connection():
-    return sqlite3.connect("sales_data.db")
+from dataset import get_filter_options
+from rollup import aggregate_sales
+from charts import show_chart
+from report_jobs import DONE, FAILED, QUEUED, RUNNING, list_jobs, submit_job
+from reports import EXPORT_FORMATS, report_file_name
+from scheduler import DONE as SCHEDULE_DONE, list_schedules
 
-def fetch_data():
-    conn = get_connection()
-    query = "SELECT * FROM sales_data"
-    df = pd.read_sql(query, conn)
-    conn.close()
-    df["InvoiceDate"] = pd.to_datetime(df["InvoiceDate"])
-    return df
-
-def calculate_metrics(data):
-    metrics = {
-        "total_sales": data["TotalSales"].sum(),
-        "total_units": data["UnitsSold"].sum(),
-        "avg_sale": data["TotalSales"].mean(),
-        "profit_margin": (data["OperatingProfit"].sum() / data["TotalSales"].sum()) * 100,
-        "top_retailer": data.groupby("Retailer")["TotalSales"].sum().idxmax(),
-        "top_product": data.groupby("Product")["TotalSales"].sum().idxmax(),
-        "top_state": data.groupby("State")["TotalSales"].sum().idxmax()
-    }
-    return metrics
-
-def generate_excel_report(data, report_type, date_range=None):
-    # Create progress bar
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-    
-    progress_bar.progress(20)
-    status_text.text("Preparing data...")
-    
-    # Create Excel writer
-    filename = f"Sales_Report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    writer = pd.ExcelWriter(filename, engine='xlsxwriter')
-    
-    # 1. Summary Metrics
-    progress_bar.progress(30)
-    status_text.text("Creating summary metrics...")
-    
-    metrics = calculate_metrics(data)
-    summary_data = {
-        'Metric': [
-            'Total Sales',
-            'Total Units Sold',
-            'Average Sale',
-            'Profit Margin',
-            'Top Retailer',
-            'Top Product',
-            'Top State'
-        ],
-        'Value': [
-            f"${metrics['total_sales']:,.2f}",
-            f"{metrics['total_units']:,}",
-            f"${metrics['avg_sale']:,.2f}",
-            f"{metrics['profit_margin']:.2f}%",
-            metrics['top_retailer'],
-            metrics['top_product'],
-            metrics['top_state']
-        ]
-    }
-    pd.DataFrame(summary_data).to_excel(writer, sheet_name='Summary', index=False)
-    
-    # 2. Sales Trend
-    progress_bar.progress(40)
-    status_text.text("Analyzing sales trends...")
-    
-    daily_sales = data.groupby('InvoiceDate').agg({
-        'TotalSales': 'sum',
-        'UnitsSold': 'sum',
-        'OperatingProfit': 'sum'
-    }).reset_index()
-    daily_sales.to_excel(writer, sheet_name='Daily Sales', index=False)
-    
-    # 3. Product Performance
-    progress_bar.progress(50)
-    status_text.text("Analyzing product performance...")
-    
-    product_performance = data.groupby('Product').agg({
-        'TotalSales': 'sum',
-        'UnitsSold': 'sum',
-        'OperatingProfit': 'sum'
-    }).reset_index()
-    product_performance['Profit Margin'] = (product_performance['OperatingProfit'] / product_performance['TotalSales'] * 100)
-    product_performance = product_performance.sort_values('TotalSales', ascending=False)
-    product_performance.to_excel(writer, sheet_name='Product Performance', index=False)
-    
-    # 4. Regional Analysis
-    progress_bar.progress(60)
-    status_text.text("Analyzing regional performance...")
-    
-    regional_performance = data.groupby(['Region', 'State']).agg({
-        'TotalSales': 'sum',
-        'UnitsSold': 'sum',
-        'OperatingProfit': 'sum'
-    }).reset_index()
-    regional_performance['Profit Margin'] = (regional_performance['OperatingProfit'] / regional_performance['TotalSales'] * 100)
-    regional_performance = regional_performance.sort_values('TotalSales', ascending=False)
-    regional_performance.to_excel(writer, sheet_name='Regional Analysis', index=False)
-    
-    # 5. Retailer Analysis
-    progress_bar.progress(70)
-    status_text.text("Analyzing retailer performance...")
-    
-    retailer_performance = data.groupby('Retailer').agg({
-        'TotalSales': 'sum',
-        'UnitsSold': 'sum',
-        'OperatingProfit': 'sum'
-    }).reset_index()
-    retailer_performance['Profit Margin'] = (retailer_performance['OperatingProfit'] / retailer_performance['TotalSales'] * 100)
-    retailer_performance = retailer_performance.sort_values('TotalSales', ascending=False)
-    retailer_performance.to_excel(writer, sheet_name='Retailer Performance', index=False)
-    
-    # 6. Monthly Trends
-    progress_bar.progress(80)
-    status_text.text("Analyzing monthly trends...")
-    
-    data['Month'] = data['InvoiceDate'].dt.to_period('M')
-    monthly_trends = data.groupby('Month').agg({
-        'TotalSales': 'sum',
-        'UnitsSold': 'sum',
-        'OperatingProfit': 'sum'
-    }).reset_index()
-    monthly_trends['Month'] = monthly_trends['Month'].astype(str)
-    monthly_trends['Growth Rate'] = monthly_trends['TotalSales'].pct_change() * 100
-    monthly_trends.to_excel(writer, sheet_name='Monthly Trends', index=False)
-    
-    # Format the Excel file
-    progress_bar.progress(90)
-    status_text.text("Formatting Excel file...")
-    
-    workbook = writer.book
-    
-    # Add formats
-    header_format = workbook.add_format({
-        'bold': True,
-        'bg_color': '#D3D3D3',
-        'border': 1
-    })
-    
-    number_format = workbook.add_format({
-        'num_format': '#,##0.00',
-        'border': 1
-    })
-    
-    percent_format = workbook.add_format({
-        'num_format': '0.00%',
-        'border': 1
-    })
-    
-    # Apply formats to each sheet
-    for sheet_name in writer.sheets:
-        worksheet = writer.sheets[sheet_name]
-        worksheet.set_column('A:Z', 15)  # Set column width
-        
-        # Get the dataframe for this sheet
-        if sheet_name == 'Summary':
-            df = pd.DataFrame(summary_data)
-        elif sheet_name == 'Daily Sales':
-            df = daily_sales
-        elif sheet_name == 'Product Performance':
-            df = product_performance
-        elif sheet_name == 'Regional Analysis':
-            df = regional_performance
-        elif sheet_name == 'Retailer Performance':
-            df = retailer_performance
-        elif sheet_name == 'Monthly Trends':
-            df = monthly_trends
-        
-        # Format headers
-        for col_num, value in enumerate(df.columns):
-            worksheet.write(0, col_num, value, header_format)
-        
-        # Format numbers and handle NaN values
-        for row in range(1, len(df) + 1):
-            for col in range(len(df.columns)):
-                cell_value = df.iloc[row-1, col]
-                if pd.isna(cell_value) or cell_value is None:  # Handle NaN and None values
-                    worksheet.write_blank(row, col, None)
-                elif isinstance(cell_value, (int, float)):
-                    if 'Margin' in df.columns[col] or 'Rate' in df.columns[col]:
-                        worksheet.write_number(row, col, cell_value, percent_format)
-                    else:
-                        worksheet.write_number(row, col, cell_value, number_format)
-                else:
-                    worksheet.write(row, col, str(cell_value))
-    
-    # Save the Excel file
-    writer.close()
-    
-    progress_bar.progress(100)
-    status_text.text("Report generation complete!")
-    
-    return filename
+# Seconds between refreshes of the progress of running report jobs
+JOB_POLL_SECONDS = 2
 
 def main():
     st.markdown("<h1 class='main-header'>Report Generation</h1>", unsafe_allow_html=True)
@@ -220,9 +31,9 @@ def main():
         )
         
         # Date range selector
-        df = fetch_data()
-        min_date = df["InvoiceDate"].min()
-        max_date = df["InvoiceDate"].max()
+        options = get_filter_options()
+        min_date = options["min_date"]
+        max_date = options["max_date"]
         date_range = st.date_input(
             "Select Date Range",
             value=(min_date, max_date),
@@ -231,102 +42,169 @@ def main():
         )
         
         # Retailer filter
-        retailers = ["All"] + sorted(df["Retailer"].unique().tolist())
+        retailers = ["All"] + options["Retailer"]
         selected_retailer = st.selectbox("Filter by Retailer", retailers)
         
         # Region filter
-        regions = ["All"] + sorted(df["Region"].unique().tolist())
+        regions = ["All"] + options["Region"]
         selected_region = st.selectbox("Filter by Region", regions)
         
         # Product filter
-        products = ["All"] + sorted(df["Product"].unique().tolist())
+        products = ["All"] + options["Product"]
         selected_product = st.selectbox("Filter by Product", products)
     
-    # Apply filters
-    filtered_df = df[
-        (df["InvoiceDate"].dt.date >= date_range[0]) &
-        (df["InvoiceDate"].dt.date <= date_range[1])
-    ]
-    
-    if selected_retailer != "All":
-        filtered_df = filtered_df[filtered_df["Retailer"] == selected_retailer]
-    if selected_region != "All":
-        filtered_df = filtered_df[filtered_df["Region"] == selected_region]
-    if selected_product != "All":
-        filtered_df = filtered_df[filtered_df["Product"] == selected_product]
+    # Apply filters in SQLite
+    filters = {
+        "start_date": date_range[0],
+        "end_date": date_range[1] if len(date_range) == 2 else date_range[0],
+        "Retailer": [selected_retailer] if selected_retailer != "All" else None,
+        "Region": [selected_region] if selected_region != "All" else None,
+        "Product": [selected_product] if selected_product != "All" else None,
+    }
     
-    # Generate report based on type
+    # Generate report based on type, from the daily rollup
     if report_type == "Sales Summary":
-        generate_sales_summary(filtered_df)
+        generate_sales_summary(filters)
     elif report_type == "Product Performance":
-        generate_product_performance(filtered_df)
+        generate_product_performance(filters)
     else:  # Regional Analysis
-        generate_regional_analysis(filtered_df)
+        generate_regional_analysis(filters)
     
     # Export options
     st.markdown("### Export Report")
-    export_format = st.selectbox("Select Export Format", ["Excel", "CSV"])
+    export_format = st.selectbox("Select Export Format", list(EXPORT_FORMATS))
+    username = st.session_state.get("username")
     
     if st.button("Export Report"):
-        if export_format == "Excel":
-            export_to_excel(filtered_df, report_type)
-            st.success("Report exported to Excel successfully!")
-        else:
-            export_to_csv(filtered_df, report_type)
-            st.success("Report exported to CSV successfully!")
+        submit_job(report_type, filters, export_format, username)
+        st.success("Report queued! It will be ready to download below.")
+    
+    show_report_jobs(username)
+    show_scheduled_reports()
+
+def read_report_file(path):
+    """Return the contents of a finished export.
 
-def generate_sales_summary(df):
+    Passed to st.download_button through functools.partial, so a file is
+    only read when its download is clicked, not on every rerun of the page.
+    """
+    with open(path, "rb") as file:
+        return file.read()
+
+def show_report_jobs(username):
+    """List the user's recent exports, with downloads for the finished ones.
+
+    Progress of queued and running jobs is polled in a fragment, so only
+    that part of the page refreshes until they finish.
+    """
+    jobs = list_jobs(username)
+    if not jobs:
+        return
+    st.markdown("### Your Reports")
+    for job in jobs:
+        if job["status"] == DONE:
+            # The file is only opened when the download is clicked, so this
+            # check just hides exports the cache has already evicted
+            if not os.path.exists(job["output_path"]):
+                st.caption(f"{job['report_type']} ({job['export_format']}): expired, please export again")
+                continue
+            created = datetime.fromtimestamp(job["created_at"])
+            st.download_button(
+                label=f"📥 Download {job['report_type']} ({job['export_format']}, {job['rows']:,} rows)",
+                data=partial(read_report_file, job["output_path"]),
+                file_name=report_file_name(job["report_type"], job["export_format"], created),
+                mime=EXPORT_FORMATS[job["export_format"]][1],
+                key=f"download_{job['job_id']}"
+            )
+        elif job["status"] == FAILED:
+            st.error(f"{job['report_type']} ({job['export_format']}) failed: {job['message']}")
+    if any(job["status"] in (QUEUED, RUNNING) for job in jobs):
+        poll_report_jobs(username)
+
+def show_scheduled_reports():
+    """Offer the latest file of every schedule pre-rendered by scheduler.py."""
+    ready = []
+    for schedule in list_schedules():
+        if not (schedule["enabled"] and schedule["last_output_path"]):
+            continue
+        # Old outputs are pruned by the scheduler
+        try:
+            ready.append((schedule, os.stat(schedule["last_output_path"]).st_mtime))
+        except FileNotFoundError:
+            continue
+    if not ready:
+        return
+    st.markdown("### Scheduled Reports")
+    for schedule, modified in ready:
+        generated = datetime.fromtimestamp(modified)
+        if schedule["last_status"] != SCHEDULE_DONE:
+            st.warning(f"{schedule['name']}: the last run failed ({schedule['last_message']}); showing an older file")
+        st.download_button(
+            label=f"📥 {schedule['name']}: {schedule['report_type']} ({schedule['export_format']}, generated {generated:%Y-%m-%d %H:%M})",
+            data=partial(read_report_file, schedule["last_output_path"]),
+            file_name=os.path.basename(schedule["last_output_path"]),
+            mime=EXPORT_FORMATS[schedule["export_format"]][1],
+            key=f"schedule_{schedule['schedule_id']}"
+        )
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def poll_report_jobs(username):
+    active = [job for job in list_jobs(username) if job["status"] in (QUEUED, RUNNING)]
+    if not active:
+        # Rerun the page so the finished jobs get their download buttons
+        st.rerun()
+    for job in active:
+        label = f"{job['report_type']} ({job['export_format']}): {job['message'] or 'Queued'}"
+        st.progress(job["progress"], text=label)
+
+def generate_sales_summary(filters):
     st.markdown("## Sales Summary Report")
     
     # Key metrics
+    totals = aggregate_sales(filters=filters).iloc[0]
     col1, col2, col3, col4 = st.columns(4)
     with col1:
-        st.metric("Total Sales", f"${df['TotalSales'].sum():,.2f}")
+        st.metric("Total Sales", f"${totals['TotalSales']:,.2f}")
     with col2:
-        st.metric("Total Units", f"{df['UnitsSold'].sum():,}")
+        st.metric("Total Units", f"{int(totals['UnitsSold']):,}")
     with col3:
-        st.metric("Avg. Order Value", f"${df['TotalSales'].mean():,.2f}")
+        st.metric("Avg. Order Value", f"${totals['AverageSale']:,.2f}")
     with col4:
-        st.metric("Operating Profit", f"${df['OperatingProfit'].sum():,.2f}")
+        st.metric("Operating Profit", f"${totals['OperatingProfit']:,.2f}")
     
     # Sales trend
     st.markdown("### Sales Trend")
-    sales_trend = df.groupby("InvoiceDate")["TotalSales"].sum().reset_index()
+    sales_trend = aggregate_sales(["InvoiceDate"], filters)[["InvoiceDate", "TotalSales"]]
     fig = px.line(sales_trend, x="InvoiceDate", y="TotalSales", title="Daily Sales Trend")
     fig.update_layout(template='plotly_white')
-    st.plotly_chart(fig, use_container_width=True)
+    show_chart(fig)
     
     # Top retailers
     st.markdown("### Top Retailers")
-    top_retailers = df.groupby("Retailer").agg({
-        "TotalSales": "sum",
-        "UnitsSold": "sum",
-        "OperatingProfit": "sum"
-    }).reset_index().sort_values("TotalSales", ascending=False).head(10)
+    top_retailers = aggregate_sales(["Retailer"], filters)[
+        ["Retailer", "TotalSales", "UnitsSold", "OperatingProfit"]
+    ].sort_values("TotalSales", ascending=False).head(10)
     
     fig = px.bar(top_retailers, x="Retailer", y="TotalSales",
                  title="Top 10 Retailers by Sales")
     fig.update_layout(template='plotly_white')
-    st.plotly_chart(fig, use_container_width=True)
+    show_chart(fig)
     
     # Sales method distribution
     st.markdown("### Sales Method Distribution")
-    sales_method = df.groupby("SalesMethod")["TotalSales"].sum().reset_index()
+    sales_method = aggregate_sales(["SalesMethod"], filters)[["SalesMethod", "TotalSales"]]
     fig = px.pie(sales_method, values="TotalSales", names="SalesMethod",
                  title="Sales Distribution by Method")
     fig.update_layout(template='plotly_white')
-    st.plotly_chart(fig, use_container_width=True)
+    show_chart(fig)
 
-def generate_product_performance(df):
+def generate_product_performance(filters):
     st.markdown("## Product Performance Report")
     
     # Product metrics
-    product_metrics = df.groupby("Product").agg({
-        "TotalSales": "sum",
-        "UnitsSold": "sum",
-        "OperatingProfit": "sum",
-        "OperatingMargin": "mean"
-    }).reset_index()
+    product_metrics = aggregate_sales(["Product"], filters)[
+        ["Product", "TotalSales", "UnitsSold", "OperatingProfit", "OperatingMargin"]
+    ]
     
     # Top products by sales
     st.markdown("### Top Products by Sales")
@@ -334,7 +212,7 @@ def generate_product_performance(df):
     fig = px.bar(top_products, x="Product", y="TotalSales",
                  title="Top 10 Products by Sales")
     fig.update_layout(template='plotly_white')
-    st.plotly_chart(fig, use_container_width=True)
+    show_chart(fig)
     
     # Product profitability
     st.markdown("### Product Profitability")
@@ -342,38 +220,36 @@ def generate_product_performance(df):
                     size="UnitsSold", color="Product",
                     title="Product Profitability Analysis")
     fig.update_layout(template='plotly_white')
-    st.plotly_chart(fig, use_container_width=True)
+    show_chart(fig)
     
     # Units sold by product
     st.markdown("### Units Sold by Product")
     fig = px.bar(product_metrics.sort_values("UnitsSold", ascending=False),
                  x="Product", y="UnitsSold", title="Units Sold by Product")
     fig.update_layout(template='plotly_white')
-    st.plotly_chart(fig, use_container_width=True)
+    show_chart(fig)
 
-def generate_regional_analysis(df):
+def generate_regional_analysis(filters):
     st.markdown("## Regional Analysis Report")
     
     # Regional metrics
-    regional_metrics = df.groupby(["Region", "State"]).agg({
-        "TotalSales": "sum",
-        "UnitsSold": "sum",
-        "OperatingProfit": "sum"
-    }).reset_index()
+    regional_metrics = aggregate_sales(["Region", "State"], filters)[
+        ["Region", "State", "TotalSales", "UnitsSold", "OperatingProfit"]
+    ]
     
     # Sales by region
     st.markdown("### Sales by Region")
-    region_sales = regional_metrics.groupby("Region")["TotalSales"].sum().reset_index()
+    region_sales = regional_metrics.groupby("Region", observed=True)["TotalSales"].sum().reset_index()
     fig = px.pie(region_sales, values="TotalSales", names="Region",
                  title="Sales Distribution by Region")
     fig.update_layout(template='plotly_white')
-    st.plotly_chart(fig, use_container_width=True)
+    show_chart(fig)
     
     # State performance using scatterplot map
     st.markdown("### State Performance")
     
     # Prepare data for scatterplot map
-    state_data = regional_metrics.groupby("State").agg({
+    state_data = regional_metrics.groupby("State", observed=True).agg({
         "TotalSales": "sum",
         "UnitsSold": "sum",
         "OperatingProfit": "sum"
@@ -448,7 +324,7 @@ def generate_regional_analysis(df):
         height=600
     )
     
-    st.plotly_chart(fig, use_container_width=True)
+    show_chart(fig)
     
     # Add a bar chart for state performance
     st.markdown("### State Performance (Bar Chart)")
@@ -461,206 +337,16 @@ def generate_regional_analysis(df):
         labels={"TotalSales": "Total Sales ($)", "OperatingProfit": "Operating Profit ($)"}
     )
     fig_bar.update_layout(template='plotly_white')
-    st.plotly_chart(fig_bar, use_container_width=True)
+    show_chart(fig_bar)
     
     # Top cities
     st.markdown("### Top Cities")
-    city_metrics = df.groupby("City")["TotalSales"].sum().reset_index()
+    city_metrics = aggregate_sales(["City"], filters)[["City", "TotalSales"]]
     top_cities = city_metrics.sort_values("TotalSales", ascending=False).head(10)
     fig = px.bar(top_cities, x="City", y="TotalSales",
                  title="Top 10 Cities by Sales")
     fig.update_layout(template='plotly_white')
-    st.plotly_chart(fig, use_container_width=True)
-
-def export_to_excel(df, report_type):
-    """Export the filtered data to Excel with formatting and multiple sheets for each visualization."""
-    try:
-        # Create a BytesIO object to store the Excel file
-        output = BytesIO()
-        
-        # Create Excel writer object
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            workbook = writer.book
-            
-            # Add formats
-            header_format = workbook.add_format({
-                'bold': True,
-                'bg_color': '#1E88E5',
-                'font_color': 'white',
-                'border': 1
-            })
-            
-            number_format = workbook.add_format({
-                'num_format': '#,##0.00',
-                'border': 1
-            })
-            
-            percent_format = workbook.add_format({
-                'num_format': '0.00%',
-                'border': 1
-            })
-
-            # Write Raw Data sheet
-            df.to_excel(writer, sheet_name='Raw Data', index=False)
-            worksheet = writer.sheets['Raw Data']
-            format_worksheet(worksheet, df, header_format, number_format)
-
-            # Create and write sheets based on report type
-            if report_type == "Sales Summary":
-                # Sales Trend Data
-                sales_trend = df.groupby("InvoiceDate")["TotalSales"].sum().reset_index()
-                sales_trend.to_excel(writer, sheet_name='Sales Trend', index=False)
-                format_worksheet(writer.sheets['Sales Trend'], sales_trend, header_format, number_format)
-
-                # Top Retailers Data
-                top_retailers = df.groupby("Retailer").agg({
-                    "TotalSales": "sum",
-                    "UnitsSold": "sum",
-                    "OperatingProfit": "sum"
-                }).reset_index().sort_values("TotalSales", ascending=False)
-                top_retailers.to_excel(writer, sheet_name='Top Retailers', index=False)
-                format_worksheet(writer.sheets['Top Retailers'], top_retailers, header_format, number_format)
-
-                # Sales Method Distribution
-                sales_method = df.groupby("SalesMethod").agg({
-                    "TotalSales": "sum",
-                    "UnitsSold": "sum",
-                    "OperatingProfit": "sum"
-                }).reset_index()
-                sales_method.to_excel(writer, sheet_name='Sales by Method', index=False)
-                format_worksheet(writer.sheets['Sales by Method'], sales_method, header_format, number_format)
-
-            elif report_type == "Product Performance":
-                # Product Metrics
-                product_metrics = df.groupby("Product").agg({
-                    "TotalSales": "sum",
-                    "UnitsSold": "sum",
-                    "OperatingProfit": "sum",
-                    "OperatingMargin": "mean"
-                }).reset_index()
-                product_metrics.to_excel(writer, sheet_name='Product Metrics', index=False)
-                format_worksheet(writer.sheets['Product Metrics'], product_metrics, header_format, number_format)
-
-                # Top Products
-                top_products = product_metrics.sort_values("TotalSales", ascending=False).head(10)
-                top_products.to_excel(writer, sheet_name='Top Products', index=False)
-                format_worksheet(writer.sheets['Top Products'], top_products, header_format, number_format)
+    show_chart(fig)
 
-                # Product Profitability
-                product_profitability = product_metrics[["Product", "TotalSales", "OperatingMargin", "UnitsSold"]]
-                product_profitability.to_excel(writer, sheet_name='Product Profitability', index=False)
-                format_worksheet(writer.sheets['Product Profitability'], product_profitability, header_format, number_format)
-
-            else:  # Regional Analysis
-                # Regional Metrics
-                regional_metrics = df.groupby(["Region", "State"]).agg({
-                    "TotalSales": "sum",
-                    "UnitsSold": "sum",
-                    "OperatingProfit": "sum"
-                }).reset_index()
-                regional_metrics.to_excel(writer, sheet_name='Regional Metrics', index=False)
-                format_worksheet(writer.sheets['Regional Metrics'], regional_metrics, header_format, number_format)
-
-                # Region Sales
-                region_sales = regional_metrics.groupby("Region")["TotalSales"].sum().reset_index()
-                region_sales.to_excel(writer, sheet_name='Sales by Region', index=False)
-                format_worksheet(writer.sheets['Sales by Region'], region_sales, header_format, number_format)
-
-                # State Performance
-                state_metrics = df.groupby("State").agg({
-                    "TotalSales": "sum",
-                    "UnitsSold": "sum",
-                    "OperatingProfit": "sum"
-                }).reset_index()
-                state_metrics.to_excel(writer, sheet_name='State Performance', index=False)
-                format_worksheet(writer.sheets['State Performance'], state_metrics, header_format, number_format)
-
-                # City Performance
-                city_metrics = df.groupby("City")["TotalSales"].sum().reset_index()
-                top_cities = city_metrics.sort_values("TotalSales", ascending=False)
-                top_cities.to_excel(writer, sheet_name='City Performance', index=False)
-                format_worksheet(writer.sheets['City Performance'], top_cities, header_format, number_format)
-
-            # Add Summary sheet with key metrics
-            summary_data = pd.DataFrame({
-                'Metric': [
-                    'Total Sales',
-                    'Total Units Sold',
-                    'Average Sale Value',
-                    'Total Operating Profit',
-                    'Average Operating Margin',
-                    'Number of Transactions',
-                    'Date Range',
-                    'Report Type'
-                ],
-                'Value': [
-                    f"${df['TotalSales'].sum():,.2f}",
-                    f"{df['UnitsSold'].sum():,}",
-                    f"${df['TotalSales'].mean():,.2f}",
-                    f"${df['OperatingProfit'].sum():,.2f}",
-                    f"{(df['OperatingProfit'].sum() / df['TotalSales'].sum() * 100):.2f}%",
-                    f"{len(df):,}",
-                    f"{df['InvoiceDate'].min().strftime('%Y-%m-%d')} to {df['InvoiceDate'].max().strftime('%Y-%m-%d')}",
-                    report_type
-                ]
-            })
-            summary_data.to_excel(writer, sheet_name='Summary', index=False)
-            format_worksheet(writer.sheets['Summary'], summary_data, header_format, number_format)
-
-        # Generate the download link
-        output.seek(0)
-        current_time = datetime.now().strftime("%Y%m%d_%H%M%S")
-        file_name = f"{report_type.lower().replace(' ', '_')}_{current_time}.xlsx"
-        
-        st.download_button(
-            label="📥 Download Excel Report",
-            data=output,
-            file_name=file_name,
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
-        
-        st.success("Report generated successfully!")
-        
-    except Exception as e:
-        st.error(f"Error generating Excel report: {str(e)}")
-
-def format_worksheet(worksheet, df, header_format, number_format):
-    """Helper function to format worksheet headers and columns."""
-    # Format headers
-    for col_num, value in enumerate(df.columns.values):
-        worksheet.write(0, col_num, value, header_format)
-    
-    # Adjust column widths
-    for i, col in enumerate(df.columns):
-        max_length = max(df[col].astype(str).apply(len).max(), len(str(col)))
-        worksheet.set_column(i, i, max_length + 2)
-        
-        # Apply number format to numeric columns
-        if df[col].dtype in ['float64', 'int64']:
-            for row in range(1, len(df) + 1):
-                worksheet.write_number(row, i, df[col].iloc[row-1], number_format)
-
-def export_to_csv(df, report_type):
-    """Export the filtered data to CSV."""
-    try:
-        # Convert dataframe to CSV
-        csv = df.to_csv(index=False)
-        
-        # Generate the download link
-        current_time = datetime.now().strftime("%Y%m%d_%H%M%S")
-        file_name = f"{report_type.lower().replace('', '_')}_{current_time}.csv"
-        
-        st.download_button(
-            label="📥 Download CSV Report",
-            data=csv,
-            file_name=file_name,
-            mime="text/csv"
-        )
-        
-        st.success("Report generated successfully!")
-        
-    except Exception as e:
-        st.error(f"Error generating CSV report: {str(e)}")
-    
 if __name__ == "__main__":
     main()
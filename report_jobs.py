@@ -0,0 +1,233 @@
+"""Background report exports.
+
+submit_job records an export spec (report type, filters, format) in the
+report_jobs table and hands it to a pool of worker processes, so a heavy
+export neither freezes the session that asked for it nor competes with the
+interactive sessions for the GIL, and several exports run at once. Workers
+write the status, progress and output path to the job's row as they go;
+pages poll list_jobs/get_job and offer the file once the job is done.
+Finished files are kept in report_cache.py's cache, and a job whose export
+is already cached is done as soon as it is submitted.
+
+Jobs survive reruns and browser refreshes but not a server restart: queued
+or running jobs left by an earlier server process are marked failed.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import db
+import report_cache
+from dataset import data_version, normalize_filters
+from db import get_connection
+from exports import EXPORT_MAX_AGE
+from reports import EXPORT_FORMATS, write_report
+
+logger = logging.getLogger(__name__)
+
+# Job statuses
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+MAX_REPORT_WORKERS = 2
+# Smallest change in progress that is written to the jobs table
+PROGRESS_STEP = 0.02
+# Finished jobs are removed after this many seconds
+JOB_RETENTION_SECONDS = EXPORT_MAX_AGE
+
+_JOB_COLUMNS = [
+    "job_id", "username", "report_type", "export_format", "filters", "status",
+    "progress", "message", "output_path", "rows", "created_at", "started_at", "finished_at",
+]
+
+_executor = None
+_executor_lock = threading.Lock()
+_recovered = False
+
+def _update(job_id, **values):
+    assignments = ", ".join(f"{column} = ?" for column in values)
+    conn = get_connection()
+    try:
+        with conn:
+            conn.execute(
+                f"UPDATE report_jobs SET {assignments} WHERE job_id = ?",
+                list(values.values()) + [job_id],
+            )
+    finally:
+        conn.close()
+
+def _recover():
+    """Fail the unfinished jobs of an earlier server process, once per process."""
+    global _recovered
+    with _executor_lock:
+        if _recovered:
+            return
+        conn = get_connection()
+        try:
+            with conn:
+                cursor = conn.execute(
+                    "UPDATE report_jobs SET status = ?, message = ?, finished_at = ? WHERE status IN (?, ?)",
+                    (FAILED, "Interrupted by a server restart", time.time(), QUEUED, RUNNING),
+                )
+        finally:
+            conn.close()
+        if cursor.rowcount:
+            logger.info(f"Marked {cursor.rowcount} interrupted report jobs as failed")
+        _recovered = True
+
+def _get_executor(reset=False):
+    global _executor
+    with _executor_lock:
+        if reset and _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
+        if _executor is None:
+            # Spawned, not forked: the server process runs many threads
+            _executor = ProcessPoolExecutor(
+                max_workers=MAX_REPORT_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _executor
+
+def run_job(job_id, db_path):
+    """Worker process: write the export for one job and record the outcome."""
+    db.DB_PATH = db_path
+    conn = get_connection()
+    try:
+        report_type, export_format, filters = conn.execute(
+            "SELECT report_type, export_format, filters FROM report_jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+    finally:
+        conn.close()
+    _update(job_id, status=RUNNING, started_at=time.time(), message="Starting...")
+
+    reported = [0.0]
+
+    def progress(fraction, message):
+        if fraction - reported[0] >= PROGRESS_STEP:
+            reported[0] = fraction
+            _update(job_id, progress=fraction, message=message)
+
+    filters = json.loads(filters)
+    try:
+        # Read before writing: if the data changes meanwhile, the file is
+        # stored under a version that is no longer looked up
+        key = report_cache.cache_key(report_type, filters, export_format, data_version())
+        partial_path = report_cache.new_partial_path(export_format)
+        try:
+            rows = write_report(partial_path, report_type, filters, export_format, progress)
+            path = report_cache.store(key, export_format, partial_path, rows)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+    except Exception as e:
+        logger.exception(f"Report job {job_id} failed")
+        _update(job_id, status=FAILED, message=str(e), finished_at=time.time())
+        return
+    _update(
+        job_id, status=DONE, progress=1.0, message=f"Exported {rows:,} rows",
+        output_path=path, rows=rows, finished_at=time.time(),
+    )
+    logger.info(f"Report job {job_id} wrote {rows} rows to {path}")
+
+def _on_done(job_id, future):
+    """Fail the job if its worker died before it could record an outcome."""
+    error = future.exception()
+    if error is None:
+        return
+    logger.error(f"Report job {job_id} crashed: {error}")
+    conn = get_connection()
+    try:
+        with conn:
+            conn.execute(
+                "UPDATE report_jobs SET status = ?, message = ?, finished_at = ? WHERE job_id = ? AND status IN (?, ?)",
+                (FAILED, f"Worker crashed: {error}", time.time(), job_id, QUEUED, RUNNING),
+            )
+    finally:
+        conn.close()
+
+def submit_job(report_type, filters, export_format, username=None):
+    """Queue an export and return its job id.
+
+    ``filters`` is a dataset filter dict; it is stored normalized, so the
+    job sees the selection as it was when it was submitted.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {export_format}")
+    _recover()
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    key = report_cache.cache_key(report_type, filters, export_format, data_version())
+    cached = report_cache.lookup(key, export_format)
+    conn = get_connection()
+    try:
+        with conn:
+            conn.execute(
+                "DELETE FROM report_jobs WHERE finished_at < ?", (now - JOB_RETENTION_SECONDS,)
+            )
+            conn.execute("""
+                INSERT INTO report_jobs (job_id, username, report_type, export_format, filters, status, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (job_id, username, report_type, export_format,
+                  json.dumps(normalize_filters(filters)), QUEUED, now))
+            if cached is not None:
+                path, rows = cached
+                conn.execute("""
+                    UPDATE report_jobs
+                    SET status = ?, progress = 1, message = ?, output_path = ?, rows = ?,
+                        started_at = ?, finished_at = ?
+                    WHERE job_id = ?
+                """, (DONE, f"Exported {rows:,} rows (cached)", path, rows, now, now, job_id))
+    finally:
+        conn.close()
+    if cached is not None:
+        logger.info(f"Report job {job_id} served from the report cache")
+        return job_id
+
+    db_path = os.path.abspath(db.DB_PATH)
+    try:
+        future = _get_executor().submit(run_job, job_id, db_path)
+    except BrokenProcessPool:
+        logger.warning("Report worker pool was broken; starting a new one")
+        future = _get_executor(reset=True).submit(run_job, job_id, db_path)
+    future.add_done_callback(lambda future: _on_done(job_id, future))
+    logger.info(f"Queued report job {job_id}: {report_type} as {export_format}")
+    return job_id
+
+def _as_job(row):
+    job = dict(zip(_JOB_COLUMNS, row))
+    job["filters"] = json.loads(job["filters"])
+    return job
+
+def get_job(job_id):
+    """Return a job as a dict of its columns, or None."""
+    conn = get_connection()
+    try:
+        row = conn.execute(
+            f"SELECT {', '.join(_JOB_COLUMNS)} FROM report_jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+    finally:
+        conn.close()
+    return _as_job(row) if row else None
+
+def list_jobs(username=None, limit=10):
+    """Return the user's most recent jobs, newest first."""
+    _recover()
+    conn = get_connection()
+    try:
+        rows = conn.execute(
+            f"SELECT {', '.join(_JOB_COLUMNS)} FROM report_jobs WHERE username IS ? "
+            "ORDER BY created_at DESC LIMIT ?",
+            (username, limit),
+        ).fetchall()
+    finally:
+        conn.close()
+    return [_as_job(row) for row in rows]
@@ -0,0 +1,180 @@
+"""Report export files, written without any Streamlit calls.
+
+write_report writes one export for a report type and filter dict to a path
+on disk, so it can run in a worker process (see report_jobs.py) as well as
+in a page. Raw rows are streamed from SQLite and summary sheets come from
+the daily rollup, so memory use does not grow with the size of the export.
+Progress is reported through an optional ``progress(fraction, message)``
+callback.
+"""
+from datetime import datetime
+
+import pandas as pd
+
+from dataset import CATEGORICAL_COLUMNS, NUMERIC_COLUMNS, SALES_COLUMNS, get_filter_options, iter_sales_rows
+from exports import (
+    ROW_GROUP_ROWS, add_formats, stream_sheets, write_arrow, write_csv, write_parquet, write_sheet,
+)
+from rollup import aggregate_sales
+
+# Export format name -> (file extension, MIME type)
+EXPORT_FORMATS = {
+    "Excel": (".xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "CSV": (".csv", "text/csv"),
+    "CSV (gzip)": (".csv.gz", "application/gzip"),
+    "Parquet": (".parquet", "application/vnd.apache.parquet"),
+    "Arrow IPC (Feather)": (".arrow", "application/vnd.apache.arrow.file"),
+}
+COLUMNAR_FORMATS = {"Parquet": write_parquet, "Arrow IPC (Feather)": write_arrow}
+
+# Share of an Excel job spent on the raw rows; the rollup sheets take the rest
+RAW_DATA_SHARE = 0.9
+
+def _no_progress(fraction, message):
+    pass
+
+def report_file_name(report_type, export_format, when=None):
+    """Return the download name, e.g. 'sales_summary_20240101_120000.xlsx'."""
+    when = (when or datetime.now()).strftime("%Y%m%d_%H%M%S")
+    return f"{report_type.lower().replace(' ', '_')}_{when}{EXPORT_FORMATS[export_format][0]}"
+
+def _counted(chunks, total, progress, start=0.0, end=1.0):
+    """Pass ``chunks`` through, reporting the share of ``total`` rows written so far."""
+    done = 0
+    for chunk in chunks:
+        yield chunk
+        done += len(chunk)
+        fraction = start + (end - start) * min(done / total, 1.0) if total else end
+        progress(fraction, f"Wrote {done:,} of {total:,} rows")
+
+def write_excel_report(path, report_type, filters, progress=None):
+    """Write the Excel export: raw data, the report type's sheets and a summary.
+
+    The raw rows go into a constant-memory workbook, split over several
+    sheets if they exceed Excel's row limit. Returns the number of raw rows.
+    """
+    progress = progress or _no_progress
+    totals = aggregate_sales(filters=filters).iloc[0]
+    with pd.ExcelWriter(path, engine='xlsxwriter', engine_kwargs={'options': {'constant_memory': True}}) as writer:
+        formats = add_formats(writer.book, {
+            'bold': True,
+            'bg_color': '#1E88E5',
+            'font_color': 'white',
+            'border': 1
+        })
+
+        # Write Raw Data sheet(s)
+        progress(0.0, "Writing raw data...")
+        kinds = ["datetime" if col == "InvoiceDate" else "number" if col in NUMERIC_COLUMNS else "text"
+                 for col in SALES_COLUMNS]
+        chunks = _counted(iter_sales_rows(filters), int(totals["Transactions"]), progress, end=RAW_DATA_SHARE)
+        rows = stream_sheets(writer.book, 'Raw Data', SALES_COLUMNS, chunks, kinds, formats)
+
+        progress(RAW_DATA_SHARE, "Writing report sheets...")
+        measures = ["TotalSales", "UnitsSold", "OperatingProfit"]
+        daily_sales = aggregate_sales(["InvoiceDate"], filters)
+
+        # Create and write sheets based on report type
+        if report_type == "Sales Summary":
+            # Sales Trend Data
+            sales_trend = daily_sales[["InvoiceDate", "TotalSales"]]
+            write_sheet(writer.book, sales_trend, 'Sales Trend', formats)
+
+            # Top Retailers Data
+            top_retailers = aggregate_sales(["Retailer"], filters)[["Retailer"] + measures]
+            top_retailers = top_retailers.sort_values("TotalSales", ascending=False)
+            write_sheet(writer.book, top_retailers, 'Top Retailers', formats)
+
+            # Sales Method Distribution
+            sales_method = aggregate_sales(["SalesMethod"], filters)[["SalesMethod"] + measures]
+            write_sheet(writer.book, sales_method, 'Sales by Method', formats)
+
+        elif report_type == "Product Performance":
+            # Product Metrics
+            product_metrics = aggregate_sales(["Product"], filters)[["Product"] + measures + ["OperatingMargin"]]
+            write_sheet(writer.book, product_metrics, 'Product Metrics', formats)
+
+            # Top Products
+            top_products = product_metrics.sort_values("TotalSales", ascending=False).head(10)
+            write_sheet(writer.book, top_products, 'Top Products', formats)
+
+            # Product Profitability
+            product_profitability = product_metrics[["Product", "TotalSales", "OperatingMargin", "UnitsSold"]]
+            write_sheet(writer.book, product_profitability, 'Product Profitability', formats)
+
+        else:  # Regional Analysis
+            # Regional Metrics
+            regional_metrics = aggregate_sales(["Region", "State"], filters)[["Region", "State"] + measures]
+            write_sheet(writer.book, regional_metrics, 'Regional Metrics', formats)
+
+            # Region Sales
+            region_sales = regional_metrics.groupby("Region")["TotalSales"].sum().reset_index()
+            write_sheet(writer.book, region_sales, 'Sales by Region', formats)
+
+            # State Performance
+            state_metrics = aggregate_sales(["State"], filters)[["State"] + measures]
+            write_sheet(writer.book, state_metrics, 'State Performance', formats)
+
+            # City Performance
+            city_metrics = aggregate_sales(["City"], filters)[["City", "TotalSales"]]
+            top_cities = city_metrics.sort_values("TotalSales", ascending=False)
+            write_sheet(writer.book, top_cities, 'City Performance', formats)
+
+        # Add Summary sheet with key metrics
+        if daily_sales.empty:
+            date_range = "No data"
+        else:
+            date_range = f"{daily_sales['InvoiceDate'].min().strftime('%Y-%m-%d')} to {daily_sales['InvoiceDate'].max().strftime('%Y-%m-%d')}"
+        summary_data = pd.DataFrame({
+            'Metric': [
+                'Total Sales',
+                'Total Units Sold',
+                'Average Sale Value',
+                'Total Operating Profit',
+                'Average Operating Margin',
+                'Number of Transactions',
+                'Date Range',
+                'Report Type'
+            ],
+            'Value': [
+                f"${totals['TotalSales']:,.2f}",
+                f"{int(totals['UnitsSold']):,}",
+                f"${totals['AverageSale']:,.2f}" if totals['Transactions'] else "n/a",
+                f"${totals['OperatingProfit']:,.2f}",
+                f"{(totals['OperatingProfit'] / totals['TotalSales'] * 100):.2f}%" if totals['TotalSales'] else "n/a",
+                f"{int(totals['Transactions']):,}",
+                date_range,
+                report_type
+            ]
+        })
+        write_sheet(writer.book, summary_data, 'Summary', formats)
+        progress(0.95, "Saving workbook...")
+    return rows
+
+def write_report(path, report_type, filters, export_format, progress=None):
+    """Write the ``export_format`` export of the filtered data to ``path``.
+
+    Excel exports hold the report type's sheets; CSV, Parquet and Arrow IPC
+    exports hold the raw rows. Returns the number of raw rows written.
+    """
+    progress = progress or _no_progress
+    if export_format == "Excel":
+        rows = write_excel_report(path, report_type, filters, progress)
+    elif export_format in COLUMNAR_FORMATS:
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise RuntimeError(f"{export_format} export requires the pyarrow package") from None
+        options = get_filter_options()
+        dictionaries = {col: options[col] for col in CATEGORICAL_COLUMNS}
+        total = int(aggregate_sales(filters=filters).iloc[0]["Transactions"])
+        chunks = _counted(iter_sales_rows(filters, chunk_size=ROW_GROUP_ROWS), total, progress)
+        rows = COLUMNAR_FORMATS[export_format](path, SALES_COLUMNS, chunks, dictionaries)
+    elif export_format in ("CSV", "CSV (gzip)"):
+        total = int(aggregate_sales(filters=filters).iloc[0]["Transactions"])
+        chunks = _counted(iter_sales_rows(filters), total, progress)
+        rows = write_csv(path, SALES_COLUMNS, chunks, compress=export_format == "CSV (gzip)")
+    else:
+        raise ValueError(f"Unknown export format: {export_format}")
+    progress(1.0, f"Exported {rows:,} rows")
+    return rows
@@ -0,0 +1,74 @@
+"""Dashboard aggregates served from the ``sales_daily_agg`` rollup.
+
+The rollup holds one row per invoice day and combination of dimensions (see
+migrate.py), kept current by triggers on ``sales_data``. Grouping it costs time
+proportional to the number of distinct groups rather than raw invoices.
+"""
+import pandas as pd
+
+from dataset import CATEGORICAL_COLUMNS, build_where
+from db import get_connection
+from query_cache import cached
+
+# Group keys that are computed from the invoice day rather than stored
+_TIME_GROUPS = {
+    "InvoiceDate": "InvoiceDay",
+    "Month": "substr(InvoiceDay, 1, 7)",
+}
+
+_MEASURES = """
+    SUM(TotalSales) AS TotalSales,
+    SUM(UnitsSold) AS UnitsSold,
+    SUM(OperatingProfit) AS OperatingProfit,
+    SUM(MarginSum) / NULLIF(SUM(MarginCount), 0) AS OperatingMargin,
+    SUM(TotalSales) / NULLIF(SUM(SalesCount), 0) AS AverageSale,
+    SUM(RecordCount) AS Transactions
+"""
+
+def aggregate_sales(group_by=(), filters=None):
+    """Return summed sales measures per group for the rows matching ``filters``.
+
+    ``group_by`` may list any dimension column, "InvoiceDate" (per day) or
+    "Month" ('YYYY-MM' strings). The result has one column per group key plus
+    TotalSales, UnitsSold, OperatingProfit, OperatingMargin (mean over
+    invoices), AverageSale (mean TotalSales per invoice) and Transactions.
+    With no group keys it is a single row of totals.
+
+    Results are cached per filter selection and data version (see
+    query_cache.py); each caller gets its own copy.
+    """
+    group_by = tuple(group_by)
+    result = cached(("aggregate_sales", group_by), filters, lambda: _aggregate_sales(group_by, filters))
+    return result.copy()
+
+def _aggregate_sales(group_by, filters):
+    group_by = list(group_by)
+    keys = []
+    for col in group_by:
+        if col in _TIME_GROUPS:
+            keys.append(f"{_TIME_GROUPS[col]} AS {col}")
+        elif col in CATEGORICAL_COLUMNS:
+            keys.append(f"NULLIF({col}, '') AS {col}")
+        else:
+            raise ValueError(f"Cannot group the sales rollup by {col}")
+
+    where, params = build_where(filters, date_column="InvoiceDay")
+    select = ", ".join(keys + [_MEASURES])
+    query = f"SELECT {select} FROM sales_daily_agg{where}"
+    if group_by:
+        positions = ", ".join(str(i + 1) for i in range(len(group_by)))
+        query += f" GROUP BY {positions} ORDER BY {positions}"
+
+    conn = get_connection()
+    try:
+        df = pd.read_sql(query, conn, params=params)
+    finally:
+        conn.close()
+
+    if "InvoiceDate" in df.columns:
+        df["InvoiceDate"] = pd.to_datetime(df["InvoiceDate"])
+    # SUM() over no rows is NULL; report empty totals as zero like pandas does
+    df[["TotalSales", "OperatingProfit"]] = df[["TotalSales", "OperatingProfit"]].astype("float64").fillna(0)
+    df[["OperatingMargin", "AverageSale"]] = df[["OperatingMargin", "AverageSale"]].astype("float64")
+    df[["UnitsSold", "Transactions"]] = df[["UnitsSold", "Transactions"]].fillna(0).astype("int64")
+    return df
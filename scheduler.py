@@ -0,0 +1,337 @@
+"""Pre-render recurring reports on a schedule.
+
+Schedules live in the report_schedules table, each with a five-field cron
+spec (minute hour day month weekday, in server local time). Manage them and
+run the scheduler with
+
+    python scheduler.py add NAME "0 2 * * *" [--report-type T] [--format F]
+                            [--window-days N] [--filter Retailer=Walmart ...]
+    python scheduler.py list
+    python scheduler.py remove NAME
+    python scheduler.py run [--once] [--output-dir DIR]
+
+``run`` keeps running and renders every due schedule; ``--once`` renders the
+due ones and exits, e.g. for a system cron job. Each file is written through
+the report cache (see report_cache.py), so identical exports requested from
+the report page are served from it while the data is unchanged, and a copy
+is kept under ``DIR/<name>/``. Several schedulers may share a database: a
+due schedule is claimed by moving its next run before it is rendered.
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+import time
+from datetime import datetime, timedelta
+
+import report_cache
+from dataset import FILTER_COLUMNS, data_version, normalize_filters
+from db import get_connection
+from reports import EXPORT_FORMATS, report_file_name, write_report
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+REPORT_OUTPUT_DIR = "scheduled_reports"
+# Files kept per schedule in the output directory
+KEEP_OUTPUTS = 7
+POLL_SECONDS = 30
+REPORT_TYPES = ["Sales Summary", "Product Performance", "Regional Analysis"]
+
+# Schedule statuses
+DONE = "done"
+FAILED = "failed"
+
+# (name, lowest, highest) of each cron field; weekday 0 and 7 are Sunday
+_CRON_FIELDS = [("minute", 0, 59), ("hour", 0, 23), ("day", 1, 31), ("month", 1, 12), ("weekday", 0, 7)]
+
+_SCHEDULE_COLUMNS = [
+    "schedule_id", "name", "cron", "report_type", "export_format", "filters", "window_days",
+    "enabled", "next_run_at", "last_run_at", "last_status", "last_message", "last_output_path", "last_rows",
+]
+
+def parse_cron(spec):
+    """Return the allowed values of each field of a cron spec.
+
+    Fields accept ``*``, numbers, ranges and lists, each with an optional
+    ``/step``. Raises ValueError for a malformed spec.
+    """
+    parts = spec.split()
+    if len(parts) != len(_CRON_FIELDS):
+        raise ValueError(f"Cron spec needs {len(_CRON_FIELDS)} fields: {spec!r}")
+    fields = []
+    for part, (name, low, high) in zip(parts, _CRON_FIELDS):
+        values = set()
+        for item in part.split(","):
+            match = re.fullmatch(r"(\*|\d+)(?:-(\d+))?(?:/(\d+))?", item)
+            if match is None:
+                raise ValueError(f"Invalid cron {name} field: {part!r}")
+            start, end, step = match.groups()
+            if start == "*":
+                start, end = low, high
+            else:
+                start = int(start)
+                end = int(end) if end else (high if step else start)
+            step = int(step) if step else 1
+            if not low <= start <= end <= high or step < 1:
+                raise ValueError(f"Invalid cron {name} field: {part!r}")
+            values.update(range(start, end + 1, step))
+        if name == "weekday" and 7 in values:
+            values = (values - {7}) | {0}
+        fields.append(values)
+    return fields
+
+def next_run(spec, after):
+    """Return the first datetime after ``after`` matching the cron spec.
+
+    As in cron, a day matches either of the day and weekday fields when both
+    are restricted.
+    """
+    minutes, hours, days, months, weekdays = parse_cron(spec)
+    any_day, any_weekday = spec.split()[2] == "*", spec.split()[4] == "*"
+    t = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    limit = t + timedelta(days=5 * 366)
+    while t < limit:
+        if t.month not in months:
+            t = (t.replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0)
+            continue
+        day_match, weekday_match = t.day in days, (t.weekday() + 1) % 7 in weekdays
+        if any_day and any_weekday:
+            matches = True
+        elif any_day or any_weekday:
+            matches = weekday_match if any_day else day_match
+        else:
+            matches = day_match or weekday_match
+        if not matches:
+            t = t.replace(hour=0, minute=0) + timedelta(days=1)
+        elif t.hour not in hours:
+            t = t.replace(minute=0) + timedelta(hours=1)
+        elif t.minute not in minutes:
+            t += timedelta(minutes=1)
+        else:
+            return t
+    raise ValueError(f"Cron spec never matches: {spec!r}")
+
+def _as_schedule(row):
+    schedule = dict(zip(_SCHEDULE_COLUMNS, row))
+    schedule["filters"] = json.loads(schedule["filters"])
+    return schedule
+
+def add_schedule(name, cron, report_type, export_format, filters=None, window_days=None):
+    """Create a schedule; return (success, message)."""
+    try:
+        first_run = next_run(cron, datetime.now())
+    except ValueError as e:
+        return False, str(e)
+    if report_type not in REPORT_TYPES:
+        return False, f"Unknown report type: {report_type}"
+    if export_format not in EXPORT_FORMATS:
+        return False, f"Unknown export format: {export_format}"
+    conn = get_connection()
+    try:
+        with conn:
+            cursor = conn.execute("""
+                INSERT OR IGNORE INTO report_schedules
+                    (name, cron, report_type, export_format, filters, window_days, next_run_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (name, cron, report_type, export_format, json.dumps(normalize_filters(filters)),
+                  window_days, first_run.timestamp()))
+    finally:
+        conn.close()
+    if cursor.rowcount == 0:
+        return False, f"A schedule named {name} already exists"
+    logger.info(f"Added schedule {name}: {report_type} as {export_format} at '{cron}'")
+    return True, f"Schedule {name} added; first run at {first_run:%Y-%m-%d %H:%M}"
+
+def remove_schedule(name):
+    """Delete a schedule; return (success, message)."""
+    conn = get_connection()
+    try:
+        with conn:
+            cursor = conn.execute("DELETE FROM report_schedules WHERE name = ?", (name,))
+    finally:
+        conn.close()
+    if cursor.rowcount == 0:
+        return False, f"No schedule named {name}"
+    return True, f"Schedule {name} removed"
+
+def list_schedules():
+    """Return every schedule as a dict of its columns, ordered by name."""
+    conn = get_connection()
+    try:
+        rows = conn.execute(
+            f"SELECT {', '.join(_SCHEDULE_COLUMNS)} FROM report_schedules ORDER BY name"
+        ).fetchall()
+    finally:
+        conn.close()
+    return [_as_schedule(row) for row in rows]
+
+def _run_filters(schedule, now):
+    """Return the schedule's filters, with the date window ending the day before ``now``."""
+    filters = dict(schedule["filters"])
+    if schedule["window_days"]:
+        end = now.date() - timedelta(days=1)
+        filters["start_date"] = end - timedelta(days=schedule["window_days"] - 1)
+        filters["end_date"] = end
+    return filters
+
+def _keep_latest(directory, keep=KEEP_OUTPUTS):
+    entries = sorted(os.scandir(directory), key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in entries[keep:]:
+        os.remove(entry.path)
+
+def render(schedule, output_dir=REPORT_OUTPUT_DIR, now=None):
+    """Render one schedule's report into ``output_dir``; return (path, rows)."""
+    now = now or datetime.now()
+    report_type, export_format = schedule["report_type"], schedule["export_format"]
+    filters = _run_filters(schedule, now)
+    key = report_cache.cache_key(report_type, filters, export_format, data_version())
+    cached = report_cache.lookup(key, export_format)
+    if cached is None:
+        partial_path = report_cache.new_partial_path(export_format)
+        try:
+            rows = write_report(partial_path, report_type, filters, export_format)
+            cached = report_cache.store(key, export_format, partial_path, rows), rows
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+    source, rows = cached
+
+    directory = os.path.join(output_dir, re.sub(r"[^\w.-]+", "_", schedule["name"]))
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.abspath(os.path.join(directory, report_file_name(report_type, export_format, now)))
+    shutil.copyfile(source, path)
+    _keep_latest(directory)
+    return path, rows
+
+def _claim(schedule, now):
+    """Move a due schedule's next run forward; False if another scheduler did first."""
+    following = next_run(schedule["cron"], now).timestamp()
+    conn = get_connection()
+    try:
+        with conn:
+            cursor = conn.execute(
+                "UPDATE report_schedules SET next_run_at = ? WHERE schedule_id = ? AND next_run_at = ?",
+                (following, schedule["schedule_id"], schedule["next_run_at"]),
+            )
+    finally:
+        conn.close()
+    return cursor.rowcount == 1
+
+def _record(schedule_id, now, status, message, path=None, rows=None):
+    conn = get_connection()
+    try:
+        with conn:
+            conn.execute("""
+                UPDATE report_schedules
+                SET last_run_at = ?, last_status = ?, last_message = ?,
+                    last_output_path = COALESCE(?, last_output_path), last_rows = COALESCE(?, last_rows)
+                WHERE schedule_id = ?
+            """, (now.timestamp(), status, message, path, rows, schedule_id))
+    finally:
+        conn.close()
+
+def run_due(output_dir=REPORT_OUTPUT_DIR, now=None):
+    """Render every enabled schedule that is due; return the number rendered.
+
+    A schedule missed while no scheduler was running is rendered once, not
+    once per missed run.
+    """
+    now = now or datetime.now()
+    conn = get_connection()
+    try:
+        rows = conn.execute(
+            f"SELECT {', '.join(_SCHEDULE_COLUMNS)} FROM report_schedules "
+            "WHERE enabled = 1 AND next_run_at <= ? ORDER BY next_run_at",
+            (now.timestamp(),),
+        ).fetchall()
+    finally:
+        conn.close()
+
+    rendered = 0
+    for schedule in map(_as_schedule, rows):
+        if not _claim(schedule, now):
+            continue
+        started = time.perf_counter()
+        try:
+            path, count = render(schedule, output_dir, now)
+        except Exception as e:
+            logger.exception(f"Schedule {schedule['name']} failed")
+            _record(schedule["schedule_id"], now, FAILED, str(e))
+            continue
+        elapsed = time.perf_counter() - started
+        _record(schedule["schedule_id"], now, DONE, f"Exported {count:,} rows in {elapsed:.1f}s", path, count)
+        logger.info(f"Schedule {schedule['name']}: wrote {count} rows to {path} in {elapsed:.1f}s")
+        rendered += 1
+    return rendered
+
+def run(output_dir=REPORT_OUTPUT_DIR, poll_seconds=POLL_SECONDS):
+    """Render due schedules forever, checking every ``poll_seconds``."""
+    logger.info(f"Scheduler started; writing reports to {os.path.abspath(output_dir)}")
+    while True:
+        run_due(output_dir)
+        time.sleep(poll_seconds)
+
+def _parse_filters(parser, items):
+    filters = {}
+    for item in items:
+        column, _, value = item.partition("=")
+        if column not in FILTER_COLUMNS or not value:
+            parser.error(f"--filter must be COLUMN=VALUE with COLUMN one of {', '.join(FILTER_COLUMNS)}")
+        filters.setdefault(column, []).append(value)
+    return filters
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-render recurring reports.")
+    commands = parser.add_subparsers(dest="command")
+
+    add = commands.add_parser("add", help="create a schedule")
+    add.add_argument("name")
+    add.add_argument("cron", help='five-field cron spec, e.g. "0 2 * * *" for 02:00 daily')
+    add.add_argument("--report-type", choices=REPORT_TYPES, default=REPORT_TYPES[0])
+    add.add_argument("--format", choices=list(EXPORT_FORMATS), default="Excel")
+    add.add_argument("--window-days", type=int, default=None,
+                     help="cover the N days before each run (default: all dates)")
+    add.add_argument("--filter", action="append", default=[], metavar="COLUMN=VALUE",
+                     help="only include these values; may be repeated")
+
+    commands.add_parser("list", help="show schedules and their last runs")
+
+    remove = commands.add_parser("remove", help="delete a schedule")
+    remove.add_argument("name")
+
+    run_parser = commands.add_parser("run", help="render due schedules (the default)")
+    run_parser.add_argument("--once", action="store_true", help="render due schedules and exit")
+    run_parser.add_argument("--output-dir", default=REPORT_OUTPUT_DIR)
+    run_parser.add_argument("--poll-seconds", type=float, default=POLL_SECONDS)
+
+    args = parser.parse_args()
+    if args.command == "add":
+        if args.window_days is not None and args.window_days < 1:
+            parser.error("--window-days must be at least 1")
+        success, message = add_schedule(args.name, args.cron, args.report_type, args.format,
+                                        _parse_filters(parser, args.filter), args.window_days)
+    elif args.command == "remove":
+        success, message = remove_schedule(args.name)
+    elif args.command == "list":
+        for schedule in list_schedules():
+            last = (f"last {datetime.fromtimestamp(schedule['last_run_at']):%Y-%m-%d %H:%M} "
+                    f"{schedule['last_status']}: {schedule['last_message']}") if schedule["last_run_at"] else "never run"
+            print(f"{schedule['name']}  '{schedule['cron']}'  {schedule['report_type']} as {schedule['export_format']}  "
+                  f"next {datetime.fromtimestamp(schedule['next_run_at']):%Y-%m-%d %H:%M}  {last}")
+        return
+    else:
+        output_dir = getattr(args, "output_dir", REPORT_OUTPUT_DIR)
+        if getattr(args, "once", False):
+            run_due(output_dir)
+        else:
+            run(output_dir, getattr(args, "poll_seconds", POLL_SECONDS))
+        return
+    print(message)
+    if not success:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
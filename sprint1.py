@@ -1,10 +1,12 @@
 import streamlit as st
 import pandas as pd
-import sqlite3
 import plotly.express as px
 import plotly.graph_objects as go
 from PIL import Image
 
+from charts import collapse, show_chart
+from db import get_connection
+
 # Set page configuration - MUST be the first Streamlit command
 st.set_page_config(
     layout="wide",
@@ -41,12 +43,6 @@ st.markdown("""
     </style>
     """, unsafe_allow_html=True)
 
-DB_PATH = "sales_data.db"  # SQLite Database Path
-
-# Connect to SQL Database
-def get_connection():
-    return sqlite3.connect(DB_PATH)
-
 # Fetch Data from SQL
 def fetch_data():
     conn = get_connection()
@@ -110,9 +106,10 @@ def main():
     # Charts
     col1, col2 = st.columns(2)
     with col1:
-        fig = px.bar(filtered_df, x="Retailer", y="TotalSales", title="Total Sales by Retailer")
+        retailer_sales = collapse(filtered_df, "Retailer", "TotalSales")
+        fig = px.bar(retailer_sales, x="Retailer", y="TotalSales", title="Total Sales by Retailer")
         fig.update_layout(template='plotly')
-        st.plotly_chart(fig, use_container_width=True)
+        show_chart(fig)
 
     with col2:
         filtered_df["Month_Year"] = filtered_df["InvoiceDate"].dt.to_period("M").astype(str)
@@ -123,7 +120,7 @@ def main():
         
         fig1 = px.line(result, x="Month_Year", y="TotalSales", title="Total Sales Over Time")
         fig1.update_layout(template='plotly')
-        st.plotly_chart(fig1, use_container_width=True)
+        show_chart(fig1)
 
     # Regional Analysis
     st.markdown("<h2>Regional Analysis</h2>", unsafe_allow_html=True)
@@ -138,7 +135,7 @@ def main():
         yaxis_title="Total Sales",
         yaxis2=dict(title="Units Sold", overlaying="y", side="right")
     )
-    st.plotly_chart(fig3, use_container_width=True)
+    show_chart(fig3)
 
     # Treemap
     st.markdown("<h2>Regional Sales Distribution</h2>", unsafe_allow_html=True)
@@ -152,7 +149,7 @@ def main():
         color_continuous_scale="blues"
     )
     fig_treemap.update_layout(template='plotly')
-    st.plotly_chart(fig_treemap, use_container_width=True)
+    show_chart(fig_treemap)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,16 +1,17 @@
 import streamlit as st
 import pandas as pd
 import datetime
-import json
-import sqlite3
 import plotly.express as px
 import plotly.graph_objects as go
-from prophet import Prophet
-import os
 import secrets
 import time
 from PIL import Image
 
+from charts import collapse, show_chart
+from db import get_connection
+from user_store import add_user, check_password, check_reset_token, create_session, end_session, get_session, update_user, user_exists
+from forecasting import FAILED, NO_DATA, STALE, get_batch_forecast, get_forecast
+
 # Set page configuration - MUST be the first Streamlit command
 st.set_page_config(
     layout="wide",
@@ -47,24 +48,6 @@ st.markdown("""
     </style>
     """, unsafe_allow_html=True)
 
-USER_DB = "users.json"
-DB_PATH = "sales_data.db"
-
-# Load Users from JSON File
-def load_users():
-    if os.path.exists(USER_DB):
-        with open(USER_DB, "r") as file:
-            return json.load(file)
-    return {}
-
-def save_users(users):
-    with open(USER_DB, "w") as file:
-        json.dump(users, file, indent=4)
-
-# Connect to SQL Database
-def get_connection():
-    return sqlite3.connect(DB_PATH)
-
 # Fetch Data from SQL
 def fetch_data():
     conn = get_connection()
@@ -82,51 +65,35 @@ def signup():
     password = st.text_input("Password", type="password")
     role = st.selectbox("Role", ["Admin", "User"])
     if st.button("Register"):
-        users = load_users()
-        if username in users:
-            st.error("Username already exists. Choose a different one.")
-        else:
-            users[username] = {"password": password, "role": role}
-            save_users(users)
+        if add_user(username, password, role):
             st.success("Signup successful! Please log in.")
+        else:
+            st.error("Username already exists. Choose a different one.")
 
 def generate_reset_token():
     return secrets.token_urlsafe(32)
 
 def save_reset_token(username, token, expiry_minutes=15):
-    users = load_users()
-    if username in users:
-        users[username]["reset_token"] = token
-        users[username]["reset_token_expiry"] = time.time() + (expiry_minutes * 60)
-        save_users(users)
-        return True
-    return False
+    return update_user(username, {
+        "reset_token": token,
+        "reset_token_expiry": time.time() + (expiry_minutes * 60),
+    })
 
 def verify_reset_token(username, token):
-    users = load_users()
-    if username in users and "reset_token" in users[username]:
-        if (users[username]["reset_token"] == token and 
-            time.time() < users[username]["reset_token_expiry"]):
-            return True
-    return False
+    return check_reset_token(username, token)
 
 def reset_password(username, token, new_password):
-    users = load_users()
     if verify_reset_token(username, token):
-        users[username]["password"] = new_password
         # Remove the reset token after successful password reset
-        del users[username]["reset_token"]
-        del users[username]["reset_token_expiry"]
-        save_users(users)
-        return True
+        return update_user(username, {"password": new_password},
+                           remove=["reset_token", "reset_token_expiry"])
     return False
 
 def forgot_password():
     st.subheader("Forgot Password")
     username = st.text_input("Enter your username")
     if st.button("Reset Password"):
-        users = load_users()
-        if username in users:
+        if user_exists(username):
             st.session_state["reset_username"] = username
             st.session_state["show_forgot_password"] = False
             st.session_state["show_reset_form"] = True
@@ -144,10 +111,7 @@ def reset_password_form():
             st.error("Passwords do not match!")
             return
         
-        users = load_users()
-        if st.session_state["reset_username"] in users:
-            users[st.session_state["reset_username"]]["password"] = new_password
-            save_users(users)
+        if update_user(st.session_state["reset_username"], {"password": new_password}):
             st.success("Password has been reset successfully! Please login with your new password.")
             # Clear reset session state
             del st.session_state["reset_username"]
@@ -168,11 +132,12 @@ def login():
     col1, col2 = st.columns([3, 1])
     with col1:
         if st.button("Login"):
-            users = load_users()
-            if username in users and users[username]["password"] == password:
+            user = check_password(username, password)
+            if user is not None:
+                st.session_state["session_token"] = create_session(username)
                 st.session_state["logged_in"] = True
                 st.session_state["username"] = username
-                st.session_state["role"] = users[username]["role"]
+                st.session_state["role"] = user["role"]
                 st.rerun()
             else:
                 st.error("Invalid credentials")
@@ -182,6 +147,9 @@ def login():
             st.rerun()
 
 def main():
+    # Logins are backed by a server-side session; drop any that expired or was revoked
+    if st.session_state.get("logged_in") and get_session(st.session_state.get("session_token")) is None:
+        st.session_state.clear()
     if "logged_in" not in st.session_state:
         st.session_state["logged_in"] = False
     if "show_forgot_password" not in st.session_state:
@@ -244,6 +212,12 @@ def main():
         filtered_df = filtered_df[filtered_df["Retailer"] == selected_retailer]
     if selected_state != "All":
         filtered_df = filtered_df[filtered_df["State"] == selected_state]
+    filters = {
+        "start_date": start_date,
+        "end_date": end_date,
+        "Retailer": [selected_retailer] if selected_retailer != "All" else None,
+        "State": [selected_state] if selected_state != "All" else None,
+    }
 
     # Main Content
     st.markdown("<h2>Sales Overview</h2>", unsafe_allow_html=True)
@@ -262,9 +236,10 @@ def main():
     # Charts
     col1, col2 = st.columns(2)
     with col1:
-        fig = px.bar(filtered_df, x="Retailer", y="TotalSales", title="Total Sales by Retailer")
+        retailer_sales = collapse(filtered_df, "Retailer", "TotalSales")
+        fig = px.bar(retailer_sales, x="Retailer", y="TotalSales", title="Total Sales by Retailer")
         fig.update_layout(template='plotly')
-        st.plotly_chart(fig, use_container_width=True)
+        show_chart(fig)
 
     with col2:
         filtered_df["Month_Year"] = filtered_df["InvoiceDate"].dt.to_period("M").astype(str)
@@ -275,7 +250,7 @@ def main():
         
         fig1 = px.line(result, x="Month_Year", y="TotalSales", title="Total Sales Over Time")
         fig1.update_layout(template='plotly')
-        st.plotly_chart(fig1, use_container_width=True)
+        show_chart(fig1)
 
     # Regional Analysis
     st.markdown("<h2>Regional Analysis</h2>", unsafe_allow_html=True)
@@ -290,7 +265,7 @@ def main():
         yaxis_title="Total Sales",
         yaxis2=dict(title="Units Sold", overlaying="y", side="right")
     )
-    st.plotly_chart(fig3, use_container_width=True)
+    show_chart(fig3)
 
     # Treemap
     st.markdown("<h2>Regional Sales Distribution</h2>", unsafe_allow_html=True)
@@ -304,7 +279,7 @@ def main():
         color_continuous_scale="blues"
     )
     fig_treemap.update_layout(template='plotly')
-    st.plotly_chart(fig_treemap, use_container_width=True)
+    show_chart(fig_treemap)
 
     # Admin Features
     if st.session_state["role"] == "Admin":
@@ -315,21 +290,31 @@ def main():
             profit_data = filtered_df.groupby("Retailer")["OperatingProfit"].sum().reset_index()
             fig6 = px.bar(profit_data, x="Retailer", y="OperatingProfit", title="Operating Profit by Retailer")
             fig6.update_layout(template='plotly')
-            st.plotly_chart(fig6, use_container_width=True)
+            show_chart(fig6)
 
         with col2:
-            df_prophet = filtered_df.groupby("InvoiceDate")["TotalSales"].sum().reset_index()
-            df_prophet.columns = ["ds", "y"]
-            model = Prophet()
-            model.fit(df_prophet)
-            future = model.make_future_dataframe(periods=90)
-            forecast = model.predict(future)
-            fig5 = px.line(forecast, x="ds", y="yhat", title="Sales Forecast for Next 3 Months")
-            fig5.update_layout(template='plotly')
-            st.plotly_chart(fig5, use_container_width=True)
+            # Drill-downs are precomputed by batch_forecast.py; other selections are
+            # fitted in the background and cached per filter selection and data version
+            forecast, status = get_batch_forecast(filters)
+            if forecast is None:
+                forecast, status = get_forecast(filters)
+            if forecast is None:
+                if status == NO_DATA:
+                    st.info("There are not enough sales in this selection to forecast.")
+                elif status == FAILED:
+                    st.warning("The sales forecast could not be computed for this selection.")
+                else:
+                    st.info("The sales forecast is being prepared in the background. Refresh in a moment.")
+            else:
+                fig5 = px.line(forecast, x="ds", y="yhat", title="Sales Forecast for Next 3 Months")
+                fig5.update_layout(template='plotly')
+                show_chart(fig5)
+                if status == STALE:
+                    st.caption("This forecast was fitted before the latest data changes.")
 
     # Logout Button
     if st.button("Logout", use_container_width=True):
+        end_session(st.session_state.get("session_token"))
         st.session_state.clear()
         st.rerun()
 
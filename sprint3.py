@@ -1,17 +1,18 @@
 import streamlit as st
 import pandas as pd
-import datetime
-import json
-import sqlite3
 from PIL import Image
 import plotly.express as px
 import plotly.graph_objects as go
-from prophet import Prophet
-import os
 import secrets
 import time
 import logging
 
+from dataset import get_filter_options
+from rollup import aggregate_sales
+from charts import show_chart
+from forecasting import FAILED, NO_DATA, STALE, get_batch_forecast, get_forecast
+from user_store import add_user, check_password, check_reset_token, create_session, end_session, get_session, update_user, user_exists
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -73,260 +74,41 @@ st.markdown("""
     </style>
     """, unsafe_allow_html=True)
 
-USER_DB = "users.json"
-DB_PATH = "sales_data.db"
-
-# Load Users from JSON File
-def load_users():
-    if os.path.exists(USER_DB):
-        with open(USER_DB, "r") as file:
-            return json.load(file)
-    return {}
-
-def save_users(users):
-    with open(USER_DB, "w") as file:
-        json.dump(users, file, indent=4)
-
-# Connect to SQL Database
-def get_connection():
-    return sqlite3.connect(DB_PATH)
-
-# Fetch Data from SQL
-def fetch_data():
-    conn = get_connection()
-    query = "SELECT * FROM sales_data"
-    df = pd.read_sql(query, conn)
-    conn.close()
-    
-    # Ensure 'InvoiceDate' is in datetime format with mixed format handling
-    df["InvoiceDate"] = pd.to_datetime(df["InvoiceDate"], format='mixed')
-    return df
-
-def get_column_names():
-    """Get the column names from the database."""
-    with get_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM sales_data LIMIT 1")
-        return [description[0] for description in cursor.description]
-
-def add_record(data):
-    """Add a new record to the database with validation."""
-    try:
-        # Validate required fields
-        required_fields = ["Retailer", "RetailerID", "InvoiceDate", "Product"]
-        missing_fields = [field for field in required_fields if field not in data]
-        if missing_fields:
-            return False, f"Missing required fields: {', '.join(missing_fields)}"
-
-        with get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Define the exact columns in the order they appear in the database
-            columns = [
-                "Retailer", "RetailerID", "InvoiceDate", "Region", "State", 
-                "City", "Product", "PriceperUnit", "UnitsSold", "TotalSales", 
-                "OperatingProfit", "OperatingMargin", "SalesMethod"
-            ]
-            
-            # Filter out any extra fields not in our database
-            available_fields = [field for field in columns if field in data]
-            
-            # Create the INSERT query
-            placeholders = ", ".join(["?" for _ in available_fields])
-            fields = ", ".join(available_fields)
-            query = f"INSERT INTO sales_data ({fields}) VALUES ({placeholders})"
-            
-            # Convert values to SQLite-compatible formats
-            values = []
-            for field in available_fields:
-                value = data[field]
-                if isinstance(value, pd.Timestamp) or isinstance(value, datetime.datetime):
-                    value = value.strftime('%Y-%m-%d %H:%M:%S')
-                values.append(value)
-            
-            # Execute the insert
-            cursor.execute(query, values)
-            conn.commit()
-            
-            logger.info("Successfully added new record")
-            return True, "Record added successfully!"
-            
-    except Exception as e:
-        logger.error(f"Error adding record: {str(e)}")
-        return False, f"Error adding record: {str(e)}"
-
-def update_record(record_index, data):
-    """Update an existing record with validation."""
-    try:
-        # Validate required fields
-        required_fields = ["Retailer", "RetailerID", "InvoiceDate", "Product"]
-        missing_fields = [field for field in required_fields if field not in data]
-        if missing_fields:
-            return False, f"Missing required fields: {', '.join(missing_fields)}"
-
-        with get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Define the exact columns in the order they appear in the database
-            columns = [
-                "Retailer", "RetailerID", "InvoiceDate", "Region", "State", 
-                "City", "Product", "PriceperUnit", "UnitsSold", "TotalSales", 
-                "OperatingProfit", "OperatingMargin", "SalesMethod"
-            ]
-            
-            # Create SET clause for the update
-            available_fields = [field for field in columns if field in data]
-            set_clause = ", ".join([f"{field} = ?" for field in available_fields])
-            
-            # Convert values to SQLite-compatible formats
-            values = []
-            for field in available_fields:
-                value = data[field]
-                if isinstance(value, pd.Timestamp) or isinstance(value, datetime.datetime):
-                    value = value.strftime('%Y-%m-%d %H:%M:%S')
-                values.append(value)
-            
-            # Get the record we want to update
-            df = fetch_data()
-            if record_index >= len(df):
-                return False, "Invalid record index"
-            
-            record = df.iloc[record_index]
-            
-            # Create WHERE clause using RetailerID, InvoiceDate, and Product for unique identification
-            where_clause = "RetailerID = ? AND date(InvoiceDate) = date(?) AND Product = ?"
-            where_values = [
-                int(record["RetailerID"]),  # Ensure RetailerID is an integer
-                record["InvoiceDate"].strftime('%Y-%m-%d'),  # Only compare the date part
-                record["Product"]
-            ]
-            
-            # Combine all values
-            all_values = values + where_values
-            
-            query = f"UPDATE sales_data SET {set_clause} WHERE {where_clause}"
-            
-            # Log the query and values for debugging
-            logger.info(f"Update query: {query}")
-            logger.info(f"Update values: {all_values}")
-            
-            # First verify if the record exists
-            verify_query = "SELECT COUNT(*) FROM sales_data WHERE RetailerID = ? AND date(InvoiceDate) = date(?) AND Product = ?"
-            cursor.execute(verify_query, where_values)
-            count = cursor.fetchone()[0]
-            
-            if count == 0:
-                return False, "Record not found in database. It may have been deleted."
-            
-            # Execute the update
-            cursor.execute(query, all_values)
-            
-            if cursor.rowcount == 0:
-                return False, "No changes were made. The new values might be the same as the existing ones."
-            
-            conn.commit()
-            logger.info(f"Successfully updated record at index {record_index}")
-            return True, "Record updated successfully!"
-            
-    except Exception as e:
-        logger.error(f"Error updating record: {str(e)}")
-        return False, f"Error updating record: {str(e)}"
-
-def delete_record(record_index):
-    """Delete a record from the database."""
-    try:
-        with get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Get the record we want to delete
-            df = fetch_data()
-            if record_index >= len(df):
-                return False, "Invalid record index"
-            
-            record = df.iloc[record_index]
-            
-            # Create WHERE clause using RetailerID, InvoiceDate, and Product for unique identification
-            where_clause = "RetailerID = ? AND date(InvoiceDate) = date(?) AND Product = ?"
-            where_values = [
-                int(record["RetailerID"]),  # Ensure RetailerID is an integer
-                record["InvoiceDate"].strftime('%Y-%m-%d'),  # Only compare the date part
-                record["Product"]
-            ]
-            
-            # First verify if the record exists
-            verify_query = "SELECT COUNT(*) FROM sales_data WHERE RetailerID = ? AND date(InvoiceDate) = date(?) AND Product = ?"
-            cursor.execute(verify_query, where_values)
-            count = cursor.fetchone()[0]
-            
-            if count == 0:
-                return False, "Record not found in database. It may have been deleted."
-            
-            # Execute the delete
-            query = f"DELETE FROM sales_data WHERE {where_clause}"
-            cursor.execute(query, where_values)
-            
-            if cursor.rowcount == 0:
-                return False, "No record was deleted. Please try again."
-            
-            conn.commit()
-            logger.info(f"Successfully deleted record at index {record_index}")
-            return True, "Record deleted successfully!"
-            
-    except Exception as e:
-        logger.error(f"Error deleting record: {str(e)}")
-        return False, f"Error deleting record: {str(e)}"
-
 def signup():
     st.subheader("Signup")
     username = st.text_input("Username")
     password = st.text_input("Password", type="password")
     role = st.selectbox("Role", ["Admin", "User"])
     if st.button("Register"):
-        users = load_users()
-        if username in users:
-            st.error("Username already exists. Choose a different one.")
-        else:
-            users[username] = {"password": password, "role": role}
-            save_users(users)
+        if add_user(username, password, role):
             st.success("Signup successful! Please log in.")
+        else:
+            st.error("Username already exists. Choose a different one.")
 
 def generate_reset_token():
     return secrets.token_urlsafe(32)
 
 def save_reset_token(username, token, expiry_minutes=15):
-    users = load_users()
-    if username in users:
-        users[username]["reset_token"] = token
-        users[username]["reset_token_expiry"] = time.time() + (expiry_minutes * 60)
-        save_users(users)
-        return True
-    return False
+    return update_user(username, {
+        "reset_token": token,
+        "reset_token_expiry": time.time() + (expiry_minutes * 60),
+    })
 
 def verify_reset_token(username, token):
-    users = load_users()
-    if username in users and "reset_token" in users[username]:
-        if (users[username]["reset_token"] == token and 
-            time.time() < users[username]["reset_token_expiry"]):
-            return True
-    return False
+    return check_reset_token(username, token)
 
 def reset_password(username, token, new_password):
-    users = load_users()
     if verify_reset_token(username, token):
-        users[username]["password"] = new_password
         # Remove the reset token after successful password reset
-        del users[username]["reset_token"]
-        del users[username]["reset_token_expiry"]
-        save_users(users)
-        return True
+        return update_user(username, {"password": new_password},
+                           remove=["reset_token", "reset_token_expiry"])
     return False
 
 def forgot_password():
     st.subheader("Forgot Password")
     username = st.text_input("Enter your username")
     if st.button("Reset Password"):
-        users = load_users()
-        if username in users:
+        if user_exists(username):
             st.session_state["reset_username"] = username
             st.session_state["show_forgot_password"] = False
             st.session_state["show_reset_form"] = True
@@ -344,10 +126,7 @@ def reset_password_form():
             st.error("Passwords do not match!")
             return
         
-        users = load_users()
-        if st.session_state["reset_username"] in users:
-            users[st.session_state["reset_username"]]["password"] = new_password
-            save_users(users)
+        if update_user(st.session_state["reset_username"], {"password": new_password}):
             st.success("Password has been reset successfully! Please login with your new password.")
             # Clear reset session state
             del st.session_state["reset_username"]
@@ -368,11 +147,12 @@ def login():
     col1, col2 = st.columns([3, 1])
     with col1:
         if st.button("Login"):
-            users = load_users()
-            if username in users and users[username]["password"] == password:
+            user = check_password(username, password)
+            if user is not None:
+                st.session_state["session_token"] = create_session(username)
                 st.session_state["logged_in"] = True
                 st.session_state["username"] = username
-                st.session_state["role"] = users[username]["role"]
+                st.session_state["role"] = user["role"]
                 st.rerun()
             else:
                 st.error("Invalid credentials")
@@ -382,6 +162,9 @@ def login():
             st.rerun()
 
 def main():
+    # Logins are backed by a server-side session; drop any that expired or was revoked
+    if st.session_state.get("logged_in") and get_session(st.session_state.get("session_token")) is None:
+        st.session_state.clear()
     if "logged_in" not in st.session_state:
         st.session_state["logged_in"] = False
     if "page" not in st.session_state:
@@ -439,8 +222,8 @@ def main():
         st.markdown("<h1>Interactive Sales Dashboard</h1>", unsafe_allow_html=True)
         st.markdown(f"<p>Welcome, {st.session_state['username']} ({st.session_state['role']})</p>", unsafe_allow_html=True)
 
-    # Load Data from SQL
-    df = fetch_data()
+    # Filter choices come from a small cached summary, not the full table
+    options = get_filter_options()
     
     # Sidebar: Navigation and Filters
     with st.sidebar:
@@ -454,19 +237,21 @@ def main():
                 st.rerun()
 
         st.markdown("<h2>Filters</h2>", unsafe_allow_html=True)
-        start_date = st.date_input("Start Date", df["InvoiceDate"].min())
-        end_date = st.date_input("End Date", df["InvoiceDate"].max())
+        start_date = st.date_input("Start Date", options["min_date"])
+        end_date = st.date_input("End Date", options["max_date"])
 
         st.markdown("<h2>Drill-down Reports</h2>", unsafe_allow_html=True)
-        selected_retailer = st.selectbox("Select a Retailer", ["All"] + list(df["Retailer"].unique()))
-        selected_state = st.selectbox("Select a State", ["All"] + list(df["State"].unique()))
-
-    # Filter Data
-    filtered_df = df[(df["InvoiceDate"] >= pd.to_datetime(start_date)) & (df["InvoiceDate"] <= pd.to_datetime(end_date))]
-    if selected_retailer != "All":
-        filtered_df = filtered_df[filtered_df["Retailer"] == selected_retailer]
-    if selected_state != "All":
-        filtered_df = filtered_df[filtered_df["State"] == selected_state]
+        selected_retailer = st.selectbox("Select a Retailer", ["All"] + options["Retailer"])
+        selected_state = st.selectbox("Select a State", ["All"] + options["State"])
+
+    # Filters applied in SQLite to the daily rollup
+    filters = {
+        "start_date": start_date,
+        "end_date": end_date,
+        "Retailer": [selected_retailer] if selected_retailer != "All" else None,
+        "State": [selected_state] if selected_state != "All" else None,
+    }
+    totals = aggregate_sales(filters=filters).iloc[0]
 
     # Main Content
     st.markdown("<h2>Sales Overview</h2>", unsafe_allow_html=True)
@@ -474,35 +259,36 @@ def main():
     # Key Metrics
     col1, col2, col3, col4 = st.columns(4)
     with col1:
-        st.metric("Total Sales", f"${filtered_df['TotalSales'].sum():,.2f}")
+        st.metric("Total Sales", f"${totals['TotalSales']:,.2f}")
     with col2:
-        st.metric("Units Sold", f"{filtered_df['UnitsSold'].sum():,}")
+        st.metric("Units Sold", f"{int(totals['UnitsSold']):,}")
     with col3:
-        st.metric("Average Sale", f"${filtered_df['TotalSales'].mean():,.2f}")
+        st.metric("Average Sale", f"${totals['AverageSale']:,.2f}")
     with col4:
-        st.metric("Number of Transactions", f"{len(filtered_df):,}")
+        st.metric("Number of Transactions", f"{int(totals['Transactions']):,}")
 
     # Charts
     col1, col2 = st.columns(2)
     with col1:
-        fig = px.bar(filtered_df, x="Retailer", y="TotalSales", title="Total Sales by Retailer")
+        retailer_sales = aggregate_sales(["Retailer"], filters)[["Retailer", "TotalSales"]]
+        fig = px.bar(retailer_sales, x="Retailer", y="TotalSales", title="Total Sales by Retailer")
         fig.update_layout(template='plotly')
-        st.plotly_chart(fig, use_container_width=True)
+        show_chart(fig)
 
     with col2:
-        filtered_df["Month_Year"] = filtered_df["InvoiceDate"].dt.to_period("M").astype(str)
-        result = filtered_df.groupby("Month_Year")["TotalSales"].sum().reset_index()
+        result = aggregate_sales(["Month"], filters)[["Month", "TotalSales"]]
+        result = result.rename(columns={"Month": "Month_Year"})
         result["Month_Year"] = pd.to_datetime(result["Month_Year"])
         result = result.sort_values("Month_Year")
         result["Month_Year"] = result["Month_Year"].dt.strftime("%b'%y")
         
         fig1 = px.line(result, x="Month_Year", y="TotalSales", title="Total Sales Over Time")
         fig1.update_layout(template='plotly')
-        st.plotly_chart(fig1, use_container_width=True)
+        show_chart(fig1)
 
     # Regional Analysis
     st.markdown("<h2>Regional Analysis</h2>", unsafe_allow_html=True)
-    result1 = filtered_df.groupby("State")[["TotalSales", "UnitsSold"]].sum().reset_index()
+    result1 = aggregate_sales(["State"], filters)
     fig3 = go.Figure()
     fig3.add_trace(go.Bar(x=result1["State"], y=result1["TotalSales"], name="Total Sales"))
     fig3.add_trace(go.Scatter(x=result1["State"], y=result1["UnitsSold"], mode="lines", name="Units Sold", yaxis="y2"))
@@ -513,11 +299,11 @@ def main():
         yaxis_title="Total Sales",
         yaxis2=dict(title="Units Sold", overlaying="y", side="right")
     )
-    st.plotly_chart(fig3, use_container_width=True)
+    show_chart(fig3)
 
     # Treemap
     st.markdown("<h2>Regional Sales Distribution</h2>", unsafe_allow_html=True)
-    treemap = df[["Region", "City", "TotalSales"]].groupby(by=["Region", "City"])["TotalSales"].sum().reset_index()
+    treemap = aggregate_sales(["Region", "City"])[["Region", "City", "TotalSales"]]
     fig_treemap = px.treemap(
         treemap,
         path=["Region", "City"],
@@ -527,7 +313,7 @@ def main():
         color_continuous_scale="blues"
     )
     fig_treemap.update_layout(template='plotly')
-    st.plotly_chart(fig_treemap, use_container_width=True)
+    show_chart(fig_treemap)
 
     # Admin Features
     if st.session_state["role"] == "Admin":
@@ -535,24 +321,34 @@ def main():
         
         col1, col2 = st.columns(2)
         with col1:
-            profit_data = filtered_df.groupby("Retailer")["OperatingProfit"].sum().reset_index()
+            profit_data = aggregate_sales(["Retailer"], filters)[["Retailer", "OperatingProfit"]]
             fig6 = px.bar(profit_data, x="Retailer", y="OperatingProfit", title="Operating Profit by Retailer")
             fig6.update_layout(template='plotly')
-            st.plotly_chart(fig6, use_container_width=True)
+            show_chart(fig6)
 
         with col2:
-            df_prophet = filtered_df.groupby("InvoiceDate")["TotalSales"].sum().reset_index()
-            df_prophet.columns = ["ds", "y"]
-            model = Prophet()
-            model.fit(df_prophet)
-            future = model.make_future_dataframe(periods=90)
-            forecast = model.predict(future)
-            fig5 = px.line(forecast, x="ds", y="yhat", title="Sales Forecast for Next 3 Months")
-            fig5.update_layout(template='plotly')
-            st.plotly_chart(fig5, use_container_width=True)
+            # Drill-downs are precomputed by batch_forecast.py; other selections are
+            # fitted in the background and cached per filter selection and data version
+            forecast, status = get_batch_forecast(filters)
+            if forecast is None:
+                forecast, status = get_forecast(filters)
+            if forecast is None:
+                if status == NO_DATA:
+                    st.info("There are not enough sales in this selection to forecast.")
+                elif status == FAILED:
+                    st.warning("The sales forecast could not be computed for this selection.")
+                else:
+                    st.info("The sales forecast is being prepared in the background. Refresh in a moment.")
+            else:
+                fig5 = px.line(forecast, x="ds", y="yhat", title="Sales Forecast for Next 3 Months")
+                fig5.update_layout(template='plotly')
+                show_chart(fig5)
+                if status == STALE:
+                    st.caption("This forecast was fitted before the latest data changes.")
 
     # Logout Button
     if st.button("Logout", use_container_width=True):
+        end_session(st.session_state.get("session_token"))
         st.session_state.clear()
         st.rerun()
 
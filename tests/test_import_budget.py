@@ -0,0 +1,19 @@
+"""Fail the test run when the login screen imports the dashboard's dependencies.
+
+Runs the check of benchmarks/import_budget.py in a fresh interpreter, as a
+regression gate: ``python -m pytest tests``. Import times are not asserted;
+they vary too much between runs.
+"""
+import os
+
+import pytest
+
+from benchmarks.import_budget import heavy_imports
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_login_screen_skips_heavy_imports(monkeypatch):
+    # Measured on top of streamlit, so it needs the real package
+    pytest.importorskip("streamlit")
+    monkeypatch.chdir(REPO_ROOT)
+    assert heavy_imports("final") == []
@@ -0,0 +1,19 @@
+"""Checks of how ingest.py parses retailer files."""
+import io
+
+from ingest import coerce_chunk, read_chunks
+
+def test_mixed_date_formats_in_one_chunk():
+    csv = io.StringIO(
+        "Retailer,Retailer ID,Invoice Date,Product,Price per Unit,Units Sold\n"
+        "Walmart,1128299,1/5/2022,Men's Street Footwear,$50.00,10\n"
+        "Walmart,1128299,2022-01-06,Men's Street Footwear,$50.00,12\n"
+        "Walmart,1128299,2022-01-07 14:30:00,Men's Street Footwear,$50.00,8\n"
+        "Walmart,1128299,not a date,Men's Street Footwear,$50.00,8\n"
+    )
+    rows, invalid = coerce_chunk(next(read_chunks(csv)))
+    assert rows["InvoiceDate"].tolist() == [
+        "2022-01-05 00:00:00", "2022-01-06 00:00:00", "2022-01-07 14:30:00",
+    ]
+    assert invalid.index.tolist() == [3]
+    assert invalid.loc[3, "InvoiceDate"]
@@ -0,0 +1,213 @@
+"""Dashboard users and login sessions, stored in the sales database.
+
+Accounts live in the ``users`` table (see migrate.py), looked up by their
+primary key, so every call touches one row however many users there are.
+Passwords and reset tokens are never stored: passwords are kept as salted
+PBKDF2 hashes and tokens as SHA-256 digests, and both are checked in
+constant time. Logins are tracked in the ``sessions`` table, so a session
+can expire or be revoked on the server.
+"""
+import hashlib
+import hmac
+import logging
+import secrets
+import time
+
+from db import get_connection
+
+logger = logging.getLogger(__name__)
+
+# Accounts created before the users table existed; imported once by migrate.py
+USER_DB = "users.json"
+
+# PBKDF2 work factor for new hashes. Hashes with fewer iterations are
+# upgraded on the next successful login, so this can be raised at any time.
+PBKDF2_ITERATIONS = 600_000
+
+SESSION_TTL_SECONDS = 12 * 60 * 60
+
+# Fields of update_user's ``changes``, mapped to the columns they are stored in
+_UPDATABLE = {
+    "password": "password_hash",
+    "role": "role",
+    "reset_token": "reset_token_hash",
+    "reset_token_expiry": "reset_token_expiry",
+}
+
+def hash_password(password, iterations=PBKDF2_ITERATIONS):
+    """Return 'pbkdf2_sha256$<iterations>$<salt>$<hash>' for ``password``."""
+    salt = secrets.token_bytes(16)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+    return f"pbkdf2_sha256${iterations}${salt.hex()}${digest.hex()}"
+
+def _parse_hash(password_hash):
+    """Return (iterations, salt, expected hex digest) of a stored hash, or None if it is malformed."""
+    try:
+        algorithm, iterations, salt, expected = password_hash.split("$")
+        iterations, salt = int(iterations), bytes.fromhex(salt)
+    except (AttributeError, ValueError):
+        return None
+    if algorithm != "pbkdf2_sha256" or iterations < 1:
+        return None
+    return iterations, salt, expected
+
+def verify_password(password, password_hash):
+    """Check ``password`` against a hash from hash_password in constant time.
+
+    Malformed hashes never match.
+    """
+    parsed = _parse_hash(password_hash)
+    if parsed is None:
+        return False
+    iterations, salt, expected = parsed
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+    return hmac.compare_digest(digest.hex(), expected)
+
+# Verified when the username is unknown, so that the response time does not
+# reveal which usernames exist. Created on first use to keep imports cheap.
+_dummy_hash = None
+
+def _token_hash(token):
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+def get_user(username):
+    """Return {"username", "role"} for the user, or None if there is no such user."""
+    conn = get_connection()
+    try:
+        row = conn.execute("SELECT username, role FROM users WHERE username = ?", (username,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    return {"username": row[0], "role": row[1]}
+
+def user_exists(username):
+    return get_user(username) is not None
+
+def add_user(username, password, role):
+    """Register a new user; return False if the username is taken."""
+    conn = get_connection()
+    try:
+        with conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO users (username, password_hash, role) VALUES (?, ?, ?)",
+                (username, hash_password(password), role),
+            )
+    finally:
+        conn.close()
+    if cursor.rowcount == 0:
+        return False
+    logger.info(f"Registered user {username}")
+    return True
+
+def update_user(username, changes=None, remove=()):
+    """Set the fields in ``changes`` and clear those in ``remove`` for one user.
+
+    Fields are "password", "role", "reset_token" and "reset_token_expiry";
+    passwords and tokens are hashed before they are stored. Returns False if
+    the user does not exist.
+    """
+    values = {}
+    for field, value in (changes or {}).items():
+        if field == "password":
+            value = hash_password(value)
+        elif field == "reset_token":
+            value = _token_hash(value)
+        values[_UPDATABLE[field]] = value
+    for field in remove:
+        values[_UPDATABLE[field]] = None
+    if not values:
+        return user_exists(username)
+
+    assignments = ", ".join(f"{column} = ?" for column in values)
+    conn = get_connection()
+    try:
+        with conn:
+            cursor = conn.execute(
+                f"UPDATE users SET {assignments} WHERE username = ?",
+                list(values.values()) + [username],
+            )
+    finally:
+        conn.close()
+    return cursor.rowcount > 0
+
+def check_password(username, password):
+    """Return the user if ``password`` is correct, otherwise None."""
+    global _dummy_hash
+    conn = get_connection()
+    try:
+        row = conn.execute(
+            "SELECT role, password_hash FROM users WHERE username = ?", (username,)
+        ).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        if _dummy_hash is None:
+            _dummy_hash = hash_password(secrets.token_hex(16))
+        verify_password(password, _dummy_hash)
+        return None
+    role, password_hash = row
+    if not verify_password(password, password_hash):
+        return None
+
+    if _parse_hash(password_hash)[0] < PBKDF2_ITERATIONS:
+        update_user(username, {"password": password})
+    return {"username": username, "role": role}
+
+def check_reset_token(username, token):
+    """Return True if ``token`` is the user's unexpired password reset token."""
+    conn = get_connection()
+    try:
+        row = conn.execute(
+            "SELECT reset_token_hash, reset_token_expiry FROM users WHERE username = ?", (username,)
+        ).fetchone()
+    finally:
+        conn.close()
+    if row is None or row[0] is None:
+        return False
+    token_hash, expiry = row
+    return hmac.compare_digest(_token_hash(token), token_hash) and time.time() < expiry
+
+def create_session(username, ttl_seconds=SESSION_TTL_SECONDS):
+    """Start a session for ``username`` and return its token."""
+    token = secrets.token_urlsafe(32)
+    now = time.time()
+    conn = get_connection()
+    try:
+        with conn:
+            conn.execute("DELETE FROM sessions WHERE expires_at < ?", (now,))
+            conn.execute(
+                "INSERT INTO sessions (token_hash, username, expires_at) VALUES (?, ?, ?)",
+                (_token_hash(token), username, now + ttl_seconds),
+            )
+    finally:
+        conn.close()
+    return token
+
+def get_session(token):
+    """Return the user of an unexpired session, or None."""
+    if not token:
+        return None
+    conn = get_connection()
+    try:
+        row = conn.execute("""
+            SELECT users.username, users.role
+            FROM sessions JOIN users ON users.username = sessions.username
+            WHERE sessions.token_hash = ? AND sessions.expires_at >= ?
+        """, (_token_hash(token), time.time())).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    return {"username": row[0], "role": row[1]}
+
+def end_session(token):
+    """Revoke a session, e.g. on logout."""
+    if not token:
+        return
+    conn = get_connection()
+    try:
+        with conn:
+            conn.execute("DELETE FROM sessions WHERE token_hash = ?", (_token_hash(token),))
+    finally:
+        conn.close()